@@ -282,6 +282,20 @@ def decoder(session, config):
     session.run(*options('test_decoder', config))
 
 
+@nox.session
+@add_session_config
+def benchmark(session, config):
+    '''Run the benchmark suite, save the results as JSON.'''
+    output = os.path.abspath(config.get('output', 'benchmark.json'))
+    argv = ['python', 'benchmark/suite.py', '--output', output]
+    if config.get('quick'):
+        argv.append('--quick')
+    if config.get('compare'):
+        argv.extend(('--compare', os.path.abspath(config['compare'])))
+    setup_venv_dev(session)
+    session.run(*argv)
+
+
 @nox.session
 @add_session_config
 def integration(session, config):
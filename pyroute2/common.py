@@ -2,6 +2,7 @@
 '''
 Common utilities
 '''
+import collections
 import errno
 import io
 import os
@@ -371,6 +372,77 @@ class AddrPool(object):
                 self.addr_map[base] ^= 1 << bit
 
 
+class SeqPool(object):
+    '''
+    Sequence number pool
+
+    The same API as `AddrPool`, but both `alloc()` and `free()`
+    are O(1), so the pool may cover the whole 32 bit space. Never
+    used numbers come from a counter, released ones are reused in
+    the FIFO order.
+
+    `free(addr, ban=N)` puts the number into quarantine until at
+    least N more numbers are allocated. With `quarantine=T` every
+    released number also stays in quarantine at least T seconds.
+    '''
+
+    def __init__(self, minaddr=0xFF, maxaddr=0xFFFF, quarantine=0):
+        self.minaddr = minaddr
+        self.maxaddr = maxaddr
+        self.quarantine = quarantine
+        self.counter = minaddr
+        self.generation = 0
+        self.allocated = set()
+        self.released = collections.deque()
+        # (generation, time, addr)
+        self.ban = collections.deque()
+        self.lock = threading.RLock()
+
+    def alloc(self):
+        with self.lock:
+            self.generation += 1
+            if self.ban:
+                now = time.monotonic() if self.quarantine else 0
+                while (
+                    self.ban
+                    and self.ban[0][0] < self.generation
+                    and self.ban[0][1] <= now
+                ):
+                    self.released.append(self.ban.popleft()[2])
+            if self.released:
+                ret = self.released.popleft()
+            elif self.counter <= self.maxaddr:
+                ret = self.counter
+                self.counter += 1
+            else:
+                raise KeyError('no free address available')
+            self.allocated.add(ret)
+            return ret
+
+    def free(self, addr, ban=0):
+        with self.lock:
+            if addr not in self.allocated:
+                # numbers set by the user are not tracked
+                if ban != 0:
+                    return
+                raise KeyError('address is not allocated')
+            self.allocated.remove(addr)
+            if ban != 0 or self.quarantine:
+                self.ban.append(
+                    (
+                        self.generation + ban,
+                        (
+                            time.monotonic() + self.quarantine
+                            if self.quarantine
+                            else 0
+                        ),
+                        addr,
+                    )
+                )
+            else:
+                self.released.append(addr)
+
+
 def fnv1(data):
     '''
     FNV1 -- 32bit hash, python3 version
@@ -470,7 +542,7 @@ def metaclass(mc):
 
 def msg_done(msg):
     newmsg = struct.pack('IHH', 40, 2, 0)
-    newmsg += msg.data[8:16]
+    newmsg += msg.data[msg.offset + 8 : msg.offset + 16]
     newmsg += struct.pack('I', 0)
     # nlmsgerr struct alignment
     newmsg += b'\0' * 20
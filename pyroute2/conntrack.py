@@ -1,12 +1,68 @@
+"""
+Conntrack -- high level connection tracking API
+
+Streaming dumps
+---------------
+
+`Conntrack.dump_entries()` decodes every message completely, and
+may filter the entries again in Python. For large tables use
+`Conntrack.stream_entries()`: the filters are applied by the
+kernel, the entries are decoded right from the receive buffer
+to `ConntrackRecord` objects, and are yielded as they arrive::
+
+    ct = Conntrack()
+    for record in ct.stream_entries(
+        fields=('tuple_orig', 'mark'),
+        tuple_orig=NFCTAttrTuple(proto=socket.IPPROTO_TCP, dport=443),
+    ):
+        print(record.tuple_orig.saddr, record.mark)
+
+Only the fields listed in `fields` are decoded, the rest are
+`None`; by default all the `ConntrackRecord` fields are decoded.
+
+Bulk updates
+------------
+
+`Conntrack.delete_many()` and `Conntrack.update_many()` take an
+iterable of tuples, or the `stream_entries()` filters as `match`.
+The requests are sent without waiting for the ACK on every one,
+and the result has the number of requests and the errors::
+
+    # drain the flows to a backend
+    ret = ct.delete_many(
+        match={'tuple_reply': NFCTAttrTuple(saddr='10.0.0.5')}
+    )
+    print(ret.done, ret.errors)
+
+    # mark the flows to port 443
+    ct.update_many(
+        match={'tuple_orig': NFCTAttrTuple(proto=6, dport=443)},
+        mark=0x10,
+    )
+
+With `match`, the dump and the requests run on the same socket at
+once; the entries are deleted or updated by the tuple and the id, so
+a new entry with the same tuple is not touched.
+"""
+
 import socket
+import struct
+import sys
 
+from pyroute2.netlink import nla_iter, nla_types
 from pyroute2.netlink.nfnetlink.nfctsocket import (
+    CTA_IP_TYPES,
+    CTA_PROTO_TYPES,
+    CTA_TUPLE_TYPES,
+    CTA_TYPES,
     IP_CT_TCP_FLAG_TO_NAME,
     IPSBIT_TO_NAME,
     TCP_CONNTRACK_TO_NAME,
     NFCTAttrTuple,
     NFCTSocket,
+    nfct_msg,
 )
+from pyroute2.netlink.nlsocket import NetlinkPipeline
 
 
 class NFCTATcpProtoInfo(object):
@@ -118,6 +174,220 @@ class ConntrackEntry(object):
         return s
 
 
+class ConntrackRecord(object):
+    """
+    A conntrack entry from `Conntrack.stream_entries()`.
+
+    The fields not decoded or not reported by the kernel are `None`.
+    Counters are `(packets, bytes)` pairs.
+    """
+
+    __slots__ = (
+        'family',
+        'tuple_orig',
+        'tuple_reply',
+        'status',
+        'protoinfo',
+        'timeout',
+        'mark',
+        'counters_orig',
+        'counters_reply',
+        'use',
+        'id',
+        'zone',
+        'labels',
+    )
+
+    def __init__(self, family):
+        self.family = family
+        self.tuple_orig = None
+        self.tuple_reply = None
+        self.status = None
+        self.protoinfo = None
+        self.timeout = None
+        self.mark = None
+        self.counters_orig = None
+        self.counters_reply = None
+        self.use = None
+        self.id = None
+        self.zone = None
+        self.labels = None
+
+    def status_name(self):
+        if self.status is None:
+            return ''
+        return ConntrackEntry.status_name(self)
+
+    def __repr__(self):
+        return 'Record({})'.format(
+            ', '.join(
+                '{}={}'.format(x, getattr(self, x))
+                for x in self.__slots__[1:]
+                if getattr(self, x) is not None
+            )
+        )
+
+
+def _decode_be16(family, data, offset, end):
+    return struct.unpack_from('>H', data, offset)[0]
+
+
+def _decode_be32(family, data, offset, end):
+    return struct.unpack_from('>I', data, offset)[0]
+
+
+def _decode_tuple(family, data, offset, end):
+    kwargs = {'family': family}
+    for nla_type, start, stop in nla_iter(data, offset, end):
+        if nla_type == _cta_tuple_ip:
+            for ip_type, ip_start, ip_stop in nla_iter(data, start, stop):
+                if ip_type in _ip_fields:
+                    name, ip_family = _ip_fields[ip_type]
+                    kwargs[name] = socket.inet_ntop(
+                        ip_family, bytes(data[ip_start:ip_stop])
+                    )
+        elif nla_type == _cta_tuple_proto:
+            for p_type, p_start, _ in nla_iter(data, start, stop):
+                if p_type in _proto_fields:
+                    name, fmt = _proto_fields[p_type]
+                    kwargs[name] = struct.unpack_from(fmt, data, p_start)[0]
+    return NFCTAttrTuple(**kwargs)
+
+
+def _decode_protoinfo(family, data, offset, end):
+    for nla_type, start, stop in nla_iter(data, offset, end):
+        if nla_type != _cta_protoinfo_tcp:
+            continue
+        kwargs = {}
+        for tcp_type, tcp_start, _ in nla_iter(data, start, stop):
+            if tcp_type in _tcp_fields:
+                name, fmt = _tcp_fields[tcp_type]
+                kwargs[name] = struct.unpack_from(fmt, data, tcp_start)[0]
+        if 'state' in kwargs:
+            return NFCTATcpProtoInfo(**kwargs)
+    return None
+
+
+def _decode_counters(family, data, offset, end):
+    ret = [None, None]
+    for nla_type, start, _ in nla_iter(data, offset, end):
+        if nla_type in _counters_fields:
+            index, fmt = _counters_fields[nla_type]
+            ret[index] = struct.unpack_from(fmt, data, start)[0]
+    return tuple(ret)
+
+
+def _decode_labels(family, data, offset, end):
+    return int.from_bytes(data[offset:end], sys.byteorder)
+
+
+_cta_tuple_ip = CTA_TUPLE_TYPES['CTA_TUPLE_IP']
+_cta_tuple_proto = CTA_TUPLE_TYPES['CTA_TUPLE_PROTO']
+_cta_protoinfo_tcp = nla_types(nfct_msg.cta_protoinfo.nla_map)[
+    'CTA_PROTOINFO_TCP'
+]
+
+# CTA_IP_* -> NFCTAttrTuple argument, address family
+_ip_fields = {
+    CTA_IP_TYPES['CTA_IP_V4_SRC']: ('saddr', socket.AF_INET),
+    CTA_IP_TYPES['CTA_IP_V4_DST']: ('daddr', socket.AF_INET),
+    CTA_IP_TYPES['CTA_IP_V6_SRC']: ('saddr', socket.AF_INET6),
+    CTA_IP_TYPES['CTA_IP_V6_DST']: ('daddr', socket.AF_INET6),
+}
+
+# CTA_PROTO_* -> NFCTAttrTuple arguments
+_proto_fields = {
+    CTA_PROTO_TYPES[name]: value
+    for name, value in (
+        ('CTA_PROTO_NUM', ('proto', 'B')),
+        ('CTA_PROTO_SRC_PORT', ('sport', '>H')),
+        ('CTA_PROTO_DST_PORT', ('dport', '>H')),
+        ('CTA_PROTO_ICMP_ID', ('icmp_id', '>H')),
+        ('CTA_PROTO_ICMP_TYPE', ('icmp_type', 'B')),
+        ('CTA_PROTO_ICMP_CODE', ('icmp_code', 'B')),
+        ('CTA_PROTO_ICMPV6_ID', ('icmp_id', '>H')),
+        ('CTA_PROTO_ICMPV6_TYPE', ('icmp_type', 'B')),
+        ('CTA_PROTO_ICMPV6_CODE', ('icmp_code', 'B')),
+    )
+}
+
+# CTA_PROTOINFO_TCP_* -> NFCTATcpProtoInfo arguments
+_tcp_types = nla_types(nfct_msg.cta_protoinfo.cta_protoinfo_tcp.nla_map)
+_tcp_fields = {
+    _tcp_types[name]: value
+    for name, value in (
+        ('CTA_PROTOINFO_TCP_STATE', ('state', 'B')),
+        ('CTA_PROTOINFO_TCP_WSCALE_ORIGINAL', ('wscale_orig', 'B')),
+        ('CTA_PROTOINFO_TCP_WSCALE_REPLY', ('wscale_reply', 'B')),
+        ('CTA_PROTOINFO_TCP_FLAGS_ORIGINAL', ('flags_orig', 'B')),
+        ('CTA_PROTOINFO_TCP_FLAGS_REPLY', ('flags_reply', 'B')),
+    )
+}
+
+# CTA_COUNTERS_* -> (packets, bytes) index, format
+_counters_types = nla_types(nfct_msg.cta_counters.nla_map)
+_counters_fields = {
+    _counters_types[name]: value
+    for name, value in (
+        ('CTA_COUNTERS_PACKETS', (0, '>Q')),
+        ('CTA_COUNTERS_BYTES', (1, '>Q')),
+        ('CTA_COUNTERS32_PACKETS', (0, '>I')),
+        ('CTA_COUNTERS32_BYTES', (1, '>I')),
+    )
+}
+
+# ConntrackRecord field -> decoder
+_record_decoders = {
+    'tuple_orig': _decode_tuple,
+    'tuple_reply': _decode_tuple,
+    'status': _decode_be32,
+    'protoinfo': _decode_protoinfo,
+    'timeout': _decode_be32,
+    'mark': _decode_be32,
+    'counters_orig': _decode_counters,
+    'counters_reply': _decode_counters,
+    'use': _decode_be32,
+    'id': _decode_be32,
+    'zone': _decode_be16,
+    'labels': _decode_labels,
+}
+
+
+class ConntrackRecordParser(object):
+    """
+    Decode `nfct_msg` buffers to `ConntrackRecord` objects.
+
+    :param fields: the record fields to decode, all by default
+    """
+
+    def __init__(self, fields=None):
+        if fields is None:
+            fields = _record_decoders.keys()
+        self.decoders = {}
+        for field in fields:
+            if field not in _record_decoders:
+                raise ValueError('unsupported field: {}'.format(field))
+            self.decoders[CTA_TYPES['CTA_' + field.upper()]] = (
+                field,
+                _record_decoders[field],
+            )
+
+    def __call__(self, data, offset, length):
+        # nlmsghdr + nfgenmsg
+        family = data[offset + 16]
+        record = ConntrackRecord(family)
+        decoders = self.decoders
+        for nla_type, start, stop in nla_iter(
+            data, offset + 20, offset + length
+        ):
+            decoder = decoders.get(nla_type)
+            if decoder is not None:
+                setattr(
+                    record, decoder[0], decoder[1](family, data, start, stop)
+                )
+        return record
+
+
 class Conntrack(NFCTSocket):
     """
     High level conntrack functions
@@ -174,6 +444,51 @@ class Conntrack(NFCTSocket):
         for res in super(Conntrack, self).entry(cmd, **kwargs):
             return res
 
+    def delete_many(self, entries=None, match=None, window=256, callback=None):
+        """
+        Delete many entries
+
+        :param entries: NFCTAttrTuple, ConntrackEntry or ConntrackRecord
+        :param dict match: or the filters for `stream_entries()`
+
+        Returns `NFCTBulkResult` with the failed entries; ENOENT
+        means the entry is already gone. An optional
+        `callback(entry, error)` is called on every ACK.
+
+        Example::
+            ret = ct.delete_many(match={'mark': 5})
+        """
+        return self._bulk('del', entries, match, window, callback, {})
+
+    def update_many(
+        self, entries=None, match=None, window=256, callback=None, **kwargs
+    ):
+        """
+        Update many entries: `mark`, `mark_mask` or `timeout`
+
+        The entries are the same as for `delete_many()`.
+
+        Example::
+            ret = ct.update_many(match={'mark': 5}, mark=6, timeout=30)
+        """
+        return self._bulk('set', entries, match, window, callback, kwargs)
+
+    def _bulk(self, cmd, entries, match, window, callback, kwargs):
+        if (entries is None) == (match is None):
+            raise ValueError('either entries or match required')
+        if match is not None:
+            entries = self.stream_entries(
+                fields=('tuple_orig', 'id', 'zone'), **match
+            )
+            # leave the socket buffer space for the dump
+            window = min(
+                window,
+                self.asyncore.status['rcvbuf']
+                // 2
+                // NetlinkPipeline.ack_size,
+            )
+        return self.entry_many(cmd, entries, window, callback, **kwargs)
+
     def dump_entries(
         self,
         mark=None,
@@ -228,3 +543,45 @@ class Conntrack(NFCTSocket):
                 ndmsg.get_attr('CTA_ID'),
                 ndmsg.get_attr('CTA_USE'),
             )
+
+    def stream_entries(
+        self,
+        fields=None,
+        mark=None,
+        mark_mask=0xFFFFFFFF,
+        tuple_orig=None,
+        tuple_reply=None,
+        status=None,
+        status_mask=None,
+    ):
+        """
+        Dump entries from conntrack table as `ConntrackRecord`
+
+        All the filters are applied by the kernel, see
+        `NFCTSocket.dump()` for the supported kernel versions.
+
+        :param fields: decode only these `ConntrackRecord` fields
+
+        Examples::
+            # mark of every entry to 8.8.8.8
+            for record in ct.stream_entries(
+                fields=('mark',),
+                tuple_orig=NFCTAttrTuple(daddr='8.8.8.8'),
+            ):
+                print(record.mark)
+
+            # unreplied connections
+            for record in ct.stream_entries(
+                status=0, status_mask=IPS_SEEN_REPLY
+            ):
+                print(record.tuple_orig)
+        """
+        return self.dump_stream(
+            parser=ConntrackRecordParser(fields),
+            mark=mark,
+            mark_mask=mark_mask,
+            tuple_orig=tuple_orig,
+            tuple_reply=tuple_reply,
+            status=status,
+            status_mask=status_mask,
+        )
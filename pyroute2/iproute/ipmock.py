@@ -1,39 +1,120 @@
+'''
+Mock RTNL engine
+================
+
+`IPEngine` is a network objects database with the socket API, that
+can be used instead of a low level RTNL socket to run `IPRoute` and
+`NDB` without root privileges, e.g. in CI containers. With
+`config.mock_netlink = True` RTNL sockets use it automatically.
+
+Every engine starts with a copy of a preset, selected by the netns
+name: `default` for the main netns, and a copy of `netns` for any
+other name. Bigger presets can be generated with `generate()`::
+
+    from pyroute2 import IPRoute
+    from pyroute2.iproute.ipmock import IPEngine, generate, presets
+
+    presets['bench'] = generate(links=100, addresses=1000, routes=100000)
+    with IPRoute(use_socket=IPEngine(netns='bench')) as ipr:
+        routes = ipr.get_routes()
+
+The objects are stored in dicts hashed by the object keys, with
+secondary indices where the requests need them, and every object
+caches its encoded message, so dumps just copy the bytes. The dump
+datagrams are generated lazily while the socket is read, like the
+kernel does. Presets are copied on write, so starting an engine with
+a big preset is cheap.
+
+To test the event handling under load, `IPEngine.storm()` sends
+a series of synthetic broadcast events to all the bound sockets.
+'''
+
 import copy
 import errno
+import ipaddress
 import os
 import socket
 import struct
 import threading
+from collections import deque
 from itertools import count
 
 from pyroute2.config import AF_NETLINK
 from pyroute2.netlink import (
+    NLM_F_CREATE,
     NLM_F_DUMP,
+    NLM_F_EXCL,
     NLM_F_MULTI,
     NLMSG_DONE,
+    NLMSG_ERROR,
     nlmsg,
     nlmsgerr,
 )
 from pyroute2.netlink.core import Stats
 from pyroute2.netlink.rtnl import (
     RTM_DELADDR,
+    RTM_DELLINK,
+    RTM_DELNEIGH,
     RTM_DELROUTE,
+    RTM_DELRULE,
     RTM_GETADDR,
     RTM_GETLINK,
+    RTM_GETNEIGH,
     RTM_GETROUTE,
+    RTM_GETRULE,
     RTM_NEWADDR,
     RTM_NEWLINK,
+    RTM_NEWNEIGH,
     RTM_NEWROUTE,
+    RTM_NEWRULE,
 )
+from pyroute2.netlink.rtnl.fibmsg import fibmsg
 from pyroute2.netlink.rtnl.ifaddrmsg import ifaddrmsg
 from pyroute2.netlink.rtnl.ifinfmsg import ifinfmsg
 from pyroute2.netlink.rtnl.marshal import MarshalRtnl
+from pyroute2.netlink.rtnl.ndmsg import ndmsg
 from pyroute2.netlink.rtnl.rtmsg import rtmsg
 
 interface_counter = count(3)
 
 
-class MockLink:
+class MockObject:
+    '''
+    The base class for mock objects. The objects must not be
+    changed in place when stored in a `MockTable`, since tables
+    share objects; use `MockTable.update()` instead.
+    '''
+
+    msg_class = None
+    _encoded = None
+
+    def key(self):
+        raise NotImplementedError()
+
+    def encode(self):
+        '''
+        Return the object encoded as a dump message with zero
+        sequence number. The result is cached until the next
+        `update_from_msg()`.
+        '''
+        if self._encoded is None:
+            msg = self.msg_class()
+            msg.load(self.export())
+            msg['header']['flags'] = NLM_F_MULTI
+            msg['header']['sequence_number'] = 0
+            msg.encode()
+            self._encoded = bytes(msg.data)
+        return self._encoded
+
+    def message(self):
+        msg = self.msg_class()
+        msg.load(self.export())
+        return msg
+
+
+class MockLink(MockObject):
+    msg_class = ifinfmsg
+
     def __init__(
         self,
         index=0,
@@ -76,7 +157,11 @@ class MockLink:
         self.br_forward_delay = br_forward_delay
         self.alt_ifname_list = alt_ifname_list or []
 
+    def key(self):
+        return self.index
+
     def update_from_msg(self, msg):
+        self._encoded = None
         [
             setattr(self, x, msg.get(x))
             for x in ['address', 'broadcast', 'mtu', 'ifname', 'master']
@@ -278,7 +363,9 @@ class MockLink:
         return ret
 
 
-class MockAddress:
+class MockAddress(MockObject):
+    msg_class = ifaddrmsg
+
     def __init__(
         self,
         index=0,
@@ -298,7 +385,11 @@ class MockAddress:
         self.label = label
         self.family = family
 
+    def key(self):
+        return (self.index, self.address, self.prefixlen)
+
     def update_from_msg(self, msg):
+        self._encoded = None
         [
             setattr(self, x, msg.get(x))
             for x in ['index', 'address', 'broadcast', 'prefixlen']
@@ -351,7 +442,9 @@ class MockAddress:
         return ret
 
 
-class MockRoute:
+class MockRoute(MockObject):
+    msg_class = rtmsg
+
     def __init__(
         self,
         dst=None,
@@ -380,7 +473,18 @@ class MockRoute:
         self.tos = kwarg.get('tos', 0)
         self._type = kwarg.get('type', 2)
 
+    def key(self):
+        return (
+            self.dst,
+            self.dst_len,
+            self.oif,
+            self.priority,
+            self.gateway,
+            self.table,
+        )
+
     def update_from_msg(self, msg):
+        self._encoded = None
         [
             setattr(self, x, msg.get(x))
             for x in [
@@ -436,6 +540,183 @@ class MockRoute:
         return ret
 
 
+class MockNeighbour(MockObject):
+    msg_class = ndmsg
+
+    def __init__(
+        self,
+        ifindex=0,
+        dst=None,
+        lladdr=None,
+        family=2,
+        state=2,
+        flags=0,
+        ndm_type=1,
+        **kwarg,
+    ):
+        self.ifindex = ifindex
+        self.dst = dst
+        self.lladdr = lladdr
+        self.family = family
+        self.state = state
+        self.flags = flags
+        self.ndm_type = ndm_type
+
+    def key(self):
+        return (self.ifindex, self.dst)
+
+    def update_from_msg(self, msg):
+        self._encoded = None
+        [
+            setattr(self, x, msg.get(x))
+            for x in ['ifindex', 'dst', 'lladdr', 'family', 'state', 'flags']
+            if msg.get(x) is not None
+        ]
+
+    @classmethod
+    def load_from_msg(cls, msg):
+        ret = cls()
+        ret.update_from_msg(msg)
+        return ret
+
+    def export(self):
+        ret = {
+            'family': self.family,
+            'ifindex': self.ifindex,
+            'state': self.state,
+            'flags': self.flags,
+            'ndm_type': self.ndm_type,
+            'attrs': [('NDA_DST', self.dst)],
+            'header': {
+                'length': 76,
+                'type': 28,
+                'flags': 2,
+                'sequence_number': 255,
+                'pid': 325359,
+                'error': None,
+                'target': 'localhost',
+                'stats': Stats(qsize=0, delta=0, delay=0),
+            },
+            'event': 'RTM_NEWNEIGH',
+        }
+        if self.lladdr is not None:
+            ret['attrs'].append(('NDA_LLADDR', self.lladdr))
+        ret['attrs'].append(
+            (
+                'NDA_CACHEINFO',
+                {
+                    'ndm_confirmed': 0,
+                    'ndm_used': 0,
+                    'ndm_updated': 0,
+                    'ndm_refcnt': 0,
+                },
+            )
+        )
+        ret['attrs'].append(('NDA_PROBES', 0))
+        return ret
+
+
+class MockRule(MockObject):
+    msg_class = fibmsg
+
+    def __init__(
+        self,
+        priority=0,
+        table=254,
+        family=2,
+        action=1,
+        src=None,
+        src_len=0,
+        dst=None,
+        dst_len=0,
+        **kwarg,
+    ):
+        self.priority = priority
+        self.table = table
+        self.family = family
+        self.action = action
+        self.src = src
+        self.src_len = src_len
+        self.dst = dst
+        self.dst_len = dst_len
+
+    def key(self):
+        return (
+            self.family,
+            self.priority,
+            self.table,
+            self.src,
+            self.src_len,
+            self.dst,
+            self.dst_len,
+        )
+
+    def update_from_msg(self, msg):
+        self._encoded = None
+        [
+            setattr(self, x, msg.get(x))
+            for x in [
+                'priority',
+                'table',
+                'family',
+                'action',
+                'src',
+                'src_len',
+                'dst',
+                'dst_len',
+            ]
+            if msg.get(x) is not None
+        ]
+
+    @classmethod
+    def load_from_msg(cls, msg):
+        ret = cls()
+        ret.update_from_msg(msg)
+        return ret
+
+    def export(self):
+        ret = {
+            'family': self.family,
+            'dst_len': self.dst_len,
+            'src_len': self.src_len,
+            'tos': 0,
+            'table': self.table if self.table <= 255 else 252,
+            'action': self.action,
+            'flags': 0,
+            'attrs': [
+                ('FRA_TABLE', self.table),
+                ('FRA_SUPPRESS_PREFIXLEN', 0xFFFFFFFF),
+                ('FRA_PROTOCOL', 2 if self.priority else 0),
+            ],
+            'header': {
+                'length': 60,
+                'type': 32,
+                'flags': 2,
+                'sequence_number': 255,
+                'pid': 325359,
+                'error': None,
+                'target': 'localhost',
+                'stats': Stats(qsize=0, delta=0, delay=0),
+            },
+            'event': 'RTM_NEWRULE',
+        }
+        if self.priority:
+            ret['attrs'].append(('FRA_PRIORITY', self.priority))
+        if self.src is not None:
+            ret['attrs'].append(('FRA_SRC', self.src))
+        if self.dst is not None:
+            ret['attrs'].append(('FRA_DST', self.dst))
+        return ret
+
+
+def default_rules():
+    return [
+        MockRule(priority=0, table=255),
+        MockRule(priority=32766, table=254),
+        MockRule(priority=32767, table=253),
+    ]
+
+
 presets = {
     'default': {
         'links': [
@@ -518,6 +799,12 @@ presets = {
                 route_type=3,
             ),
         ],
+        'neighbours': [
+            MockNeighbour(
+                ifindex=2, dst='192.168.122.1', lladdr='52:54:00:1d:d7:49'
+            )
+        ],
+        'rules': default_rules(),
     },
     'netns': {
         'links': [
@@ -558,18 +845,249 @@ presets = {
                 route_type=3,
             ),
         ],
+        'neighbours': [],
+        'rules': default_rules(),
     },
 }
 
 
+def synthetic_links(count, start=3):
+    return [
+        MockLink(
+            index=start + x,
+            ifname=f'mock{start + x}',
+            address='02:00:%02x:%02x:%02x:%02x'
+            % tuple((start + x).to_bytes(4, 'big')),
+            mtu=1500,
+            kind='dummy',
+        )
+        for x in range(count)
+    ]
+
+
+def synthetic_addresses(count, links):
+    # 100.64.0.0/10
+    base = int(ipaddress.IPv4Address('100.64.0.1'))
+    return [
+        MockAddress(
+            index=links[x % len(links)],
+            address=str(ipaddress.IPv4Address(base + x)),
+            prefixlen=32,
+        )
+        for x in range(count)
+    ]
+
+
+def synthetic_routes(count, links):
+    # 10.0.0.0/8
+    base = int(ipaddress.IPv4Address('10.0.0.0'))
+    return [
+        MockRoute(
+            dst=str(ipaddress.IPv4Address(base + x)),
+            oif=links[x % len(links)],
+            dst_len=32,
+        )
+        for x in range(count)
+    ]
+
+
+def synthetic_neighbours(count, links):
+    # 172.16.0.0/12
+    base = int(ipaddress.IPv4Address('172.16.0.1'))
+    return [
+        MockNeighbour(
+            ifindex=links[x % len(links)],
+            dst=str(ipaddress.IPv4Address(base + x)),
+            lladdr='02:01:%02x:%02x:%02x:%02x' % tuple(x.to_bytes(4, 'big')),
+        )
+        for x in range(count)
+    ]
+
+
+def synthetic_rules(count):
+    return [MockRule(priority=1000 + x, table=1000 + x) for x in range(count)]
+
+
+def generate(
+    links=0, addresses=0, routes=0, neighbours=0, rules=0, base='default'
+):
+    '''
+    Return a new preset: a copy of the `base` preset with synthetic
+    objects added. The addresses, routes and neighbours are spread
+    over the new links, or over the base links if `links` is 0::
+
+        presets['bench'] = generate(links=10, routes=100000)
+        ipe = IPEngine(netns='bench')
+    '''
+    ret = copy.deepcopy(presets[base])
+    for table in IPEngine.tables:
+        ret.setdefault(table, [])
+    start = max([x.index for x in ret['links']] + [0]) + 1
+    new_links = synthetic_links(links, start)
+    ret['links'].extend(new_links)
+    targets = [x.index for x in (new_links or ret['links'])]
+    ret['addr'].extend(synthetic_addresses(addresses, targets))
+    ret['routes'].extend(synthetic_routes(routes, targets))
+    ret['neighbours'].extend(synthetic_neighbours(neighbours, targets))
+    ret['rules'].extend(synthetic_rules(rules))
+    return ret
+
+
+class MockTable:
+    '''
+    Mock objects hashed by `key()`, with secondary indices defined
+    as `{name: function(object) -> value}`.
+
+    `copy()` shares the objects between the tables, so the objects
+    must be replaced, not changed in place; see `update()`.
+    '''
+
+    def __init__(self, objects=(), indices=None):
+        self.functions = indices or {}
+        self.objects = {}
+        self.indices = {x: {} for x in self.functions}
+        for obj in objects:
+            self.add(obj)
+
+    def copy(self):
+        ret = type(self)(indices=self.functions)
+        ret.objects = dict(self.objects)
+        ret.indices = {
+            name: {value: dict(keys) for value, keys in index.items()}
+            for name, index in self.indices.items()
+        }
+        return ret
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __iter__(self):
+        # iterate a snapshot, the table may change during a dump
+        return iter(tuple(self.objects.values()))
+
+    def __contains__(self, key):
+        return key in self.objects
+
+    def get(self, key, default=None):
+        return self.objects.get(key, default)
+
+    def lookup(self, name, value):
+        return [self.objects[x] for x in self.indices[name].get(value, ())]
+
+    def add(self, obj):
+        key = obj.key()
+        if key in self.objects:
+            self.remove(key)
+        self.objects[key] = obj
+        for name, function in self.functions.items():
+            self.indices[name].setdefault(function(obj), {})[key] = None
+        return obj
+
+    def remove(self, key):
+        obj = self.objects.pop(key)
+        for name, function in self.functions.items():
+            value = function(obj)
+            bucket = self.indices[name][value]
+            del bucket[key]
+            if not bucket:
+                del self.indices[name][value]
+        return obj
+
+    def update(self, key, msg):
+        obj = copy.copy(self.objects[key])
+        obj.update_from_msg(msg)
+        self.remove(key)
+        return self.add(obj)
+
+
+class MockChannel:
+    '''
+    A queue of datagrams with a file descriptor to poll: the fd is
+    readable while the queue is not empty. The queue items are
+    bytes, or iterators that generate datagrams on demand.
+    '''
+
+    def __init__(self):
+        self.rfd, self.wfd = socket.socketpair(
+            socket.AF_UNIX, socket.SOCK_DGRAM
+        )
+        self.queue = deque()
+        self.lock = threading.Lock()
+        self.ready = False
+
+    def close(self):
+        self.rfd.close()
+        self.wfd.close()
+
+    def put(self, item):
+        with self.lock:
+            self.queue.append(item)
+            if not self.ready:
+                self.wfd.send(b'\0')
+                self.ready = True
+
+    def _pop(self, peek):
+        while self.queue:
+            item = self.queue[0]
+            if isinstance(item, bytes):
+                if not peek:
+                    self.queue.popleft()
+                return item
+            try:
+                data = next(item)
+            except StopIteration:
+                self.queue.popleft()
+                continue
+            if peek:
+                self.queue.appendleft(data)
+            return data
+        return None
+
+    def get(self, flags=0):
+        while True:
+            with self.lock:
+                data = self._pop(flags & socket.MSG_PEEK)
+                if not self.queue and self.ready:
+                    self.rfd.recv(1)
+                    self.ready = False
+                if data is not None:
+                    return data
+            # wait for data, or raise BlockingIOError
+            self.rfd.recv(1, socket.MSG_PEEK | (flags & socket.MSG_DONTWAIT))
+
+
+def compile_preset(name):
+    '''
+    Return tables for the preset. The tables are built once per
+    preset version and then copied.
+    '''
+    preset = presets[name]
+    version = tuple(
+        (id(preset.get(x)), len(preset.get(x, ()))) for x in IPEngine.tables
+    )
+    cached = compiled.get(name)
+    if cached is None or cached[0] != version:
+        cached = (
+            version,
+            {
+                table: MockTable(preset.get(table, ()), indices)
+                for table, indices in IPEngine.tables.items()
+            },
+        )
+        compiled[name] = cached
+    return {table: x.copy() for table, x in cached[1].items()}
+
+
+compiled = {}
+
+
 class IPEngine:
     '''Mock network objects database with the socket API.
 
-    WIP: work in progress.
-
     A drop-in replacement to use instead of a low level RTNL socket.
     Implements all the required socket properties and provides a
-    network objects database with RTNL protocol.
+    network objects database with RTNL protocol: links, addresses,
+    routes, neighbours and rules.
 
     Example::
 
@@ -578,8 +1096,21 @@ class IPEngine:
         >>> [ x.get('ifname') for x in ipr.link('dump') ]
         ['lo', 'eth0']
 
+    Dump responses are packed into datagrams up to `dump_size`
+    bytes, like the kernel does.
     '''
 
+    tables = {
+        'links': {'ifname': lambda x: x.ifname},
+        'addr': {'index': lambda x: x.index},
+        'routes': {
+            'prefix': lambda x: (x.dst, x.dst_len),
+            'oif': lambda x: x.oif,
+        },
+        'neighbours': {'ifindex': lambda x: x.ifindex},
+        'rules': {'priority': lambda x: x.priority},
+    }
+
     def __init__(
         self,
         sfamily=AF_NETLINK,
@@ -587,82 +1118,98 @@ class IPEngine:
         sproto=0,
         netns='default',
         flags=os.O_CREAT,
+        dump_size=16384,
     ):
         self.marshal = MarshalRtnl()
         self.netns = netns
         self.flags = flags
+        self.dump_size = dump_size
         self._stype = stype
         self._sfamily = sfamily
         self._sproto = sproto
         self._local = threading.local()
         self._lock = threading.Lock()
         self._broadcast = set()
+        self.request = None
         self.processors = {
             RTM_GETADDR: self.RTM_GETADDR,
             RTM_GETLINK: self.RTM_GETLINK,
             RTM_NEWADDR: self.RTM_NEWADDR,
             RTM_DELADDR: self.RTM_DELADDR,
             RTM_NEWLINK: self.RTM_NEWLINK,
+            RTM_DELLINK: self.RTM_DELLINK,
             RTM_DELROUTE: self.RTM_DELROUTE,
             RTM_NEWROUTE: self.RTM_NEWROUTE,
             RTM_GETROUTE: self.RTM_GETROUTE,
+            RTM_NEWNEIGH: self.RTM_NEWNEIGH,
+            RTM_DELNEIGH: self.RTM_DELNEIGH,
+            RTM_GETNEIGH: self.RTM_GETNEIGH,
+            RTM_NEWRULE: self.RTM_NEWRULE,
+            RTM_DELRULE: self.RTM_DELRULE,
+            RTM_GETRULE: self.RTM_GETRULE,
         }
         self.initdb()
 
     @property
-    def loopback_r(self):
-        if not hasattr(self._local, 'loopback_r'):
-            self._local.loopback_r, self._local.loopback_w = socket.socketpair(
-                socket.AF_UNIX, socket.SOCK_DGRAM
-            )
-        return self._local.loopback_r
-
-    @property
-    def loopback_w(self):
-        if not hasattr(self._local, 'loopback_w'):
-            self._local.loopback_r, self._local.loopback_w = socket.socketpair(
-                socket.AF_UNIX, socket.SOCK_DGRAM
-            )
-        return self._local.loopback_w
+    def channel(self):
+        if not hasattr(self._local, 'channel'):
+            self._local.channel = MockChannel()
+        return self._local.channel
 
     def initdb(self):
         if self.netns not in presets:
             if not self.flags & os.O_CREAT:
                 raise FileNotFoundError()
             presets[self.netns] = copy.deepcopy(presets['netns'])
-        self.database = copy.deepcopy(presets[self.netns])
+        self.database = compile_preset(self.netns)
 
     def close(self):
-        self.loopback_r.close()
-        self.loopback_w.close()
+        with self._lock:
+            self._broadcast.discard(self.channel)
+        self.channel.close()
 
     def bind(self, address=None):
-        self._broadcast.add(self.loopback_w)
-        msg = rtmsg()
-        msg.load(self.database['routes'][0].export())
-        msg.encode()
-        self.loopback_w.send(msg.data)
+        with self._lock:
+            self._broadcast.add(self.channel)
+        for route in self.database['routes']:
+            data = bytearray(route.encode())
+            struct.pack_into('H', data, 6, 0)
+            self.channel.put(bytes(data))
+            break
 
     def fileno(self):
-        return self.loopback_r.fileno()
+        return self.channel.rfd.fileno()
 
     def recv(self, bufsize, flags=0):
-        return self.loopback_r.recv(bufsize, flags)
+        return self.channel.get(flags)[:bufsize]
 
     def recvfrom(self, bufsize, flags=0):
-        return self.loopback_r.recvfrom(bufsize, flags)
+        return self.recv(bufsize, flags), None
 
     def recvmsg(self, bufsize, ancbufsize=0, flags=0):
-        return self.loopback_r.recvmsg(bufsize, ancbufsize, flags)
+        return self.recv(bufsize, flags), [], 0, None
 
     def recv_into(self, buffer, nbytes=0, flags=0):
-        return self.loopback_r.recv_into(buffer, nbytes, flags)
+        data = self.channel.get(flags)
+        view = memoryview(buffer)[: nbytes or len(buffer)]
+        length = min(len(data), len(view))
+        view[:length] = data[:length]
+        if flags & socket.MSG_TRUNC:
+            return len(data)
+        return length
 
     def recvfrom_into(self, buffer, nbytes=0, flags=0):
-        return self.loopback_r.recvfrom_into(buffer, nbytes, flags)
+        return self.recv_into(buffer, nbytes, flags), None
 
     def recvmsg_into(self, buffers, ancbufsize=0, flags=0):
-        return self.loopback_r.recvmsg_into(buffers, ancbufsize, flags)
+        data = self.channel.get(flags)
+        offset = 0
+        for buffer in buffers:
+            view = memoryview(buffer)
+            length = min(len(data) - offset, len(view))
+            view[:length] = data[offset : offset + length]
+            offset += length
+        return offset, [], 0, None
 
     def send(self, data, flags=0):
         return self.nl_handle(data)
@@ -677,16 +1224,16 @@ class IPEngine:
         raise NotImplementedError()
 
     def setblocking(self, flag):
-        return self.loopback_r.setblocking(flag)
+        return self.channel.rfd.setblocking(flag)
 
     def getblocking(self):
-        return self.loopback_r.getblocking()
+        return self.channel.rfd.getblocking()
 
     def getsockname(self):
-        return self.loopback_r.getsockname()
+        return self.channel.rfd.getsockname()
 
     def getpeername(self):
-        return self.loopback_r.getpeername()
+        return self.channel.rfd.getpeername()
 
     @property
     def type(self):
@@ -705,180 +1252,330 @@ class IPEngine:
             for msg in self.marshal.parse(data):
                 key = msg['header']['type']
                 tag = msg['header']['sequence_number']
+                self.request = msg
                 if key in self.processors:
                     self.processors[key](msg)
                 else:
                     self.nl_done(tag)
             return len(data)
 
-    def nl_dump(self, registry, msg_class, tag):
-        for item in registry:
-            msg = msg_class()
-            msg.load(item.export())
-            msg['header']['flags'] = NLM_F_MULTI
-            msg['header']['sequence_number'] = tag
-            msg.encode()
-            yield msg
+    def nl_dump(self, objects, tag, done=True):
+        '''
+        Generate datagrams with the cached messages of the objects,
+        and `NLMSG_DONE` in the end.
+        '''
+        data = bytearray()
+        for obj in objects:
+            msg = obj.encode()
+            if data and len(data) + len(msg) > self.dump_size:
+                yield bytes(data)
+                data = bytearray()
+            offset = len(data)
+            data += msg
+            struct.pack_into('I', data, offset + 8, tag)
+        if done:
+            data += self.nl_done_data(tag)
+        if data:
+            yield bytes(data)
+
+    def nl_send(self, objects, tag, dump):
+        if dump:
+            self.channel.put(self.nl_dump(objects, tag))
+        else:
+            self.channel.put(self.nl_dump(objects, tag, done=False))
+            self.nl_error(tag, 0)
 
     def nl_broadcast(self, msg):
-        for sock in self._broadcast:
-            msg['header']['sequence_number'] = 0
-            msg.reset()
-            msg.encode()
-            sock.send(msg.data)
+        msg['header']['sequence_number'] = 0
+        msg.reset()
+        msg.encode()
+        data = bytes(msg.data)
+        for channel in tuple(self._broadcast):
+            channel.put(data)
 
-    def nl_done(self, tag):
+    def nl_done_data(self, tag):
         msg = nlmsg()
         msg['header']['type'] = NLMSG_DONE
         msg['header']['sequence_number'] = tag
         msg.encode()
-        self.loopback_w.send(msg.data)
+        return bytes(msg.data)
+
+    def nl_done(self, tag):
+        self.channel.put(self.nl_done_data(tag))
 
     def nl_error(self, tag, code):
         msg = nlmsgerr()
+        msg['header']['type'] = NLMSG_ERROR
         msg['header']['sequence_number'] = tag
-        msg['error'] = code
+        msg['error'] = -code
         msg.encode()
-        self.loopback_w.send(msg.data)
+        data = bytes(msg.data)
+        if code and self.request is not None:
+            # like the kernel, return the request with the error
+            offset = self.request.offset
+            length = self.request['header']['length']
+            data += bytes(self.request.data[offset : offset + length])
+            data = struct.pack('I', len(data)) + data[4:]
+        self.channel.put(data)
+
+    def storm(self, count, kind='route', size=1024, batch=1):
+        '''
+        Send `count` synthetic broadcast events to all the bound
+        sockets. A pool of `size` synthetic objects of the `kind`,
+        "link", "addr", "route" or "neigh", is added and removed in
+        turns: first all the objects are added, then removed, etc.
+        Every datagram contains `batch` events.
+
+        The events are generated while the sockets are read, and
+        they don't change the database.
+        '''
+        links = [x.index for x in self.database['links']]
+        if kind == 'link':
+            pool = synthetic_links(size, start=0x100000)
+        elif kind == 'addr':
+            pool = synthetic_addresses(size, links)
+        elif kind == 'route':
+            pool = synthetic_routes(size, links)
+        elif kind == 'neigh':
+            pool = synthetic_neighbours(size, links)
+        else:
+            raise ValueError(f'unsupported kind {kind}')
+        pool = [x.encode() for x in pool]
+        with self._lock:
+            for channel in self._broadcast:
+                channel.put(self.storm_datagrams(pool, count, batch))
+
+    @staticmethod
+    def storm_datagrams(pool, count, batch):
+        data = bytearray()
+        for idx in range(count):
+            msg = pool[idx % len(pool)]
+            offset = len(data)
+            data += msg
+            # RTM_NEW* + 1 == RTM_DEL*, flags == 0
+            (msg_type,) = struct.unpack_from('H', msg, 4)
+            struct.pack_into(
+                'HH', data, offset + 4, msg_type + idx // len(pool) % 2, 0
+            )
+            if (idx + 1) % batch == 0:
+                yield bytes(data)
+                data = bytearray()
+        if data:
+            yield bytes(data)
+
+    def route_lookup(self, dst, tables=None):
+        '''
+        Longest prefix match, `dst == None` matches only the
+        default routes.
+        '''
+        prefixlen = 0
+        if dst is not None:
+            dst = ipaddress.ip_address(dst)
+            prefixlen = dst.max_prefixlen
+        for dst_len in range(prefixlen, -1, -1):
+            network = None
+            if dst_len > 0:
+                network = str(
+                    ipaddress.ip_network((dst, dst_len), strict=False)[0]
+                )
+            for route in self.database['routes'].lookup(
+                'prefix', (network, dst_len)
+            ):
+                if tables is None or route.table in tables:
+                    return route
+        return None
 
     def RTM_GETROUTE(self, req):
         tag = req['header']['sequence_number']
-        for msg in self.nl_dump(self.database['routes'], rtmsg, tag):
-            self.loopback_w.send(msg.data)
-        self.nl_done(tag)
+        if req['header']['flags'] & NLM_F_DUMP:
+            return self.nl_send(self.database['routes'], tag, True)
+        route = self.route_lookup(req.get('dst'), (255, 254))
+        if route is None:
+            return self.nl_error(tag, errno.ENETUNREACH)
+        if req.get('dst') is not None:
+            route = copy.copy(route)
+            route._encoded = None
+            route.dst = req.get('dst')
+            route.dst_len = req.get('dst_len') or (
+                32 if route.family == 2 else 128
+            )
+        self.nl_send([route], tag, False)
 
     def RTM_GETADDR(self, msg_in):
         tag = msg_in['header']['sequence_number']
-        for msg_out in self.nl_dump(self.database['addr'], ifaddrmsg, tag):
-            self.loopback_w.send(msg_out.data)
-        self.nl_done(tag)
+        self.nl_send(self.database['addr'], tag, True)
 
-    def RTM_GETLINK(self, msg_in):
+    def RTM_GETNEIGH(self, msg_in):
         tag = msg_in['header']['sequence_number']
-        database = self.database['links']
-        if msg_in.get('index') > 0:
-            database = [
-                x
-                for x in self.database['links']
-                if x.index == msg_in.get('index')
-            ]
+        self.nl_send(self.database['neighbours'], tag, True)
+
+    def RTM_GETRULE(self, msg_in):
+        tag = msg_in['header']['sequence_number']
+        self.nl_send(self.database['rules'], tag, True)
+
+    def get_link(self, msg_in):
+        links = self.database['links']
+        if msg_in.get('index'):
+            link = links.get(msg_in.get('index'))
+            return [link] if link is not None else []
         elif msg_in.get('ifname'):
-            database = [
-                x
-                for x in self.database['links']
-                if x.ifname == msg_in.get('ifname')
-            ]
-        for msg_out in self.nl_dump(database, ifinfmsg, tag):
-            self.loopback_w.send(msg_out.data)
-        if msg_in.get(('header', 'flags')) & NLM_F_DUMP:
-            return self.nl_done(tag)
-        self.nl_error(tag, 0)
+            return links.lookup('ifname', msg_in.get('ifname'))
+        return None
+
+    def RTM_GETLINK(self, msg_in):
+        tag = msg_in['header']['sequence_number']
+        database = self.get_link(msg_in)
+        if database is None:
+            database = self.database['links']
+        self.nl_send(
+            database, tag, msg_in.get(('header', 'flags')) & NLM_F_DUMP
+        )
 
     def RTM_NEWROUTE(self, req):
         tag = req['header']['sequence_number']
         if not req.get('oif'):
-            (gateway,) = struct.unpack(
-                '>I', socket.inet_aton(req.get('gateway'))
-            )
-            for route in self.database['routes']:
-                if route.dst is None:
-                    continue
-                (dst,) = struct.unpack('>I', socket.inet_aton(route.dst))
-                if (gateway & (0xFFFFFFFF << (32 - route.dst_len))) == dst:
-                    req['attrs'].append(('RTA_OIF', route.oif))
-                    break
-            else:
+            gateway = req.get('gateway')
+            route = None
+            if gateway is not None:
+                route = self.route_lookup(gateway)
+            if route is None or route.dst is None:
                 return self.nl_error(tag, errno.ENOENT)
-        idx = {
-            (x.dst, x.dst_len, x.oif, x.priority, x.gateway, x.table): x
-            for x in self.database['routes']
-        }
-        req_index = (
-            req.get('dst'),
-            req.get('dst_len'),
-            req.get('oif'),
-            req.get('priority'),
-            req.get('gateway'),
-            req.get('IFLA_TABLE') or req.get('table'),
-        )
-        if req_index in idx:
-            return self.nl_error(tag, errno.EEXIST)
+            req['attrs'].append(('RTA_OIF', route.oif))
         route = MockRoute.load_from_msg(req)
-        self.database['routes'].append(route)
+        if route.key() in self.database['routes']:
+            return self.nl_error(tag, errno.EEXIST)
+        self.database['routes'].add(route)
         self.nl_error(tag, 0)
-        msg = rtmsg()
-        msg.load(route.export())
-        self.nl_broadcast(msg)
+        self.nl_broadcast(route.message())
 
     def RTM_DELROUTE(self, req):
-        idx = {
-            (x.dst, x.dst_len, x.oif, x.priority, x.table): x
-            for x in self.database['routes']
-        }
-        req_index = (
-            req.get('dst'),
-            req.get('dst_len'),
-            req.get('oif'),
-            req.get('priority'),
-            req.get('IFLA_TABLE') or req.get('table'),
-        )
         tag = req['header']['sequence_number']
-        if req_index not in idx:
+        table = req.get('IFLA_TABLE') or req.get('table')
+        for route in self.database['routes'].lookup(
+            'prefix', (req.get('dst'), req.get('dst_len'))
+        ):
+            if route.table != table:
+                continue
+            if any(
+                req.get(x) is not None and req.get(x) != getattr(route, x)
+                for x in ('oif', 'priority', 'gateway')
+            ):
+                continue
+            break
+        else:
             return self.nl_error(tag, errno.ENOENT)
-        self.database['routes'].remove(idx[req_index])
+        self.database['routes'].remove(route.key())
         self.nl_error(tag, 0)
         self.nl_broadcast(req)
 
     def RTM_DELADDR(self, req):
-        idx = {
-            (x.index, x.address, x.prefixlen): x for x in self.database['addr']
-        }
         req_index = (
             req.get("index"),
             req.get("address"),
             req.get("prefixlen"),
         )
         tag = req['header']['sequence_number']
-        if req_index not in idx:
+        if req_index not in self.database['addr']:
             return self.nl_error(tag, errno.ENOENT)
-        self.database['addr'].remove(idx[req_index])
+        self.database['addr'].remove(req_index)
         self.nl_error(tag, 0)
         self.nl_broadcast(req)
 
     def RTM_NEWADDR(self, req):
-        idx = {
-            (x.index, x.address, x.prefixlen) for x in self.database['addr']
-        }
         req_index = (
             req.get("index"),
             req.get("address"),
             req.get("prefixlen"),
         )
         tag = req['header']['sequence_number']
-        if req_index in idx:
+        if req_index in self.database['addr']:
             return self.nl_error(tag, errno.EEXIST)
-        addr = MockAddress.load_from_msg(req)
-        self.database['addr'].append(addr)
+        addr = self.database['addr'].add(MockAddress.load_from_msg(req))
         self.nl_error(tag, 0)
-        msg = ifaddrmsg()
-        msg.load(addr.export())
-        self.nl_broadcast(msg)
+        self.nl_broadcast(addr.message())
 
     def RTM_NEWLINK(self, req):
-        idx = {x.index: x for x in self.database['links']}
-        nmx = {x.ifname: x for x in self.database['links']}
+        links = self.database['links']
         tag = req['header']['sequence_number']
-        if req.get('index') in idx:
-            link = idx[req.get('index')]
+        if req.get('index') in links:
+            link = links.get(req.get('index'))
             if link.ifname == req.get('ifname'):
                 return self.nl_error(tag, errno.EEXIST)
-            link.update_from_msg(req)
-        elif req.get('ifname') in nmx:
+            link = links.update(link.index, req)
+        elif links.lookup('ifname', req.get('ifname')):
             return self.nl_error(tag, errno.EEXIST)
         else:
-            link = MockLink.load_from_msg(req)
-            self.database['links'].append(link)
+            link = links.add(MockLink.load_from_msg(req))
         self.nl_error(tag, 0)
-        msg = ifinfmsg()
-        msg.load(link.export())
+        self.nl_broadcast(link.message())
+
+    def RTM_DELLINK(self, req):
+        tag = req['header']['sequence_number']
+        links = self.get_link(req)
+        if not links:
+            return self.nl_error(tag, errno.ENODEV)
+        (link,) = links
+        self.database['links'].remove(link.index)
+        # the kernel removes the dependent objects
+        for table, index in (
+            ('addr', 'index'),
+            ('routes', 'oif'),
+            ('neighbours', 'ifindex'),
+        ):
+            for obj in self.database[table].lookup(index, link.index):
+                self.database[table].remove(obj.key())
+        self.nl_error(tag, 0)
+        msg = link.message()
+        msg['header']['type'] = RTM_DELLINK
         self.nl_broadcast(msg)
+
+    def RTM_NEWNEIGH(self, req):
+        tag = req['header']['sequence_number']
+        neighbours = self.database['neighbours']
+        key = (req.get('ifindex'), req.get('dst'))
+        if key in neighbours:
+            if req['header']['flags'] & NLM_F_EXCL:
+                return self.nl_error(tag, errno.EEXIST)
+            neighbour = neighbours.update(key, req)
+        elif not req['header']['flags'] & NLM_F_CREATE:
+            return self.nl_error(tag, errno.ENOENT)
+        else:
+            neighbour = neighbours.add(MockNeighbour.load_from_msg(req))
+        self.nl_error(tag, 0)
+        self.nl_broadcast(neighbour.message())
+
+    def RTM_DELNEIGH(self, req):
+        tag = req['header']['sequence_number']
+        key = (req.get('ifindex'), req.get('dst'))
+        if key not in self.database['neighbours']:
+            return self.nl_error(tag, errno.ENOENT)
+        self.database['neighbours'].remove(key)
+        self.nl_error(tag, 0)
+        self.nl_broadcast(req)
+
+    def RTM_NEWRULE(self, req):
+        tag = req['header']['sequence_number']
+        rule = MockRule.load_from_msg(req)
+        if rule.key() in self.database['rules']:
+            return self.nl_error(tag, errno.EEXIST)
+        self.database['rules'].add(rule)
+        self.nl_error(tag, 0)
+        self.nl_broadcast(rule.message())
+
+    def RTM_DELRULE(self, req):
+        tag = req['header']['sequence_number']
+        rules = self.database['rules']
+        if req.get('priority') is not None:
+            rules = rules.lookup('priority', req.get('priority'))
+        for rule in rules:
+            if any(
+                req.get(x) is not None and req.get(x) != getattr(rule, x)
+                for x in ('family', 'table', 'src', 'dst')
+            ):
+                continue
+            break
+        else:
+            return self.nl_error(tag, errno.ENOENT)
+        self.database['rules'].remove(rule.key())
+        self.nl_error(tag, 0)
+        self.nl_broadcast(req)
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import io
 import logging
 import os
@@ -17,7 +18,12 @@ from pyroute2.netlink.exceptions import (
     NetlinkError,
     SkipInode,
 )
-from pyroute2.netlink.nlsocket import NetlinkRequest, NetlinkSocket
+from pyroute2.netlink.nlsocket import (
+    NetlinkBatch,
+    NetlinkPipeline,
+    NetlinkRequest,
+    NetlinkSocket,
+)
 from pyroute2.netlink.rtnl import (
     RTM_DELADDR,
     RTM_DELLINK,
@@ -76,6 +82,7 @@ from pyroute2.netlink.rtnl.probe_msg import probe_msg
 from pyroute2.netlink.rtnl.rtmsg import rtmsg
 from pyroute2.netlink.rtnl.tcmsg import plugins as tc_plugins
 from pyroute2.netlink.rtnl.tcmsg import tcmsg
+from pyroute2.netns import listnetns
 from pyroute2.requests.address import AddressFieldFilter, AddressIPRouteFilter
 from pyroute2.requests.bridge import (
     BridgeFieldFilter,
@@ -497,15 +504,23 @@ class RTNL_API:
         await self.route_dump(fd, family, fmt)
         return fd.getvalue()
 
-    async def route_load(self, fd, fmt='iproute2'):
+    async def route_load(self, fd, fmt='iproute2', window=256, bufsize=65536):
         '''Load routes from a binary dump.
 
         fd -- an open file object, must support `read()`
         fmt -- dump format, "iproute2" (default) or "raw"
+        window -- max number of requests in flight
+        bufsize -- max size of one send() buffer
+
+        Routes are not decoded, but sent as is with updated
+        headers as `RTM_NEWROUTE` with `replace` flags. Many
+        routes are packed into one `send()` call, and the loader
+        doesn't wait for an ACK for every route before sending the
+        next one, see `NetlinkPipeline`.
 
-        The current version parses the dump and loads routes one
-        by one. This behavior will be changed in the future to
-        optimize the performance, but the result will be the same.
+        One failed route doesn't stop the loader. The method
+        returns the list of failed routes as `(rtmsg, error)`
+        tuples, so an empty list means all the routes are loaded.
 
         If `fmt == "iproute2"`, then the loader checks the magic iproute2
         prefix in the dump. Otherwise it parses the data from byte 0.
@@ -518,26 +533,33 @@ class RTNL_API:
                 raise TypeError('wrong dump magic')
         elif fmt != 'raw':
             raise TypeError('dump format not supported')
+        data = fd.read()
+        msg_flags = NetlinkRequest.calculate_request_flags(
+            'replace', self.status['nlm_echo']
+        )
+        pipeline = NetlinkPipeline(self, window=window, bufsize=bufsize)
+        offset = 0
+        while offset <= len(data) - 16:
+            length, msg_type = struct.unpack_from('IH', data, offset)
+            if length < 16:
+                raise ValueError('broken route dump')
+            if msg_type == RTM_NEWROUTE:
+                await pipeline.put(
+                    data[offset : offset + length],
+                    RTM_NEWROUTE,
+                    msg_flags,
+                    offset,
+                )
+            offset += length
         ret = []
-        for msg in self.marshal.parse(fd.read()):
-            request = NetlinkRequest(
-                self,
-                msg,
-                command='replace',
-                command_map={'replace': (RTM_NEWROUTE, 'replace')},
-            )
-            await request.send()
-            ret.extend(
-                [
-                    x['header']['error'] is None
-                    async for x in request.response()
-                ]
-            )
-        if not all(ret):
-            raise NetlinkError('error loading route dump')
-        return []
+        for offset, error in await pipeline.finish():
+            if error is not None:
+                msg = rtmsg(data, offset=offset)
+                msg.decode()
+                ret.append((msg, error))
+        return ret
 
-    async def route_loads(self, data, fmt='iproute2'):
+    async def route_loads(self, data, fmt='iproute2', **kwarg):
         '''Load routes from a `bytes` object.
 
         Like `.route_load()`, but accepts `bytes` instead of an file file.
@@ -545,7 +567,60 @@ class RTNL_API:
         fd = io.BytesIO()
         fd.write(data)
         fd.seek(0)
-        return await self.route_load(fd, fmt)
+        return await self.route_load(fd, fmt, **kwarg)
+
+    # 8<---------------------------------------------------------------
+    #
+    # Bulk operations
+    #
+    async def bulk(self, api, requests, window=256, bufsize=65536):
+        '''Run many `link`, `addr`, `neigh` or `route` requests
+        without waiting for the ACK on every request.
+
+        api -- "link", "addr", "neigh" or "route"
+        requests -- an iterable of `(command, kwarg)` pairs
+        window -- max number of requests in flight
+        bufsize -- max size of one send() buffer
+
+        The requests are compiled with the same arguments as the
+        corresponding methods take to one `NetlinkBatch`, and sent
+        with `AsyncNetlinkSocket.submit_batch()`. Returns a list
+        with the result per request, in the same order: `None` on
+        success, or `NetlinkError`. A failed request doesn't stop
+        the rest::
+
+            errors = ipr.bulk(
+                'addr',
+                [
+                    ('add', {'index': 1, 'address': f'10.0.0.{x}'})
+                    for x in range(1, 255)
+                ],
+            )
+        '''
+        if api not in ('link', 'addr', 'neigh', 'route'):
+            raise ValueError(f'bulk operations not supported for {api}')
+        method = getattr(self, api)
+        # the range of the batch requests per call
+        calls = []
+        # compile the requests to the batch buffer; the methods
+        # don't await anything in the batch mode, so other tasks
+        # can not send their requests to the buffer
+        batch, self.batch = self.batch, NetlinkBatch()
+        try:
+            for command, kwarg in requests:
+                if command in ('dump', 'show', 'get'):
+                    raise ValueError(f'{command} is not supported in bulk')
+                start = len(self.batch.requests)
+                await method(command, **kwarg)
+                calls.append((start, len(self.batch.requests)))
+        finally:
+            batch, self.batch = self.batch, batch
+        results = await self.submit_batch(batch, window, bufsize)
+        ret = []
+        for start, end in calls:
+            errors = [x[1] for x in results[start:end] if x[1] is not None]
+            ret.append(errors[0] if errors else None)
+        return ret
 
     # 8<---------------------------------------------------------------
     #
@@ -772,73 +847,102 @@ class RTNL_API:
     #
     # List NetNS info
     #
-    async def _dump_one_ns(self, path, registry):
+    def _open_one_ns(self, path, registry):
         item = nsinfmsg()
         item['netnsid'] = 0xFFFFFFFF  # default netnsid "unknown"
-        nsfd = 0
-        info = nsidmsg()
-        msg = nsidmsg()
         try:
             (nsfd, inode) = self.open_file(path)
-            item['inode'] = inode
-            #
-            # if the inode is registered, skip it
-            #
-            if item['inode'] in registry:
-                raise SkipInode()
-            registry.add(item['inode'])
-            #
-            # request NETNSA_NSID
-            #
-            # may not work on older kernels ( <4.20 ?)
-            #
+        except OSError as e:
+            raise SkipInode(e.errno)
+        #
+        # if the inode is registered, skip it
+        #
+        if inode in registry:
+            self.close_file(nsfd)
+            raise SkipInode()
+        registry.add(inode)
+        item['inode'] = inode
+        item['attrs'] = [('NSINFO_PATH', path)]
+        item['header']['type'] = RTM_NEWNETNS
+        item['header']['target'] = self.target
+        item['event'] = 'RTM_NEWNETNS'
+        return item, nsfd
+
+    async def _get_nsids(self, items):
+        #
+        # request NETNSA_NSID for (item, nsfd) pairs; send all
+        # the requests first, and collect the responses then
+        #
+        # may not work on older kernels ( <4.20 ?)
+        #
+        requests = []
+        for item, nsfd in items:
+            msg = nsidmsg()
             msg['attrs'] = [('NETNSA_FD', nsfd)]
             request = NetlinkRequest(
                 self, msg, msg_type=RTM_GETNSID, msg_flags=NLM_F_REQUEST
             )
             await request.send()
+            requests.append((item, request))
+        for item, request in requests:
             try:
                 async for info in request.response():
-                    # response to nlm_request() is a list or a generator,
-                    # that's why loop
                     item['netnsid'] = info.get_attr('NETNSA_NSID')
-                    break
             except Exception:
                 pass
-            item['attrs'] = [('NSINFO_PATH', path)]
-        except OSError as e:
-            raise SkipInode(e.errno)
+
+    async def _dump_one_ns(self, path, registry):
+        item, nsfd = self._open_one_ns(path, registry)
+        try:
+            await self._get_nsids([(item, nsfd)])
         finally:
-            if nsfd > 0:
-                self.close_file(nsfd)
-        item['header']['type'] = RTM_NEWNETNS
-        item['header']['target'] = self.target
-        item['event'] = 'RTM_NEWNETNS'
+            self.close_file(nsfd)
         return item
 
-    async def _dump_dir(self, path, registry):
-        for name in os.listdir(path):
-            # strictly speaking, there is no need to use os.sep,
-            # since the code is not portable outside of Linux
-            nspath = '%s%s%s' % (path, os.sep, name)
+    async def _dump_paths(self, paths, registry, chunk=256):
+        '''
+        Yield netns info for the paths. The paths are opened by
+        chunks, not to hit the open files limit, and the NSID
+        requests for every chunk are sent in one go.
+        '''
+        paths = iter(paths)
+        while True:
+            items = []
             try:
-                yield await self._dump_one_ns(nspath, registry)
-            except SkipInode:
-                pass
+                for path in paths:
+                    try:
+                        items.append(self._open_one_ns(path, registry))
+                    except SkipInode:
+                        continue
+                    if len(items) >= chunk:
+                        break
+                if not items:
+                    return
+                await self._get_nsids(items)
+            finally:
+                for _, nsfd in items:
+                    self.close_file(nsfd)
+            for item, _ in items:
+                yield item
 
-    async def _dump_proc(self, registry):
-        for name in os.listdir('/proc'):
-            try:
-                int(name)
-            except ValueError:
-                continue
+    async def _dump_dir(self, path, registry):
+        # strictly speaking, there is no need to use os.sep,
+        # since the code is not portable outside of Linux
+        async for item in self._dump_paths(
+            ['%s%s%s' % (path, os.sep, x) for x in os.listdir(path)], registry
+        ):
+            yield item
 
-            try:
-                yield await self._dump_one_ns(
-                    '/proc/%s/ns/net' % name, registry
-                )
-            except SkipInode:
-                pass
+    async def _dump_proc(self, registry):
+        async for item in self._dump_paths(
+            [
+                '/proc/%s/ns/net' % x
+                for x in os.listdir('/proc')
+                if x.isdigit()
+            ],
+            registry,
+        ):
+            yield item
 
     async def get_netnsid(
         self, nsid=None, pid=None, fd=None, target_nsid=None
@@ -2520,6 +2624,26 @@ class AsyncIPRoute(AsyncIPRSocket, RTNL_API):
     '''
     Regular ordinary async utility class, provides RTNL API using
     AsyncIPRSocket as the transport level.
+
+    With `lazy_decode=True` messages keep only an index of their
+    NLAs, and every NLA is decoded on the first access, e.g. with
+    `msg.get('ifname')`. This saves CPU and memory on big dumps,
+    when only a few attributes are used::
+
+        async with AsyncIPRoute(lazy_decode=True) as ipr:
+            async for link in await ipr.link('dump'):
+                print(link.get('index'), link.get('ifname'))
+
+    With `use_buffer=True` the socket receives data directly to
+    the pages of a preallocated `pyroute2.netlink.buffer.Buffer`,
+    and messages are decoded from memoryview chunks of the pages.
+    A page returns to the pool when all the messages received to
+    it are gone. One can also pass a `Buffer` object to share it
+    between sockets.
+
+    With `seq32=True` sequence numbers are allocated from the whole
+    32 bit space instead of 16 bit, for sockets with a lot of
+    requests in flight.
     '''
 
     async def __aenter__(self):
@@ -2528,6 +2652,81 @@ class AsyncIPRoute(AsyncIPRSocket, RTNL_API):
     async def __aexit__(self, exc_type, exc, tb):
         self.close()
 
+    @classmethod
+    async def fanout(
+        cls,
+        method,
+        *argv,
+        netns=None,
+        concurrency=32,
+        flags=0,
+        skip_errors=False,
+        init=None,
+        **kwarg,
+    ):
+        '''Run the same request in many network namespaces
+        concurrently, and stream the results tagged with the
+        netns name as `(netns, msg)` pairs::
+
+            async for nsname, link in AsyncIPRoute.fanout('get_links'):
+                print(nsname, link.get('ifname'))
+
+        method -- the method name, like "get_links" or "route"
+        netns -- an iterable of netns names, all the netns by default
+        concurrency -- max number of netns to query at the same time
+        flags -- netns open flags, by default don't create netns
+        skip_errors -- log and skip failed netns instead of raising
+        init -- a dict of the socket init arguments
+        argv, kwarg -- the method arguments
+
+        The results from different netns come in arbitrary order,
+        the results from one netns come in the dump order. If the
+        caller stops the iteration, the pending requests are
+        cancelled and the sockets are closed.
+        '''
+        if netns is None:
+            netns = listnetns()
+        init = dict(init or {})
+        targets = iter(netns)
+        queue = asyncio.Queue(maxsize=max(concurrency, 1) * 64)
+
+        async def worker():
+            for nsname in targets:
+                try:
+                    async with cls(netns=nsname, flags=flags, **init) as ipr:
+                        ret = await getattr(ipr, method)(*argv, **kwarg)
+                        if hasattr(ret, '__aiter__'):
+                            async for msg in ret:
+                                await queue.put((True, nsname, msg))
+                        elif ret is not None:
+                            for msg in ret:
+                                await queue.put((True, nsname, msg))
+                except Exception as e:
+                    if not skip_errors:
+                        await queue.put((False, nsname, e))
+                        return
+                    log.warning('fanout: netns %s failed: %s', nsname, e)
+            await queue.put(None)
+
+        workers = [
+            asyncio.create_task(worker()) for _ in range(max(concurrency, 1))
+        ]
+        try:
+            running = len(workers)
+            while running:
+                item = await queue.get()
+                if item is None:
+                    running -= 1
+                    continue
+                ok, nsname, msg = item
+                if not ok:
+                    raise msg
+                yield nsname, msg
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
 
 class IPRoute(NetlinkSocket):
     '''
@@ -2557,6 +2756,9 @@ class IPRoute(NetlinkSocket):
         flags=os.O_CREAT,
         libc=None,
         use_event_loop=False,
+        lazy_decode=False,
+        use_buffer=False,
+        seq32=False,
     ):
         self.asyncore = AsyncIPRoute(
             port=port,
@@ -2578,6 +2780,9 @@ class IPRoute(NetlinkSocket):
             flags=flags,
             libc=libc,
             use_event_loop=use_event_loop,
+            lazy_decode=lazy_decode,
+            use_buffer=use_buffer,
+            seq32=seq32,
         )
         self.asyncore.ensure_event_loop()
         if self.asyncore.status['event_loop'] != 'new' and not use_event_loop:
@@ -2592,6 +2797,40 @@ class IPRoute(NetlinkSocket):
         ret.asyncore = iproute
         return ret
 
+    def _iterate(self, symbol, *argv, **kwarg):
+        # drive the async generator step by step, so only the
+        # messages that are already received are kept in memory
+        agen = self.event_loop.run_until_complete(symbol(*argv, **kwarg))
+        try:
+            while True:
+                try:
+                    yield self.event_loop.run_until_complete(agen.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            self.event_loop.run_until_complete(agen.aclose())
+
+    def iter_routes(self, *argv, **kwarg):
+        '''
+        The same as `get_routes()`, but returns an iterator
+        instead of a list. Messages are parsed and returned as
+        they are received from the kernel, so dumping big routing
+        tables doesn't require to keep all the routes in memory::
+
+            for route in ipr.iter_routes(table=254):
+                print(route.get('dst'))
+
+        Breaking the loop stops the dump.
+        '''
+        return self._iterate(self.asyncore.get_routes, *argv, **kwarg)
+
+    def iter_neighbours(self, *argv, **kwarg):
+        '''
+        The same as `get_neighbours()`, but returns an iterator
+        instead of a list. See also `iter_routes()`.
+        '''
+        return self._iterate(self.asyncore.get_neighbours, *argv, **kwarg)
+
     def __getattr__(self, name):
         async_generic_methods = [
             'addr',
@@ -2613,6 +2852,8 @@ class IPRoute(NetlinkSocket):
             'route_dumps',
             'route_load',
             'route_loads',
+            'bulk',
+            'submit_batch',
         ]
         async_dump_methods = [
             'dump',
@@ -2663,9 +2904,10 @@ class IPRoute(NetlinkSocket):
 class IPBatch(IPRoute):
     '''
     Netlink requests compiler. Does not send any requests, but
-    instead stores them in the internal binary buffer. The
-    contents of the buffer can be used to send batch requests,
-    to test custom netlink parsers and so on.
+    instead encodes them one after another in the internal
+    binary buffer, `NetlinkBatch`. The contents of the buffer
+    can be used to send batch requests, to test custom netlink
+    parsers and so on.
 
     Uses `RTNL_API` and provides all the same API as normal
     `IPRoute` objects::
@@ -2684,6 +2926,17 @@ class IPBatch(IPRoute):
         # send the buffer
         IPRoute().sendto(data, (0, 0))
 
+    The batch can also be sent with `submit()`. The buffer is
+    sent as is, with a few `send()` calls, and the result is
+    returned per compiled request::
+
+        ipb = IPBatch()
+        ipb.addr("add", index=1, address="10.0.0.2", mask=32)
+        ipb.route("add", dst="10.1.0.0/24", oif=12345)
+        for msg, error in ipb.submit():
+            if error is not None:
+                print(msg["header"]["type"], error)
+
     '''
 
     def __init__(self):
@@ -2691,7 +2944,32 @@ class IPBatch(IPRoute):
         self.reset()
 
     def reset(self):
-        self.asyncore.batch = bytearray()
+        self.asyncore.batch = NetlinkBatch()
+
+    def submit(self, ipr=None, window=256, bufsize=65536):
+        '''
+        Send the compiled requests, and reset the batch.
+
+        ipr -- `IPRoute` to send the requests with; by default
+               the batch own socket is used
+        window -- max number of requests in flight
+        bufsize -- max size of one send() buffer
+
+        Returns a list of pairs `(msg, error)`, one per compiled
+        request in the same order, where `msg` is the request,
+        and `error` is `None` on success, or `NetlinkError`.
+        '''
+        batch = self.asyncore.batch
+        if ipr is None:
+            ipr = self
+        # switch off the batch mode to send the requests
+        self.asyncore.batch = None
+        try:
+            return ipr.event_loop.run_until_complete(
+                ipr.asyncore.submit_batch(batch, window, bufsize)
+            )
+        finally:
+            self.reset()
 
 
 class RawIPRoute(IPRoute):
@@ -7,23 +7,48 @@ that this module is working with all available ipset modules.
 
 It supports almost all kernel commands (create, destroy, flush,
 rename, swap, test...)
+
+Bulk operations
+---------------
+
+`add_many()`, `delete_many()` and `test_many()` work with many
+entries at once. Like `ipset restore`, the add and delete methods
+pack the entries into a few messages with `IPSET_ATTR_ADT`, and the
+messages are sent without waiting for the ACK on every one. The
+result is a list of errors, one per entry::
+
+    ipset = IPSet()
+    ipset.create("foo", stype="hash:ip")
+    errors = ipset.add_many("foo", ["198.51.100.1", "198.51.100.2"])
+    failed = [x for x in errors if x is not None]
+
+The kernel stops processing a message on the first failed entry,
+and reports its line number; the rest of the entries are sent
+again, so one failed entry doesn't stop the rest.
 '''
 
 import errno
 import socket
+import struct
 
 from pyroute2.common import basestring
 from pyroute2.netlink import (
     NETLINK_NETFILTER,
+    NLA_F_NESTED,
     NLM_F_ACK,
     NLM_F_DUMP,
     NLM_F_EXCL,
     NLM_F_REQUEST,
     NLMSG_ERROR,
+    nla_encode,
+    nla_iter,
 )
 from pyroute2.netlink.exceptions import IPSetError, NetlinkError
 from pyroute2.netlink.nfnetlink import NFNL_SUBSYS_IPSET
 from pyroute2.netlink.nfnetlink.ipset import (
+    IPSET_ATTR_ADT,
+    IPSET_ATTR_DATA,
+    IPSET_ATTR_LINENO,
     IPSET_CMD_ADD,
     IPSET_CMD_CREATE,
     IPSET_CMD_DEL,
@@ -64,7 +89,60 @@ from pyroute2.netlink.nfnetlink.ipset import (
     IPSET_FLAG_WITH_SKBINFO,
     ipset_msg,
 )
-from pyroute2.netlink.nlsocket import NetlinkSocket
+from pyroute2.netlink.nlsocket import NetlinkPipeline, NetlinkSocket
+
+# the max bulk request size: the kernel returns the whole request
+# with the error, and the reply must fit into one datagram
+IPSET_MAX_REQUEST_SIZE = 65536 - 20
+
+
+def _compile_data_map(cls):
+    # NLA name -> (type with flags, format, nested map / struct format)
+    ret = {}
+    for idx, item in enumerate(cls.nla_map):
+        if not isinstance(item[0], int):
+            item = (idx,) + tuple(item)
+        nla_type, name, fmt = item[:3]
+        nla_type |= item[3] if len(item) > 3 else 0
+        nla_class = getattr(cls, fmt, None)
+        nla_type |= getattr(nla_class, 'nla_flags', 0)
+        spec = None
+        if getattr(nla_class, 'nla_map', None):
+            spec = _compile_data_map(nla_class)
+        elif fmt not in ('asciiz', 'ip4addr', 'ip6addr'):
+            fields = getattr(nla_class, 'fields', ())
+            if len(fields) != 1 or 'encode' in vars(nla_class):
+                continue
+            spec = fields[0][1]
+        ret[name] = (nla_type, fmt, spec)
+    return ret
+
+
+_data_map = _compile_data_map(ipset_msg.ipset_generic.adt_data)
+
+
+def _encode_data_attrs(nla_map, attrs):
+    '''
+    Encode the IPSET_ATTR_DATA attributes without creating NLA
+    objects. Raises `KeyError` for unsupported attributes.
+    '''
+    ret = []
+    for name, value in attrs:
+        nla_type, fmt, spec = nla_map[name]
+        if isinstance(spec, dict):
+            payload = _encode_data_attrs(spec, value['attrs'])
+        elif fmt == 'ip4addr':
+            payload = socket.inet_pton(socket.AF_INET, value)
+        elif fmt == 'ip6addr':
+            payload = socket.inet_pton(socket.AF_INET6, value)
+        elif fmt == 'asciiz':
+            payload = value.encode('utf-8') + b'\0'
+        elif isinstance(value, (tuple, list)):
+            payload = struct.pack(spec, *value)
+        else:
+            payload = struct.pack(spec, value)
+        ret.append(nla_encode(nla_type, payload))
+    return b''.join(ret)
 
 
 def _nlmsg_error(msg):
@@ -101,6 +179,38 @@ class PortEntry(object):
         self.protocol = protocol
 
 
+class IPSetPipeline(NetlinkPipeline):
+    '''
+    `NetlinkPipeline` for the ipset requests. The errors are
+    :class:`IPSetError` instances with the `lineno` attribute: the
+    number of the failed entry if the kernel reports it, or `None`.
+    '''
+
+    def __init__(self, sock, cmd, max_size, window=256, bufsize=65536):
+        self.cmd = cmd
+        # the error messages carry the whole request
+        self.ack_size = max(self.ack_size, max_size)
+        super().__init__(sock, window, bufsize)
+
+    def decode_error(self, data, msg_seq):
+        (code,) = struct.unpack_from('i', data, 16)
+        error = _IPSetError(abs(code), cmd=self.cmd)
+        error.lineno = None
+        if len(data) < 40:
+            return error
+        # the original request follows the error code; on a bulk
+        # request the kernel puts the number of the failed entry
+        # into the top level IPSET_ATTR_LINENO
+        (length,) = struct.unpack_from('I', data, 20)
+        end = min(len(data), 20 + length)
+        for nla_type, start, stop in nla_iter(data, 40, end):
+            if nla_type == IPSET_ATTR_LINENO and stop - start >= 4:
+                error.lineno = struct.unpack_from('>I', data, start)[0]
+                error.lineno = error.lineno or None
+                break
+        return error
+
+
 class IPSet(NetlinkSocket):
     '''
     NFNetlink socket (family=NETLINK_NETFILTER).
@@ -386,16 +496,13 @@ class IPSet(NetlinkSocket):
 
         return attrs
 
-    def _add_delete_test(
+    def _data_attrs(
         self,
-        name,
         entry,
-        family,
-        cmd,
-        exclusive,
+        etype,
+        ip_version,
         comment=None,
         timeout=None,
-        etype="ip",
         packets=None,
         bytes=None,
         skbmark=None,
@@ -403,21 +510,19 @@ class IPSet(NetlinkSocket):
         skbqueue=None,
         wildcard=False,
         physdev=False,
+        lineno=None,
     ):
-        excl_flag = NLM_F_EXCL if exclusive else 0
         adt_flags = 0
         if wildcard:
             adt_flags |= IPSET_FLAG_IFACE_WILDCARD
         if physdev:
             adt_flags |= IPSET_FLAG_PHYSDEV
 
-        ip_version = self._family_to_version(family)
         data_attrs = self._entry_to_data_attrs(entry, etype, ip_version)
         if comment is not None:
-            data_attrs += [
-                ["IPSET_ATTR_COMMENT", comment],
-                ["IPSET_ATTR_CADT_LINENO", 0],
-            ]
+            data_attrs += [["IPSET_ATTR_COMMENT", comment]]
+        if comment is not None or lineno is not None:
+            data_attrs += [["IPSET_ATTR_CADT_LINENO", lineno or 0]]
         if timeout is not None:
             data_attrs += [["IPSET_ATTR_TIMEOUT", timeout]]
         if bytes is not None:
@@ -432,6 +537,14 @@ class IPSet(NetlinkSocket):
             data_attrs += [["IPSET_ATTR_SKBQUEUE", skbqueue]]
         if adt_flags:
             data_attrs += [["IPSET_ATTR_CADT_FLAGS", adt_flags]]
+        return data_attrs
+
+    def _add_delete_test(
+        self, name, entry, family, cmd, exclusive, etype="ip", **kwargs
+    ):
+        excl_flag = NLM_F_EXCL if exclusive else 0
+        ip_version = self._family_to_version(family)
+        data_attrs = self._data_attrs(entry, etype, ip_version, **kwargs)
         msg = ipset_msg()
         msg['attrs'] = [
             ['IPSET_ATTR_PROTOCOL', self._proto_version],
@@ -446,6 +559,131 @@ class IPSet(NetlinkSocket):
             terminate=_nlmsg_error,
         )
 
+    def _bulk_header(self, name, lineno):
+        # encoded message header and the common attributes
+        msg = ipset_msg()
+        msg['nfgen_family'] = self._nfgen_family
+        msg['attrs'] = [
+            ['IPSET_ATTR_PROTOCOL', self._proto_version],
+            ['IPSET_ATTR_SETNAME', name],
+        ]
+        if lineno:
+            msg['attrs'].append(['IPSET_ATTR_LINENO', 0])
+        msg.encode()
+        return bytes(msg.data)
+
+    def _bulk_data(self, entries, family, etype, kwargs):
+        # encoded IPSET_ATTR_DATA for every entry, numbered from 1
+        # with IPSET_ATTR_CADT_LINENO; the attribute type is the
+        # same both at the top level and in IPSET_ATTR_ADT
+        ip_version = self._family_to_version(family)
+        ret = []
+        for lineno, entry in enumerate(entries, 1):
+            options = kwargs
+            if isinstance(entry, dict):
+                options = dict(kwargs)
+                options.update(entry)
+                entry = options.pop('entry')
+            data_attrs = self._data_attrs(
+                entry, etype, ip_version, lineno=lineno, **options
+            )
+            try:
+                ret.append(
+                    nla_encode(
+                        IPSET_ATTR_DATA | NLA_F_NESTED,
+                        _encode_data_attrs(_data_map, data_attrs),
+                    )
+                )
+            except KeyError:
+                adt = ipset_msg.attr_adt()
+                adt['attrs'] = [['IPSET_ATTR_DATA', {'attrs': data_attrs}]]
+                adt.encode()
+                ret.append(bytes(adt.data)[4:])
+        return ret
+
+    async def _bulk_adt(self, name, cmd, items, msg_flags, max_size, window):
+        header = self._bulk_header(name, lineno=True)
+        msg_type = cmd | (NFNL_SUBSYS_IPSET << 8)
+        max_size = min(max_size, IPSET_MAX_REQUEST_SIZE)
+        max_payload = max_size - len(header) - 4
+        ret = [None] * len(items)
+        # (start, stop, limit): the range of entries to send, and
+        # the max number of entries per message
+        todo = [(0, len(items), len(items))]
+        while todo:
+            pipeline = IPSetPipeline(self.asyncore, cmd, max_size, window)
+            for start, stop, limit in todo:
+                while start < stop:
+                    end = start + 1
+                    size = len(items[start])
+                    while (
+                        end < stop
+                        and end - start < limit
+                        and size + len(items[end]) <= max_payload
+                    ):
+                        size += len(items[end])
+                        end += 1
+                    adt = struct.pack(
+                        'HH', size + 4, IPSET_ATTR_ADT | NLA_F_NESTED
+                    )
+                    await pipeline.put(
+                        b''.join([header, adt] + items[start:end]),
+                        msg_type,
+                        msg_flags,
+                        (start, end),
+                    )
+                    start = end
+            todo = []
+            for (start, end), error in await pipeline.finish():
+                if error is None:
+                    continue
+                if error.lineno is None or not start < error.lineno <= end:
+                    ret[start:end] = [error] * (end - start)
+                    continue
+                # the entries before the failed one are done, send
+                # the rest again; limit the messages by the number
+                # of done entries, so dense errors don't make the
+                # same entries to be sent again and again
+                ret[error.lineno - 1] = error
+                if error.lineno < end:
+                    todo.append(
+                        (error.lineno, end, max(1, error.lineno - 1 - start))
+                    )
+        return ret
+
+    async def _bulk_test(self, name, items, window):
+        header = self._bulk_header(name, lineno=False)
+        msg_type = IPSET_CMD_TEST | (NFNL_SUBSYS_IPSET << 8)
+        ret = [None] * len(items)
+        pipeline = IPSetPipeline(
+            self.asyncore, IPSET_CMD_TEST, IPSET_MAX_REQUEST_SIZE, window
+        )
+        for idx, item in enumerate(items):
+            await pipeline.put(header + item, msg_type, NLM_F_REQUEST, idx)
+        for idx, error in await pipeline.finish():
+            ret[idx] = error
+        return ret
+
+    def _bulk(
+        self,
+        name,
+        cmd,
+        entries,
+        family,
+        exclusive,
+        etype,
+        max_size,
+        window,
+        kwargs,
+    ):
+        items = self._bulk_data(entries, family, etype, kwargs)
+        msg_flags = NLM_F_REQUEST | NLM_F_ACK
+        if exclusive:
+            msg_flags |= NLM_F_EXCL
+        return self.asyncore.event_loop.run_until_complete(
+            self._bulk_adt(name, cmd, items, msg_flags, max_size, window)
+        )
+
     def add(
         self,
         name,
@@ -544,6 +782,105 @@ class IPSet(NetlinkSocket):
                 return False
             raise e
 
+    def add_many(
+        self,
+        name,
+        entries,
+        family=socket.AF_INET,
+        exclusive=True,
+        etype="ip",
+        max_size=IPSET_MAX_REQUEST_SIZE,
+        window=256,
+        **kwargs
+    ):
+        '''
+        Add many members to the ipset.
+
+        `entries` is an iterable of entries like for :func:`add`, or of
+        dicts with the `entry` key and per-entry options: `comment`,
+        `timeout`, `skbmark` etc. The rest of the keyword arguments are
+        the default options for all the entries.
+
+        The entries are packed into messages up to `max_size` bytes,
+        and up to `window` messages are in flight.
+
+        Returns a list with one item per entry, in the same order:
+        `None` if the entry is added, or :class:`IPSetError` with the
+        `lineno` attribute, the entry number starting from 1::
+
+            ipset = IPSet()
+            ipset.create("foo", stype="hash:ip")
+            errors = ipset.add_many(
+                "foo",
+                [
+                    "198.51.100.1",
+                    {"entry": "198.51.100.2", "timeout": 30},
+                ],
+            )
+        '''
+        return self._bulk(
+            name,
+            IPSET_CMD_ADD,
+            entries,
+            family,
+            exclusive,
+            etype,
+            max_size,
+            window,
+            kwargs,
+        )
+
+    def delete_many(
+        self,
+        name,
+        entries,
+        family=socket.AF_INET,
+        exclusive=True,
+        etype="ip",
+        max_size=IPSET_MAX_REQUEST_SIZE,
+        window=256,
+    ):
+        '''
+        Delete many members from the ipset.
+
+        See :func:`add_many` for the arguments and the return value.
+        '''
+        return self._bulk(
+            name,
+            IPSET_CMD_DEL,
+            entries,
+            family,
+            exclusive,
+            etype,
+            max_size,
+            window,
+            {},
+        )
+
+    def test_many(
+        self, name, entries, family=socket.AF_INET, etype="ip", window=256
+    ):
+        '''
+        Test many entries, return a list of booleans in the same
+        order as the entries.
+
+        The kernel accepts only one entry per a test request, so the
+        entries are sent one per message, but without waiting for the
+        ACK on every one.
+        '''
+        items = self._bulk_data(entries, family, etype, {})
+        ret = []
+        for error in self.asyncore.event_loop.run_until_complete(
+            self._bulk_test(name, items, window)
+        ):
+            if error is None:
+                ret.append(True)
+            elif error.code == IPSET_ERR_EXIST:
+                ret.append(False)
+            else:
+                raise error
+        return ret
+
     def swap(self, set_a, set_b):
         '''
         Swap two ipsets. They must have compatible content type.
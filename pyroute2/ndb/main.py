@@ -274,6 +274,7 @@ import ctypes.util
 import logging
 import logging.handlers
 import threading
+import time
 
 from pyroute2.common import basestring
 
@@ -282,8 +283,8 @@ from pyroute2.common import basestring
 from .auth_manager import AuthManager
 from .events import ShutdownException
 from .messages import cmsg
-from .schema import DBProvider
-from .task_manager import TaskManager
+from .storage import DBProvider
+from .task_manager import TRANSACTION_SIZE, TaskManager
 from .transaction import Transaction
 from .view import SourcesView, View
 
@@ -298,6 +299,8 @@ except ImportError:
     import Queue as queue
 
 log = logging.getLogger(__name__)
+# the events queue limit in bytes, see MemoryQueue
+QUEUE_MEMORY = 16 * 1024 * 1024
 
 
 NDB_VIEWS_SPECS = (
@@ -412,9 +415,54 @@ class DeadEnd:
         raise ShutdownException('shutdown in progress')
 
 
+class MemoryQueue(queue.Queue):
+    '''
+    A queue limited by the netlink size of the queued events, not
+    by the number of the queued batches: one batch from a dump or
+    a route storm may contain thousands of messages.
+
+    A batch is accepted while the limit is not reached, thus a batch
+    bigger than the limit doesn't block forever. `qsize()` returns
+    the number of the queued batches.
+    '''
+
+    def _init(self, maxsize):
+        super()._init(maxsize)
+        self.memory = 0
+        self.memory_max = 0
+        # the time the last batch spent in the queue
+        self.latency = 0
+
+    def _qsize(self):
+        return self.memory
+
+    def _put(self, item):
+        cost = 1
+        if isinstance(item[1], (tuple, list)):
+            for msg in item[1]:
+                header = (
+                    dict.get(msg, 'header') if isinstance(msg, dict) else None
+                )
+                if isinstance(header, dict):
+                    cost += dict.get(header, 'length', 0)
+        self.queue.append((cost, time.time(), item))
+        self.memory += cost
+        self.memory_max = max(self.memory_max, self.memory)
+
+    def _get(self):
+        cost, stamp, item = self.queue.popleft()
+        self.memory -= cost
+        self.latency = time.time() - stamp
+        return item
+
+    def qsize(self):
+        with self.mutex:
+            return len(self.queue)
+
+
 class EventQueue:
-    def __init__(self, *argv, **kwarg):
-        self._bypass = self._queue = queue.Queue(*argv, **kwarg)
+    def __init__(self, memory=QUEUE_MEMORY):
+        self._bypass = self._queue = MemoryQueue(memory)
 
     def put(self, msg, source=None):
         return self._queue.put((source, msg))
@@ -431,6 +479,18 @@ class EventQueue:
     def qsize(self):
         return self._bypass.qsize()
 
+    @property
+    def memory(self):
+        return self._bypass.memory
+
+    @property
+    def memory_max(self):
+        return self._bypass.memory_max
+
+    @property
+    def latency(self):
+        return self._bypass.latency
+
 
 class AuthProxy:
     def __init__(self, ndb, auth_managers):
@@ -458,6 +518,9 @@ class NDB:
         log=False,
         auto_netns=False,
         libc=None,
+        queue_memory=QUEUE_MEMORY,
+        transaction_size=TRANSACTION_SIZE,
+        coalesce_window=None,
     ):
         if db_provider == 'postgres':
             db_provider = 'psycopg2'
@@ -473,7 +536,7 @@ class NDB:
         self._dbm_ready = threading.Event()
         self._dbm_shutdown = threading.Event()
         self._global_lock = threading.Lock()
-        self._event_queue = EventQueue(maxsize=100)
+        self._event_queue = EventQueue(queue_memory)
         self.messenger = None
         #
         if log:
@@ -517,7 +580,9 @@ class NDB:
             'auto_netns': auto_netns,
             'recordset_pipe': 'false',
         }
-        self.task_manager = TaskManager(self)
+        self.task_manager = TaskManager(
+            self, transaction_size, coalesce_window
+        )
         self._dbm_thread = threading.Thread(
             target=self.task_manager.run, name='NDB main loop'
         )
@@ -577,6 +642,16 @@ class NDB:
     def backup(self, spec):
         self.task_manager.db_backup(spec)
 
+    def metrics(self):
+        '''
+        Return the events pipeline metrics: the queue depth in
+        batches and in bytes, the number of the loaded events and
+        DB transactions, and the latency per stage -- the CPU time
+        the sources spend to receive and parse a batch, the time
+        spent in the queue, by the handlers, and by the commit.
+        '''
+        return self.task_manager.metrics()
+
     def reload(self, kinds=None):
         for source in self.sources.values():
             if kinds is not None and source.kind in kinds:
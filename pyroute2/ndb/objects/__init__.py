@@ -77,7 +77,7 @@ from pyroute2.requests.main import RequestProcessor
 from ..auth_manager import AuthManager, check_auth
 from ..events import InvalidateHandlerException, State
 from ..messages import cmsg_event
-from ..report import Record
+from ..report import Record, SQLRequest
 
 RSLV_IGNORE = 0
 RSLV_RAISE = 1
@@ -230,10 +230,15 @@ class RTNL_Object(dict):
             fnames,
             cls.table,
         )
-        yield names
         where, values = cls._dump_where(view)
-        for record in view.ndb.task_manager.db_fetch(req + where, values):
-            yield record
+        return SQLRequest(
+            view.ndb.task_manager.db_fetch,
+            view.ndb.schema.plch,
+            names,
+            req + where,
+            values,
+            cls,
+        )
 
     @classmethod
     def summary(cls, view):
@@ -621,25 +626,21 @@ class RTNL_Object(dict):
                 fetch.append('f_%s' % name)
 
         if fetch:
-            keys = []
-            values = []
+            fields = {}
             for name, value in key.items():
                 nla_name = self.iclass.name2nla(name)
                 if nla_name in self.spec:
                     name = nla_name
                 if value is not None and name in self.spec:
-                    keys.append('f_%s = %s' % (name, self.schema.plch))
-                    values.append(value)
-            spec = self.ndb.task_manager.db_fetchone(
-                'SELECT %s FROM %s WHERE %s'
-                % (' , '.join(fetch), self.etable, ' AND '.join(keys)),
-                values,
-            )
+                    fields[name] = value
+            spec = None
+            for spec in self.ndb.task_manager.db_lookup(self.etable, fields):
+                break
             if spec is None:
                 self.log.debug('got none')
                 return None
-            for name, value in zip(fetch, spec):
-                key[name[2:]] = value
+            for name in fetch:
+                key[name[2:]] = spec[self.spec.index(name[2:])]
 
         self.log.debug('got %s' % key)
         return key
@@ -1112,18 +1113,16 @@ class RTNL_Object(dict):
                 table = self.etable
             else:
                 table = '%s_%s' % (self.table, ctxid)
-        keys = []
-        values = []
+        key = {}
 
         for name, value in self.key.items():
-            keys.append('f_%s = %s' % (name, self.schema.plch))
             if isinstance(value, (list, tuple, dict)):
                 value = json.dumps(value)
-            values.append(value)
+            key[name] = value
 
-        spec = self.ndb.task_manager.db_fetchone(
-            'SELECT * FROM %s WHERE %s' % (table, ' AND '.join(keys)), values
-        )
+        spec = None
+        for spec in self.ndb.task_manager.db_lookup(table, key):
+            break
         self.log.debug('load_sql load: %s' % str(spec))
         self.log.debug('load_sql names: %s' % str(self.names))
         if set_state:
@@ -223,6 +223,8 @@ def load_ifaddrmsg(schema, target, event):
 ifaddr_spec = (
     ifaddrmsg.sql_schema()
     .unique_index('family', 'prefixlen', 'index', 'IFA_ADDRESS', 'IFA_LOCAL')
+    .lookup_index('index')
+    .lookup_index('IFA_ADDRESS')
     .foreign_key(
         'interfaces',
         ('f_target', 'f_tflags', 'f_index'),
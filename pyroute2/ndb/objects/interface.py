@@ -309,7 +309,11 @@ def load_ifinfmsg(schema, target, event):
 ip_tunnels = ('gre', 'gretap', 'ip6gre', 'ip6gretap', 'ip6tnl', 'sit', 'ipip')
 
 schema_ifinfmsg = (
-    ifinfmsg.sql_schema().push('alt_ifname_list', 'TEXT').unique_index('index')
+    ifinfmsg.sql_schema()
+    .push('alt_ifname_list', 'TEXT')
+    .unique_index('index')
+    .lookup_index('IFLA_IFNAME')
+    .lookup_index('IFLA_ADDRESS')
 )
 
 schema_brinfmsg = (
@@ -37,6 +37,7 @@ def load_ndmsg(schema, target, event):
 ndmsg_schema = (
     ndmsg.sql_schema()
     .unique_index('ifindex', 'NDA_DST', 'NDA_VLAN')
+    .lookup_index('NDA_DST')
     .constraint('NDA_DST', "NOT NULL DEFAULT ''")
     .constraint('NDA_VLAN', "NOT NULL DEFAULT 0")
     .foreign_key(
@@ -49,6 +50,7 @@ ndmsg_schema = (
 brmsg_schema = (
     ndmsg.sql_schema()
     .unique_index('ifindex', 'flags', 'NDA_DST', 'NDA_LLADDR', 'NDA_VLAN')
+    .lookup_index('NDA_LLADDR')
     .constraint('NDA_LLADDR', "NOT NULL DEFAULT ''")
     .constraint('NDA_DST', "NOT NULL DEFAULT ''")
     .constraint('NDA_VLAN', "NOT NULL DEFAULT 0")
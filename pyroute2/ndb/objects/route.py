@@ -134,20 +134,19 @@ F_RTA_METRICS = 4
 
 
 def get_route_id(schema, target, event):
-    keys = ['f_target = %s' % schema.plch]
-    values = [target]
-    for key in schema.indices['routes']:
-        keys.append('f_%s = %s' % (key, schema.plch))
-        values.append(event.get(key) or event.get_attr(key))
-    #
-    spec = 'WHERE %s' % ' AND '.join(keys)
-    s_req = 'SELECT f_route_id FROM routes %s' % spec
+    spec = dict(
+        zip(schema.indices['routes'], schema.netlink_key('routes', event))
+    )
+    spec['target'] = target
     #
-    # get existing route_id
-    for route_id in schema.execute(s_req, values).fetchall():
+    # get existing route_id; select() uses the storage indices,
+    # if any, so the route events don't run SQL
+    rid = schema.compiled['routes']['all_names'].index('route_id')
+    for route in schema.select('routes', spec):
         #
         # if exists
-        return route_id[0][0]
+        if route[rid] is not None:
+            return route[rid]
     #
     # or create a new route_id
     return str(uuid.uuid4())
@@ -326,6 +325,10 @@ rt_schema = (
         'RTA_VIA',
         'RTA_NEWDST',
     )
+    .lookup_index('RTA_DST')
+    .lookup_index('RTA_OIF')
+    .lookup_index('RTA_IIF')
+    .lookup_index('RTA_GATEWAY')
     .foreign_key(
         'interfaces',
         ('f_target', 'f_tflags', 'f_RTA_OIF'),
@@ -343,6 +346,7 @@ nh_schema = (
     .push('route_id', 'TEXT')
     .push('nh_id', 'INTEGER')
     .unique_index('route_id', 'nh_id')
+    .lookup_index('oif')
     .foreign_key('routes', ('f_route_id',), ('f_route_id',))
     .foreign_key(
         'interfaces',
@@ -38,6 +38,7 @@ Filtering example:
 import json
 import warnings
 from itertools import chain
+from operator import itemgetter
 
 from pyroute2 import cli
 
@@ -101,11 +102,15 @@ def format_csv(dump, headless=False):
 
 class Record:
     def __init__(self, names, values, ref_class=None):
-        self._names = tuple(names)
-        self._values = tuple(values)
-        if len(self._names) != len(self._values):
+        names = tuple(names)
+        values = tuple(values)
+        if len(names) != len(values):
             raise ValueError('names and values must have the same length')
-        self._ref_class = ref_class
+        # bypass __setattr__(), records are created in bulk
+        data = self.__dict__
+        data['_names'] = names
+        data['_values'] = values
+        data['_ref_class'] = ref_class
 
     def __getitem__(self, key):
         idx = len(self._names)
@@ -117,11 +122,10 @@ class Record:
     def __setitem__(self, *argv, **kwarg):
         raise TypeError('immutable object')
 
-    def __getattribute__(self, key):
+    def __getattr__(self, key):
         if key.startswith('_'):
-            return object.__getattribute__(self, key)
-        else:
-            return self[key]
+            raise AttributeError(key)
+        return self[key]
 
     def __setattr__(self, key, value):
         if not key.startswith('_'):
@@ -180,6 +184,153 @@ class Record:
             return all(x[0] == x[1] for x in zip(self._values, right))
 
 
+def join_fields(on):
+    '''
+    Normalize the `on` spec of an equi-join to a tuple of
+    `(left_field, right_field)` pairs.
+    '''
+    if isinstance(on, str):
+        on = (on,)
+    elif len(on) == 2 and all(isinstance(x, str) for x in on):
+        on = (on,)
+    ret = []
+    for pair in on:
+        if isinstance(pair, str):
+            pair = (pair, pair)
+        if len(pair) != 2:
+            raise ValueError('join fields must be pairs')
+        ret.append(tuple(pair))
+    return tuple(ret)
+
+
+def last_index(names, name):
+    # the last field wins, like in Record.__getitem__()
+    for idx in range(len(names) - 1, -1, -1):
+        if names[idx] == name:
+            return idx
+
+
+class RecordKey:
+    '''
+    Get a tuple of field values from records. The field positions
+    are resolved once per the record names tuple.
+    '''
+
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+        self.names = None
+        self.getter = None
+
+    def __call__(self, record):
+        if record._names is not self.names:
+            self.names = record._names
+            idx = [last_index(self.names, x) for x in self.fields]
+            if None in idx:
+                self.getter = lambda r: tuple(r[x] for x in self.fields)
+            elif len(idx) == 1:
+                self.getter = lambda r, i=idx[0]: (r._values[i],)
+            else:
+                getter = itemgetter(*idx)
+                self.getter = lambda r: getter(r._values)
+        return self.getter(record)
+
+
+class SQLRequest:
+    '''
+    A deferred SQL request to build records from. Simple filters
+    and equi-joins with other requests to the same DB are compiled
+    into the SQL instead of being run over the records in Python.
+
+    Iteration returns the field names first, and then the DB rows,
+    as the object classes `summary()` and `dump()` do.
+    '''
+
+    def __init__(
+        self, fetch, plch, names, request, values=None, ref_class=None
+    ):
+        self.fetch = fetch
+        self.plch = plch
+        self.names = tuple(names)
+        self.request = request
+        self.values = list(values or [])
+        self.ref_class = ref_class
+
+    def __iter__(self):
+        yield self.names
+        for record in self.fetch(self.request, self.values):
+            yield record
+
+    def records(self):
+        for record in self.fetch(self.request, self.values):
+            yield Record(self.names, record, self.ref_class)
+
+    def columns(self):
+        return ', '.join(['c%i' % x for x in range(len(self.names))])
+
+    def column(self, name):
+        return 'c%i' % last_index(self.names, name)
+
+    def match(self, spec):
+        '''
+        Check if the spec can be compiled into a WHERE clause.
+        '''
+        for key, value in spec.items():
+            if key not in self.names:
+                return False
+            if value is not None and not isinstance(value, (int, str)):
+                return False
+        return True
+
+    def where(self, spec):
+        conditions = []
+        values = []
+        for key, value in spec.items():
+            if value is None:
+                conditions.append('rs.%s IS NULL' % self.column(key))
+            else:
+                conditions.append('rs.%s = %s' % (self.column(key), self.plch))
+                values.append(value)
+        request = '''
+                  WITH rs (%s) AS (%s)
+                  SELECT * FROM rs WHERE %s
+                  ''' % (
+            self.columns(),
+            self.request,
+            ' AND '.join(conditions),
+        )
+        return SQLRequest(
+            self.fetch,
+            self.plch,
+            self.names,
+            request,
+            self.values + values,
+            self.ref_class,
+        )
+
+    def join(self, right, on, prefix=''):
+        conditions = [
+            'l.%s = r.%s' % (self.column(x), right.column(y)) for x, y in on
+        ]
+        request = '''
+                  WITH l (%s) AS (%s), r (%s) AS (%s)
+                  SELECT l.*, r.* FROM l INNER JOIN r ON %s
+                  ''' % (
+            self.columns(),
+            self.request,
+            right.columns(),
+            right.request,
+            ' AND '.join(conditions),
+        )
+        return SQLRequest(
+            self.fetch,
+            self.plch,
+            self.names + tuple(['%s%s' % (prefix, x) for x in right.names]),
+            request,
+            self.values + right.values,
+            self.ref_class,
+        )
+
+
 class BaseRecordSet(object):
     def __init__(self, generator, ellipsis='(...)'):
         self.generator = generator
@@ -237,14 +388,32 @@ class RecordSet(BaseRecordSet):
 
     RecordSet filters also return objects of this class, thus making possible
     to make chains of filters.
+
+    If the record set is built from an SQL request, constant filters
+    and equi-joins with other record sets from the same NDB are done
+    by the DB as long as the iteration is not started yet, and there
+    are no Python filters before them.
     '''
 
-    def __init__(self, generator, config=None, ellipsis=True):
+    def __init__(self, generator, config=None, ellipsis=True, request=None):
         super().__init__(generator, ellipsis)
         self.filters = []
         self.config = RecordSetConfig(config) if config is not None else {}
+        self.request = request
+        self.started = False
+
+    def _request(self):
+        # an SQL request that still may be modified, or None
+        if self.started or self.filters:
+            return None
+        return self.request
+
+    def _pipe(self):
+        if self.config.get('recordset_pipe'):
+            return RecordSet(self, config=self.config, request=self._request())
 
     def __next__(self):
+        self.started = True
         while True:
             record = next(self.generator)
             for f in self.filters:
@@ -273,8 +442,7 @@ class RecordSet(BaseRecordSet):
             2,'eth0'
         '''
         self.filters.append(lambda x: x._select_fields(*fields))
-        if self.config.get('recordset_pipe'):
-            return RecordSet(self, config=self.config)
+        return self._pipe()
 
     @cli.show_result
     def select_records(self, f=None, **spec):
@@ -293,10 +461,17 @@ class RecordSet(BaseRecordSet):
 
             'target','tflags','ifname','address','prefixlen'
             'localhost',0,'eth0','192.168.122.28',24
+
+        A spec of constants only is compiled into the SQL request
+        when possible.
         '''
-        self.filters.append(lambda x: x if x._match(f, **spec) else None)
-        if self.config.get('recordset_pipe'):
-            return RecordSet(self, config=self.config)
+        request = self._request()
+        if f is None and spec and request is not None and request.match(spec):
+            self.request = request.where(spec)
+            self.generator = self.request.records()
+        else:
+            self.filters.append(lambda x: x if x._match(f, **spec) else None)
+        return self._pipe()
 
     @cli.show_result
     def transform_fields(self, **kwarg):
@@ -321,8 +496,7 @@ class RecordSet(BaseRecordSet):
             'eth0','192.168.122.28/24'
         '''
         self.filters.append(lambda x: x._transform_fields(**kwarg))
-        if self.config.get('recordset_pipe'):
-            return RecordSet(self, config=self.config)
+        return self._pipe()
 
     @cli.show_result
     def transform(self, **kwarg):
@@ -376,8 +550,43 @@ class RecordSet(BaseRecordSet):
         return RecordSet(g())
 
     @cli.show_result
-    def join(self, right, condition=lambda r1, r2: True, prefix=''):
+    def join(self, right, condition=None, prefix='', on=None):
+        '''
+        Join the records with the records from the right, where the
+        `on` fields are equal. The `on` spec is a field name, a pair
+        of `(left, right)` names, or a list of those. The right fields
+        names get the `prefix`:
+
+        .. testcode::
+
+            report = ndb.addresses.dump()
+            report.select_records(family=2)
+            report = report.join(
+                ndb.interfaces.dump(), on=('index', 'index'), prefix='if_'
+            )
+            report.select_fields('address', 'prefixlen', 'if_ifname')
+            for line in report.format('csv'):
+                print(line)
+
+        .. testoutput::
+
+            'address','prefixlen','if_ifname'
+            '127.0.0.1',8,'lo'
+            '192.168.122.28',24,'eth0'
+
+        Like in SQL, `None` values never match. The join is done by the
+        DB when both the record sets are SQL requests to the same NDB,
+        otherwise the right records are loaded into a hash table.
+
+        The optional `condition(left, right)` is checked for the matched
+        pairs. Without `on`, the condition is checked for every pair of
+        the records; this mode is deprecated.
+        '''
+        if on is not None:
+            return self._join(right, join_fields(on), condition, prefix)
         warnings.warn(deprecation_notice, DeprecationWarning)
+        if condition is None:
+            condition = lambda r1, r2: True  # noqa: E731
         # fetch all the records from the right
         # ACHTUNG it may consume a lot of memory
         right = tuple(right)
@@ -397,6 +606,54 @@ class RecordSet(BaseRecordSet):
 
         return RecordSet(g())
 
+    def _join(self, right, on, condition, prefix):
+        left_request = self._request()
+        right_request = None
+        if isinstance(right, RecordSet):
+            right_request = right._request()
+        if (
+            condition is None
+            and left_request is not None
+            and right_request is not None
+            and left_request.fetch is right_request.fetch
+            and all(x in left_request.names for x, _ in on)
+            and all(y in right_request.names for _, y in on)
+        ):
+            request = left_request.join(right_request, on, prefix)
+            return RecordSet(
+                request.records(), config=self.config, request=request
+            )
+
+        def g():
+            index = {}
+            key = RecordKey([y for _, y in on])
+            for r2 in right:
+                value = key(r2)
+                if None not in value:
+                    index.setdefault(value, []).append(r2)
+            key = RecordKey([x for x, _ in on])
+            names = (None, None, None)
+            for r1 in self:
+                for r2 in index.get(key(r1), ()):
+                    if condition is not None and not condition(r1, r2):
+                        continue
+                    if r1._names is not names[0] or r2._names is not names[1]:
+                        names = (
+                            r1._names,
+                            r2._names,
+                            tuple(
+                                chain(
+                                    r1._names,
+                                    ['%s%s' % (prefix, x) for x in r2._names],
+                                )
+                            ),
+                        )
+                    yield Record(
+                        names[2], r1._values + r2._values, r1._ref_class
+                    )
+
+        return RecordSet(g(), config=self.config)
+
     @cli.show_result
     def format(self, kind):
         '''
@@ -27,6 +27,20 @@ module::
               db_spec={'dbname': 'test',
                        'host': 'db1.example.com'})
 
+For the hosts that do many lookups, there is a lookup cache on top
+of SQLite3: the objects are looked up in Python dicts without SQL
+requests, see :ref:`ndbstorage`::
+
+    # SQLite3 in memory with the lookup cache
+    ndb = NDB(db_provider='sqlite3_cache')
+
+The hosts that use NDB only as a live cache may keep the records
+in Python dicts, and SQLite3 only as a write-behind copy for the
+reports and joins::
+
+    # Python dicts, SQLite3 in memory for SQL requests
+    ndb = NDB(db_provider='native')
+
 Database backup
 ---------------
 
@@ -117,7 +131,6 @@ all the tables from the DB, and NDB will create them from scratch
 on startup.
 '''
 
-import enum
 import json
 import random
 import sqlite3
@@ -130,14 +143,19 @@ from functools import partial
 from pyroute2 import config
 from pyroute2.common import basestring, uuid32
 from pyroute2.netlink import NLM_F_REPLACE
+from pyroute2.netlink.rtnl import (
+    RTM_DELADDR,
+    RTM_DELLINK,
+    RTM_DELNEIGH,
+    RTM_DELNETNS,
+    RTM_DELROUTE,
+    RTM_DELRULE,
+    RTM_VALUES,
+)
 
 #
 from .objects import address, interface, neighbour, netns, probe, route, rule
-
-try:
-    import psycopg2
-except ImportError:
-    psycopg2 = None
+from .storage import DBProvider, get_engine  # noqa: F401
 
 #
 # the order is important
@@ -145,14 +163,27 @@ except ImportError:
 plugins = [interface, address, neighbour, route, netns, rule, probe]
 
 MAX_ATTEMPTS = 5
+MAX_PENDING = 4096
+#
+# create an index after so many lookups by the same fields
+# that end up in a table scan, see DBSchema.select()
+#
+AUTO_INDEX = 16
 
-
-class DBProvider(enum.Enum):
-    sqlite3 = 'sqlite3'
-    psycopg2 = 'psycopg2'
-
-    def __eq__(self, r):
-        return str(self) == r
+#
+# event types to report the objects removed while a source
+# was resyncing, see DBSchema.resync()
+#
+resync_delete = {
+    'interfaces': RTM_DELLINK,
+    'af_bridge_ifs': RTM_DELLINK,
+    'addresses': RTM_DELADDR,
+    'neighbours': RTM_DELNEIGH,
+    'af_bridge_fdb': RTM_DELNEIGH,
+    'routes': RTM_DELROUTE,
+    'rules': RTM_DELRULE,
+    'netns': RTM_DELNETNS,
+}
 
 
 def publish(f):
@@ -229,6 +260,10 @@ class DBSchema:
     event_map = None
     key_defaults = None
     snapshots = None  # <table_name>: <obj_weakref>
+    resync_log = None  # [(table, event), ...] while staging a dump
+    transaction = False
+    pending_statement = None
+    pending = None  # [values, ...] for pending_statement
 
     spec = OrderedDict()
     classes = {}
@@ -238,6 +273,7 @@ class DBSchema:
     # one loop to fetch both index and row values
     #
     indices = {}
+    lookup_indices = {}
     foreign_keys = {}
 
     def __init__(self, config, sources, event_map, log_channel):
@@ -245,10 +281,14 @@ class DBSchema:
         self.sources = sources
         self.config = DBDict(self, 'config')
         self.stats = {}
+        self.storage = None
         self.connection = None
         self.cursor = None
         self.log = log_channel
         self.snapshots = {}
+        self.pending = []
+        self.nla_names = {}
+        self.lookup_scans = {}
         self.key_defaults = {}
         self.event_map = {}
         # cache locally these variables so they will not be
@@ -265,6 +305,7 @@ class DBSchema:
             for name, spec in plugin.init['specs']:
                 self.spec[name] = spec.as_dict()
                 self.indices[name] = spec.index
+                self.lookup_indices[name] = spec.lookup_indices
                 self.foreign_keys[name] = spec.foreign_keys
             #
             # 2. classes
@@ -292,15 +333,10 @@ class DBSchema:
     def initdb(self, config):
         if self.connection is not None:
             self.close()
-        if config['provider'] == DBProvider.sqlite3:
-            self.connection = sqlite3.connect(config['spec'])
-            self.plch = '?'
-            self.connection.execute('PRAGMA foreign_keys = ON')
-        elif config['provider'] == DBProvider.psycopg2:
-            self.connection = psycopg2.connect(**config['spec'])
-            self.plch = '%s'
-        else:
-            raise TypeError('DB provider not supported')
+        self.storage = get_engine(config['provider'], config['spec'])
+        self.connection = self.storage.connect()
+        self.plch = self.storage.plch
+        self.upsert = self.storage.upsert
         self.cursor = self.connection.cursor()
         #
         # compile request lines
@@ -311,6 +347,7 @@ class DBSchema:
                 table, self.spec[table], self.indices[table]
             )
             self.create_table(table)
+        self.storage.setup(self)
         #
         # service tables
         #
@@ -427,6 +464,12 @@ class DBSchema:
         #
         f_set = ['f_%s = %s' % (x, self.plch) for x in all_names]
         #
+        # the same for UPSERT
+        #
+        # e.g.: f_flags = excluded.f_flags, ...
+        #
+        f_excluded = ['f_%s = excluded.f_%s' % (x, x) for x in all_names]
+        #
         # the set of the placeholders to use in the INSERT statements
         #
         plchs = [self.plch] * len(f_names)
@@ -450,6 +493,27 @@ class DBSchema:
         # the same issue with the placeholders
         #
         f_idx_match = ['%s.%s = %s' % (table, x, self.plch) for x in f_idx]
+        #
+        # match the netlink key: the index without tflags, since
+        # the delete events remove records with any tflags
+        #
+        # f_target = ?, f_index = ?
+        #
+        f_key_match = [
+            'f_%s = %s' % (x, self.plch) for x in ('target',) + schema_idx
+        ]
+        #
+        # the netlink events statements
+        #
+        upsert = 'INSERT INTO %s (%s) VALUES (%s) ' % (
+            table,
+            ','.join(f_names),
+            ','.join(plchs),
+        ) + 'ON CONFLICT (%s) DO UPDATE SET %s' % (
+            ','.join(f_idx),
+            ','.join(f_excluded),
+        )
+        delete = 'DELETE FROM %s WHERE %s' % (table, ' AND '.join(f_key_match))
 
         return {
             'names': names,
@@ -460,8 +524,11 @@ class DBSchema:
             'fnames': ','.join(f_names),
             'plchs': ','.join(plchs),
             'fset': ','.join(f_set),
+            'fexcluded': ','.join(f_excluded),
             'knames': ','.join(f_idx),
             'fidx': ' AND '.join(f_idx_match),
+            'upsert': upsert,
+            'delete': delete,
             'lookup_fallbacks': iclass.lookup_fallbacks,
         }
 
@@ -508,7 +575,72 @@ class DBSchema:
                 (target, key, vtype, value),
             )
 
-    def execute(self, *argv, **kwarg):
+    def begin(self):
+        '''
+        Start a batch of writes. The statements are not committed
+        until `commit()`, and the `load_netlink()` writes are
+        queued to run with `executemany()`.
+
+        Only for SQLite3: a failed statement aborts the whole
+        transaction in PostgreSQL, so there every statement is
+        committed as before.
+        '''
+        if self.storage.transactions:
+            self.transaction = True
+
+    def defer(self, statement, values):
+        #
+        # Queue a write: the same subsequent statements run with one
+        # executemany() call. Any other statement flushes the queue
+        # first, so the order of writes is not changed.
+        #
+        if statement != self.pending_statement or self.storage.dirty:
+            self.sync()
+            self.pending_statement = statement
+        self.pending.append(values)
+        if not self.transaction or len(self.pending) >= MAX_PENDING:
+            self.flush_pending()
+
+    def flush_pending(self):
+        if not self.pending:
+            return
+        statement = self.pending_statement
+        pending = self.pending
+        self.pending_statement = None
+        self.pending = []
+        self.executemany(statement, pending)
+
+    def sync(self):
+        '''
+        Write to SQL the queued statements, and then the records
+        that the storage keeps without SQL, see `Storage.flush()`.
+        '''
+        self.flush_pending()
+        for statement, pending in self.storage.flush():
+            self.executemany(statement, pending)
+
+    def executemany(self, statement, pending):
+        try:
+            self.cursor.executemany(statement, pending)
+        except Exception:
+            # the cache has the failed records already
+            self.storage.invalidate()
+            # find the failed records
+            for values in pending:
+                try:
+                    self.cursor.execute(statement, values)
+                except Exception:
+                    self.log.debug('load_netlink: %s %s' % (statement, values))
+                    self.log.error('load_netlink: %s' % traceback.format_exc())
+        finally:
+            if not self.transaction:
+                self.connection.commit()
+
+    def execute(self, *argv, indexed=False, **kwarg):
+        #
+        # indexed: the caller updates the cache itself
+        #
+        self.sync()
         try:
             #
             # FIXME: add logging
@@ -517,7 +649,7 @@ class DBSchema:
                 try:
                     self.cursor.execute(*argv, **kwarg)
                     break
-                except (sqlite3.InterfaceError, sqlite3.OperationalError) as e:
+                except self.storage.retry as e:
                     self.log.debug('%s' % e)
                     #
                     # Retry on:
@@ -530,7 +662,10 @@ class DBSchema:
         except Exception:
             raise
         finally:
-            self.connection.commit()  # no performance optimisation yet
+            if not self.transaction:
+                self.connection.commit()
+        if not indexed:
+            self.storage.written(argv[0], self.cursor.rowcount)
         return self.cursor
 
     @publish
@@ -551,12 +686,10 @@ class DBSchema:
 
     @publish
     def backup(self, spec):
-        if sys.version_info >= (3, 7) and self.provider == DBProvider.sqlite3:
-            backup_connection = sqlite3.connect(spec)
-            self.connection.backup(backup_connection)
-            backup_connection.close()
-        else:
-            raise NotImplementedError()
+        # save the current transaction
+        self.sync()
+        self.connection.commit()
+        self.storage.backup(self.connection, spec)
 
     @publish
     def export(self, f='stdout'):
@@ -585,11 +718,14 @@ class DBSchema:
         if self.config['spec'] != ':memory:':
             # simply discard in-memory sqlite db on exit
             self.purge_snapshots()
+            self.sync()
             self.connection.commit()
         self.connection.close()
 
     @publish
     def commit(self):
+        self.flush_pending()
+        self.transaction = False
         self.connection.commit()
 
     def create_table(self, table):
@@ -650,6 +786,13 @@ class DBSchema:
             index,
         )
         self.execute(req)
+        #
+        # the lookups go with f_target mostly, so add it to the
+        # secondary indices to have them preferred over the unique
+        # index on (f_target, f_tflags, ...)
+        #
+        for lookup in self.lookup_indices.get(table, ()):
+            self.create_index(table, tuple(lookup) + ('target',))
 
         #
         # create table for the transaction buffer: there go the system
@@ -676,6 +819,20 @@ class DBSchema:
                 'CREATE TABLE IF NOT EXISTS ' '%s_log (%s)' % (table, req)
             )
 
+    def create_index(self, table, fields):
+        #
+        # a secondary index for lookups, not unique
+        #
+        self.execute(
+            'CREATE INDEX IF NOT EXISTS ix_%s_%s ON %s (%s)'
+            % (
+                table,
+                '_'.join(fields),
+                table,
+                ','.join(['f_%s' % x for x in fields]),
+            )
+        )
+
     def mark(self, target, mark):
         for table in self.spec:
             self.execute(
@@ -698,6 +855,182 @@ class DBSchema:
                 (target,),
             )
 
+    @publish
+    def resync(self, target, events):
+        '''
+        Compare a fresh dump of the target with the DB records.
+
+        The dump is loaded under a staging target, and the records
+        are compared with the current ones table by table by the
+        index keys. The current records are not changed, so the DB
+        is never empty while a source reconnects.
+
+        Returns the events to apply the difference: synthetic
+        delete events for the objects that are gone, and the dump
+        messages for the new or changed objects.
+        '''
+        events = list(events)
+        for table in self.spec:
+            if self.fetchone(
+                'SELECT f_target FROM %s WHERE f_target = %s LIMIT 1'
+                % (table, self.plch),
+                (target,),
+            ):
+                break
+        else:
+            # initial load, nothing to compare
+            return events
+        # restore the records marked by cmsg_failed
+        self.mark(target, 0)
+        stage = '%s/resync' % target
+        self.flush(stage)
+        # owned records per event, and the classes that failed
+        owners = {}
+        failed = set()
+        try:
+            for event in events:
+                self.resync_log = []
+                try:
+                    for handler in self.event_map.get(event.__class__, []):
+                        handler(stage, event)
+                except Exception as e:
+                    self.log.debug('resync: %s %s' % (e, event))
+                    failed.add(event.__class__)
+                for table, msg in self.resync_log:
+                    if msg is event and table in resync_delete:
+                        owners[(table, self.netlink_key(table, msg))] = event
+            self.resync_log = None
+            deleted = []
+            changed = set()
+            route_keys = {}
+            stage_keys = {}
+            for table in self.spec:
+                current = self.resync_records(table, target, route_keys)
+                staged = self.resync_records(table, stage, stage_keys)
+                for key, record in staged.items():
+                    if current.get(key) != record:
+                        changed.add(self.resync_owner(table, key, record))
+                for key in set(current) - set(staged):
+                    if table in resync_delete:
+                        if self.classes[table] not in failed:
+                            deleted.append(
+                                self.resync_event(table, target, current[key])
+                            )
+                    elif self.foreign_keys.get(table):
+                        changed.add(
+                            self.resync_owner(table, key, current[key])
+                        )
+                    else:
+                        # no event to report, remove as is
+                        self.resync_remove(table, target, key)
+        finally:
+            self.resync_log = None
+            self.flush(stage)
+        # the dump messages to load, in the dump order
+        changed = set([id(owners[x]) for x in changed if x in owners])
+        load = [x for x in events if x.__class__ in failed or id(x) in changed]
+        # delete the dependent objects first
+        deleted.reverse()
+        return deleted + load
+
+    def netlink_key(self, table, event):
+        values = []
+        for key in self.indices[table]:
+            value = event.get(key) or event.get_attr(key)
+            if value is None:
+                value = self.key_defaults[table][key]
+            if isinstance(value, (dict, list, tuple, set)):
+                value = json.dumps(value)
+            values.append(value)
+        return tuple(values)
+
+    def resync_records(self, table, target, route_keys):
+        #
+        # Fetch the target records as {index_key: record}
+        #
+        # route_id is a random key, so replace it with the route
+        # index key, and ignore the route gc marks
+        #
+        names = self.compiled[table]['all_names'][2:]
+        idx = [names.index(x) for x in self.indices[table]]
+        rid = names.index('route_id') if 'route_id' in names else None
+        ret = {}
+        for record in tuple(
+            self.fetch(
+                'SELECT %s FROM %s WHERE f_target = %s'
+                % (','.join(['f_%s' % x for x in names]), table, self.plch),
+                (target,),
+            )
+        ):
+            record = list(record)
+            if table == 'routes':
+                key = tuple([record[x] for x in idx])
+                route_keys[record[rid]] = key
+                record[rid] = record[names.index('gc_mark')] = None
+            else:
+                if rid is not None:
+                    record[rid] = route_keys.get(record[rid])
+                key = tuple([record[x] for x in idx])
+            ret[key] = tuple(record)
+        return ret
+
+    def resync_owner(self, table, key, record):
+        #
+        # Map a record to the (table, key) of the object that owns
+        # the record: routes for nh, metrics and enc_mpls; the parent
+        # table for the rest
+        #
+        if table in resync_delete:
+            return (table, key)
+        names = self.compiled[table]['all_names'][2:]
+        if 'route_id' in names:
+            return ('routes', record[names.index('route_id')])
+        for fkey in self.foreign_keys.get(table, []):
+            parent = fkey['parent']
+            fmap = dict(zip(fkey['parent_fields'], fkey['fields']))
+            return (
+                parent,
+                tuple(
+                    [
+                        record[names.index(fmap['f_%s' % x][2:])]
+                        for x in self.indices[parent]
+                    ]
+                ),
+            )
+        return (table, key)
+
+    def resync_event(self, table, target, record):
+        #
+        # Make a synthetic delete event from the record
+        #
+        msg_class = self.classes[table]
+        msg_type = resync_delete[table]
+        fields = [x[0] for x in msg_class.fields]
+        nlas = [
+            x[0] if isinstance(x[0], str) else x[1] for x in msg_class.nla_map
+        ]
+        msg = msg_class()
+        msg['header'] = {'type': msg_type, 'flags': 0, 'target': target}
+        msg['event'] = RTM_VALUES[msg_type]
+        for fname, value in zip(self.spec[table], record):
+            if len(fname) > 1 or value is None:
+                continue
+            name = fname[0]
+            if name in fields:
+                msg[name] = value
+            elif name in nlas:
+                msg['attrs'].append((name, value))
+        return msg
+
+    def resync_remove(self, table, target, key):
+        conditions = ['f_target = %s' % self.plch]
+        for name in self.indices[table]:
+            conditions.append('f_%s = %s' % (name, self.plch))
+        self.execute(
+            'DELETE FROM %s WHERE %s' % (table, ' AND '.join(conditions)),
+            (target,) + key,
+        )
+
     @publish
     def save_deps(self, ctxid, weak_ref, iclass):
         uuid = uuid32()
@@ -779,10 +1112,7 @@ class DBSchema:
         for table in tuple(self.snapshots):
             for _ in range(MAX_ATTEMPTS):
                 try:
-                    if self.provider == DBProvider.sqlite3:
-                        self.execute('DROP TABLE %s' % table)
-                    elif self.provider == DBProvider.psycopg2:
-                        self.execute('DROP TABLE %s CASCADE' % table)
+                    self.execute(self.storage.drop_table(table))
                     self.connection.commit()
                     del self.snapshots[table]
                     break
@@ -802,8 +1132,7 @@ class DBSchema:
         #
         # ndb.interfaces.get({'ifname': 'eth0'})
         #
-        conditions = []
-        values = []
+        fields = {}
         cls = self.classes[table]
         cspec = self.compiled[table]
         for key, value in spec.items():
@@ -811,12 +1140,87 @@ class DBSchema:
                 key = cls.name2nla(key)
             if key not in cspec['all_names']:
                 raise KeyError('field name not found')
-            conditions.append('f_%s = %s' % (key, self.plch))
-            values.append(value)
-        req = 'SELECT * FROM %s WHERE %s' % (table, ' AND '.join(conditions))
-        for record in self.fetch(req, values):
+            fields[key] = value
+        for record in self.select(table, fields):
             yield dict(zip(self.compiled[table]['all_names'], record))
 
+    def lookup(self, table, spec):
+        '''
+        Look up the table rows where the fields match the spec,
+        `{field: value}`, in the lookup cache. May be called
+        from any thread. Return `None` if the lookup must be done
+        by SQL, see `select()`.
+        '''
+        return self.storage.lookup(table, spec)
+
+    @publish
+    def select(self, table, spec):
+        '''
+        Return the table rows where the fields match the spec,
+        `{field: value}`. Rebuild the lookup cache if required,
+        or run SQL if the storage has no cache.
+        '''
+        self.storage.rebuild(table, self.fetch)
+        rows = self.storage.lookup(table, spec)
+        if rows is not None:
+            return rows
+        req, values = self.select_request(table, spec)
+        if AUTO_INDEX and table in self.spec:
+            self.check_lookup(table, tuple(spec), req, values)
+        return list(self.fetch(req, values))
+
+    def select_request(self, table, spec):
+        req = 'SELECT * FROM %s' % table
+        if spec:
+            req += ' WHERE %s' % ' AND '.join(
+                ['f_%s = %s' % (x, self.plch) for x in spec]
+            )
+        return req, list(spec.values())
+
+    def query_plan(self, req, values):
+        return [
+            str(x[-1])
+            for x in self.fetch('%s %s' % (self.storage.explain, req), values)
+        ]
+
+    def check_lookup(self, table, fields, req, values):
+        #
+        # Count the lookups by the same fields that end up in
+        # a table scan, and index the fields after AUTO_INDEX
+        # such lookups. The plan is checked only once.
+        #
+        key = (table, fields)
+        count = self.lookup_scans.get(key, 0)
+        if count < 0:
+            return
+        if count == 0:
+            if table not in self.storage.scans(self.query_plan(req, values)):
+                self.lookup_scans[key] = -1
+                return
+        count += 1
+        if count >= AUTO_INDEX:
+            self.log.debug('auto index %s %s' % (table, fields))
+            index = tuple(x for x in fields if x not in ('target', 'tflags'))
+            if 'target' in fields:
+                index += ('target',)
+            self.create_index(table, index)
+            count = -1
+        self.lookup_scans[key] = count
+
+    @publish
+    def explain(self, table, spec):
+        '''
+        Return the DB query plan for the lookup by the spec,
+        `{field: value}`, and the list of the tables scanned.
+        '''
+        req, values = self.select_request(table, spec)
+        plan = self.query_plan(req, values)
+        return {
+            'request': req,
+            'plan': plan,
+            'scans': self.storage.scans(plan),
+        }
+
     def log_netlink(self, table, target, event, ctable=None):
         #
         # RTNL Logs
@@ -843,8 +1247,31 @@ class DBSchema:
             values,
         )
 
+    def get_value(self, nlas, fname, node):
+        path = fname[:-1]
+        name = fname[-1]
+        if path not in nlas:
+            nlas[path] = {}
+            for nla in dict.get(node, 'attrs', None) or ():
+                nlas[path].setdefault(nla[0], nla)
+        nla = nlas[path].get(name)
+        if nla is None:
+            key = (node.__class__, name)
+            if key not in self.nla_names:
+                self.nla_names[key] = (
+                    node.name2nla(name) if node.prefix else name.upper()
+                )
+            nla = nlas[path].get(self.nla_names[key])
+        if nla is not None and nla[1] is not None:
+            return nla[1]
+        if name in node:
+            return node[name]
+        return None
+
     def load_netlink(self, table, target, event, ctable=None, propagate=False):
         #
+        if self.resync_log is not None:
+            self.resync_log.append((table, event))
         if self.rtnl_log:
             self.log_netlink(table, target, event, ctable)
         #
@@ -881,21 +1308,10 @@ class DBSchema:
             #
             # Delete an object
             #
-            conditions = ['f_target = %s' % self.plch]
             values = [target]
-            for key in self.indices[table]:
-                conditions.append('f_%s = %s' % (key, self.plch))
-                value = event.get(key) or event.get_attr(key)
-                if value is None:
-                    value = self.key_defaults[table][key]
-                if isinstance(value, (dict, list, tuple, set)):
-                    value = json.dumps(value)
-                values.append(value)
-            self.execute(
-                'DELETE FROM %s WHERE'
-                ' %s' % (table, ' AND '.join(conditions)),
-                values,
-            )
+            values.extend(self.netlink_key(table, event))
+            if not self.storage.remove(table, values):
+                self.defer(self.compiled[table]['delete'], values)
         else:
             #
             # Create or set an object
@@ -907,9 +1323,12 @@ class DBSchema:
             compiled = self.compiled[table]
             # a map of sub-NLAs
             nodes = {}
+            # the first NLA by name, per node
+            nlas = {}
             # replace
             r_conditions = []
             r_values = []
+            r_spec = {}
 
             # Check route replace
             if (
@@ -919,6 +1338,7 @@ class DBSchema:
                 # Replace existing route
                 r_conditions = [table + '.f_target = %s' % self.plch]
                 r_values = [target]
+                r_spec = {'target': target}
                 for key in self.indices[table]:
                     if key not in [
                         'RTA_DST',
@@ -937,6 +1357,7 @@ class DBSchema:
                     if isinstance(value, (dict, list, tuple, set)):
                         value = json.dumps(value)
                     r_values.append(value)
+                    r_spec[key] = value
 
             # fetch values (exc. the first two columns)
             for fname, ftype in self.spec[table].items():
@@ -959,10 +1380,9 @@ class DBSchema:
                         values.append(None)
                         continue
 
-                # NLA have priority
-                value = node.get_attr(fname[-1])
-                if value is None:
-                    value = node.get(fname[-1])
+                # NLA have priority; the same lookup as node.get(),
+                # but index the node NLA only once
+                value = self.get_value(nlas, fname, node)
                 if value is None and fname[-1] in self.compiled[table]['idx']:
                     value = self.key_defaults[table][fname[-1]]
                     node['attrs'].append((fname[-1], value))
@@ -975,11 +1395,27 @@ class DBSchema:
             try:
                 w_fidx = compiled['fidx']
                 w_ivalues = ivalues
+                w_spec = dict(zip(compiled['idx'], ivalues))
                 if r_conditions:
                     w_fidx = ' AND '.join(r_conditions)
                     w_ivalues = r_values
+                    w_spec = r_spec
 
-                if self.provider == DBProvider.psycopg2:
+                if self.upsert and not r_conditions:
+                    #
+                    # run UPSERT; subsequent writes to the same table
+                    # are batched, see defer()
+                    #
+                    # the storage may keep the record without SQL,
+                    # except the propagate mode, where SQL reports
+                    # the errors to the caller
+                    #
+                    if propagate:
+                        self.execute(compiled['upsert'], values, indexed=True)
+                        self.storage.store(table, tuple(values), written=True)
+                    elif not self.storage.store(table, tuple(values)):
+                        self.defer(compiled['upsert'], values)
+                elif self.storage.upsert_where:
                     #
                     # run UPSERT -- the DB provider must support it
                     #
@@ -1000,23 +1436,28 @@ class DBSchema:
                         )
                     )
                     #
-                elif self.provider == DBProvider.sqlite3:
+                else:
                     #
-                    # SQLite3 >= 3.24 actually has UPSERT, but ...
+                    # SQLite3 < 3.24 has no UPSERT, and route replace
+                    # matches the record not by the unique index.
                     #
                     # We can not use here INSERT OR REPLACE as well, since
                     # it drops (almost always) records with foreign key
                     # dependencies. Maybe a bug in SQLite3, who knows.
                     #
-                    count = (
-                        self.execute(
-                            '''
-                                      SELECT count(*) FROM %s WHERE %s
-                                      '''
-                            % (table, w_fidx),
-                            w_ivalues,
-                        ).fetchone()
-                    )[0]
+                    rows = self.storage.lookup(table, w_spec)
+                    if rows is not None:
+                        count = len(rows)
+                    else:
+                        count = (
+                            self.execute(
+                                '''
+                                          SELECT count(*) FROM %s WHERE %s
+                                          '''
+                                % (table, w_fidx),
+                                w_ivalues,
+                            ).fetchone()
+                        )[0]
                     if count == 0:
                         self.execute(
                             '''
@@ -1024,7 +1465,9 @@ class DBSchema:
                                      '''
                             % (table, compiled['fnames'], compiled['plchs']),
                             values,
+                            indexed=True,
                         )
+                        self.storage.store(table, tuple(values), written=True)
                     else:
                         self.execute(
                             '''
@@ -1032,9 +1475,9 @@ class DBSchema:
                                      '''
                             % (table, compiled['fset'], w_fidx),
                             (values + w_ivalues),
+                            indexed=True,
                         )
-                else:
-                    raise NotImplementedError()
+                        self.storage.replace(table, w_spec, tuple(values))
                 #
             except Exception as e:
                 #
@@ -33,6 +33,18 @@ consume memory regardless of the RTNL objects number::
 
 See also: :ref:`iproute`
 
+Source restart
+--------------
+
+When a source reconnects, e.g. after a restart or a socket error,
+the DB records are not flushed. The source dumps the objects, the
+dump is loaded into a staging area and compared with the current
+records of the target by the index keys, and only the difference
+is loaded: the messages for new or changed objects, and synthetic
+`RTM_DEL*` events for the objects that are gone. So the records
+remain available while the source is loading, and the objects are
+not reported as removed and added again.
+
 Network namespaces
 ------------------
 
@@ -175,6 +187,7 @@ class Source(dict):
             self.ndb.messenger.targets.add(self.target)
         #
         self.errors_counter = 0
+        self.keep_records = False
         self.shutdown = threading.Event()
         self.started = threading.Event()
         self.lock = threading.RLock()
@@ -317,7 +330,7 @@ class Source(dict):
             ('IFLA_ADDRESS', '00:00:00:00:00:00'),
         ]
         zero_if.encode()
-        self.evq.put([zero_if], source=self.target)
+        return zero_if
 
     def receiver(self):
         #
@@ -352,13 +365,22 @@ class Source(dict):
                     #
                     # Initial load -- enqueue the data
                     #
-                    try:
-                        self.ndb.task_manager.db_flush(self.target)
-                        if self.kind in ('local', 'netns', 'remote'):
-                            self.fake_zero_if()
-                        self.evq.put(tuple(self.nl.dump()), source=self.target)
-                    finally:
-                        pass
+                    # On reconnect the dump is compared with the DB
+                    # records, and only the difference is enqueued
+                    #
+                    snapshot = []
+                    if self.kind in ('local', 'netns', 'remote'):
+                        snapshot.append(self.fake_zero_if())
+                    timestamp = time.thread_time()
+                    snapshot.extend(self.nl.dump())
+                    self.ndb.task_manager.account(
+                        'receive', time.thread_time() - timestamp
+                    )
+                    self.evq.put(
+                        self.ndb.task_manager.db_resync(self.target, snapshot),
+                        source=self.target,
+                    )
+                    self.keep_records = False
                     self.errors_counter = 0
                 except Exception as e:
                     self.errors_counter += 1
@@ -394,7 +416,12 @@ class Source(dict):
 
             while self.state.get() not in ('stop', 'restart'):
                 try:
+                    # the thread CPU time, not to account the wait
+                    timestamp = time.thread_time()
                     msg = tuple(self.nl.get())
+                    self.ndb.task_manager.account(
+                        'receive', time.thread_time() - timestamp
+                    )
                     self.log.debug(f'received message {msg}')
                 except Exception as e:
                     self.errors_counter += 1
@@ -425,8 +452,11 @@ class Source(dict):
         # in __dbm__() routine
         try:
             self.sync()
-            self.log.debug('flush DB for the target')
-            self.ndb.task_manager.db_flush(self.target)
+            if self.keep_records:
+                self.log.debug('keep the DB records for the resync')
+            else:
+                self.log.debug('flush DB for the target')
+                self.ndb.task_manager.db_flush(self.target)
         except ShutdownException:
             self.log.debug('shutdown handled by the main thread')
             pass
@@ -477,6 +507,8 @@ class Source(dict):
             with self.shutdown_lock:
                 self.log.debug('restarting the source, reason <%s>' % (reason))
                 self.started.clear()
+                # the records will be resynced on start
+                self.keep_records = True
                 try:
                     self.close()
                     if self.th:
@@ -0,0 +1,693 @@
+'''
+Storage engines
+===============
+
+The DB schema talks to the database via a storage engine object.
+The engine provides the DB API connection, the SQL dialect details
+and the provider specific operations like backup.
+
+Engines:
+
+* `sqlite3` -- SQLite3, the default
+* `psycopg2` -- PostgreSQL via psycopg2
+* `sqlite3_cache` -- SQLite3 plus a lookup cache in Python dicts
+* `native` -- Python dicts, SQLite3 only as a write-behind copy
+
+Lookup cache
+------------
+
+The `sqlite3_cache` engine is not a replacement for SQLite3, but
+a read cache on top of it. It keeps a copy of the tables in Python
+dicts, hashed by the table unique index, with secondary indices on
+the common lookup fields: `ifname`, `index`, `dst`, `oif`, `table`
+etc.; the lookups by other fields scan the records. The NDB views
+use the cache to look up objects directly from the caller thread
+instead of sending SQL requests to the DB thread,
+and the DB thread uses it instead of `SELECT count(*)` on every
+update that can not be done with UPSERT::
+
+    ndb = NDB(db_provider='sqlite3_cache')
+
+All the data is still written to SQLite3: reports, joins and the
+object dependencies use SQL as usual. Thus the netlink events are
+written twice, to SQLite3 and to the cache, and the engine pays
+off only when the lookups outnumber the events.
+
+A table is cached on the first lookup with one `SELECT`, so the
+initial load of the DB writes only to SQLite3. After that the
+netlink events update the cache; any other write to a table
+invalidates its cache and the cache of the dependent tables, and
+the cache is rebuilt from the SQL table on the next lookup.
+
+Native storage
+--------------
+
+The `native` engine is for the hosts that use NDB as a live cache.
+The dict tables are the primary copy of the data, and the netlink
+events are written only there, without SQL::
+
+    ndb = NDB(db_provider='native')
+
+The engine keeps the `ON DELETE CASCADE` and `ON UPDATE CASCADE`
+foreign keys itself, using secondary indices on the referencing
+fields, and marks the changed keys. SQLite3 is a write-behind copy:
+the changed records are written to SQL with `executemany()` only
+before some other SQL statement, like a report, `count()`, a join,
+the objects dependencies, or the periodic routes gc, and many
+updates of one record end up in one SQL write.
+
+Thus the records that SQL would reject, e.g. with a foreign key
+violation, are rejected only when written to SQL; then the tables
+are rebuilt from SQL as in `sqlite3_cache`. The engine requires
+SQLite3 >= 3.24 to write the records with UPSERT.
+'''
+
+import abc
+import enum
+import re
+import sqlite3
+import threading
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+#
+# the normalized field names to build secondary cache indices on
+#
+CACHE_INDICES = ('ifname', 'index', 'ifindex', 'dst', 'oif', 'table')
+
+#
+# SQL statements that modify tables
+#
+write_statement = re.compile(
+    r'^\s*(INSERT\s+(?:OR\s+\w+\s+)?INTO|UPDATE|DELETE\s+FROM)\s+(\w+)',
+    re.IGNORECASE,
+)
+read_statement = re.compile(r'^\s*(SELECT|WITH|EXPLAIN)\b', re.IGNORECASE)
+schema_statement = re.compile(r'^\s*(CREATE|DROP|PRAGMA)\b', re.IGNORECASE)
+
+#
+# query plans
+#
+plan_scan = re.compile(r'^\s*SCAN (?:TABLE )?(\w+)')
+plan_search = re.compile(r'^\s*SEARCH (?:TABLE )?(\w+) USING .*?\((.*)\)')
+plan_column = re.compile(r'(\w+)\s*[=<>]')
+plan_seq_scan = re.compile(r'Seq Scan on (\w+)')
+
+
+class DBProvider(enum.Enum):
+    sqlite3 = 'sqlite3'
+    psycopg2 = 'psycopg2'
+    sqlite3_cache = 'sqlite3_cache'
+    native = 'native'
+
+    def __eq__(self, r):
+        return str(self) == r
+
+
+class Storage(abc.ABC):
+    '''
+    The base storage engine.
+
+    The cache methods are no-op here: `lookup()` returns `None`,
+    and the DB schema falls back to SQL; `store()` and `remove()`
+    return `None`, so the DB schema writes the records to SQL.
+    '''
+
+    plch = '?'
+    upsert = True
+    # UPSERT with WHERE clause is supported
+    upsert_where = False
+    # run the netlink events batch in one transaction
+    transactions = False
+    # exceptions to retry the statement on
+    retry = ()
+    # the query plan statement prefix
+    explain = 'EXPLAIN'
+    # the records to write to SQL, see flush()
+    dirty = None
+
+    def __init__(self, spec):
+        self.spec = spec
+
+    def scans(self, plan):
+        '''
+        Return the tables scanned by the query plan lines.
+        '''
+        return []
+
+    @abc.abstractmethod
+    def connect(self):
+        '''
+        Return a new DB API connection.
+        '''
+
+    def setup(self, schema):
+        pass
+
+    @abc.abstractmethod
+    def backup(self, connection, spec):
+        '''
+        Save the database to `spec`.
+        '''
+
+    def drop_table(self, table):
+        return 'DROP TABLE %s' % table
+
+    def written(self, statement, rowcount):
+        pass
+
+    def store(self, table, row, written=False):
+        pass
+
+    def remove(self, table, key):
+        pass
+
+    def flush(self):
+        '''
+        Return the records to write to SQL before other statements,
+        `[(statement, [values, ...]), ...]`.
+        '''
+        return ()
+
+    def replace(self, table, spec, row):
+        pass
+
+    def invalidate(self, table=None):
+        pass
+
+    def rebuild(self, table, fetch):
+        pass
+
+    def lookup(self, table, spec):
+        return None
+
+
+class SQLite3Storage(Storage):
+    transactions = True
+    retry = (sqlite3.InterfaceError, sqlite3.OperationalError)
+    explain = 'EXPLAIN QUERY PLAN'
+
+    def scans(self, plan):
+        #
+        # SCAN routes
+        # SEARCH routes USING INDEX routes_idx (f_target=? AND f_tflags=?)
+        #
+        # a search by the target and tflags only is a scan as well
+        #
+        ret = []
+        for line in plan:
+            match = plan_scan.match(line)
+            if match is not None:
+                ret.append(match.group(1))
+                continue
+            match = plan_search.match(line)
+            if match is not None and not (
+                set(plan_column.findall(match.group(2)))
+                - set(('f_target', 'f_tflags'))
+            ):
+                ret.append(match.group(1))
+        return ret
+
+    def connect(self):
+        connection = sqlite3.connect(self.spec)
+        connection.execute('PRAGMA foreign_keys = ON')
+        self.upsert = sqlite3.sqlite_version_info >= (3, 24, 0)
+        return connection
+
+    def backup(self, connection, spec):
+        backup_connection = sqlite3.connect(spec)
+        connection.backup(backup_connection)
+        backup_connection.close()
+
+
+class PostgreSQLStorage(Storage):
+    plch = '%s'
+    upsert_where = True
+
+    def connect(self):
+        return psycopg2.connect(**self.spec)
+
+    def scans(self, plan):
+        ret = []
+        for line in plan:
+            ret.extend(plan_seq_scan.findall(line))
+        return ret
+
+    def backup(self, connection, spec):
+        raise NotImplementedError('backup is supported only for SQLite3')
+
+    def drop_table(self, table):
+        return 'DROP TABLE %s CASCADE' % table
+
+
+def affinity(ftype):
+    #
+    # SQLite3 type affinity for the comparisons, see
+    # https://sqlite.org/datatype3.html
+    #
+    ftype = ftype.upper()
+    if 'INT' in ftype:
+        return int
+    if 'CHAR' in ftype or 'CLOB' in ftype or 'TEXT' in ftype:
+        return str
+    return None
+
+
+class CacheTable:
+    '''
+    Table records hashed by the unique index. Every index key
+    maps to `{tflags: row}`, since the netlink delete events
+    remove records with any tflags.
+
+    The table is created invalid, and it is filled on the first
+    lookup, see `SQLite3CacheStorage.rebuild()`.
+    '''
+
+    def __init__(self, names, types, index, secondary):
+        self.names = names
+        self.types = dict(zip(names, types))
+        position = {}
+        for idx, name in enumerate(names):
+            position[name] = idx
+        self.position = position
+        self.index = tuple(index)
+        self.kpos = [position[x] for x in index]
+        self.records = {}
+        self.secondary = {position[x]: {} for x in secondary}
+        self.valid = False
+
+    def key(self, row):
+        return (row[0],) + tuple([row[x] for x in self.kpos])
+
+    def link(self, key, row):
+        for pos, index in self.secondary.items():
+            index.setdefault(row[pos], set()).add(key)
+
+    def unlink(self, key, row, records):
+        for pos, index in self.secondary.items():
+            value = row[pos]
+            if any(x[pos] == value for x in records.values()):
+                continue
+            bucket = index.get(value)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del index[value]
+
+    def store(self, row):
+        key = self.key(row)
+        records = self.records.setdefault(key, {})
+        old = records.get(row[1])
+        records[row[1]] = row
+        if old is not None:
+            self.unlink(key, old, records)
+        self.link(key, row)
+
+    def remove(self, key):
+        records = self.records.pop(key, {})
+        for row in records.values():
+            self.unlink(key, row, {})
+
+    def discard(self, key, tflags):
+        records = self.records.get(key, {})
+        row = records.pop(tflags, None)
+        if row is not None:
+            self.unlink(key, row, records)
+        if not records:
+            self.records.pop(key, None)
+
+    def convert(self, name, value):
+        ftype = self.types[name]
+        if value is None or ftype is None or isinstance(value, ftype):
+            return value
+        try:
+            return ftype(value)
+        except ValueError:
+            return value
+
+    def lookup(self, spec):
+        for name in spec:
+            if name not in self.position:
+                return None
+        spec = {x: self.convert(x, y) for x, y in spec.items()}
+        if None in spec.values():
+            # like in SQL, NULL matches nothing
+            return []
+        if 'target' in spec and all(x in spec for x in self.index):
+            keys = ((spec['target'],) + tuple([spec[x] for x in self.index]),)
+        else:
+            keys = None
+            for name, value in spec.items():
+                index = self.secondary.get(self.position[name])
+                if index is not None:
+                    bucket = index.get(value, ())
+                    if keys is None or len(bucket) < len(keys):
+                        keys = bucket
+            if keys is None:
+                # no index, scan the records
+                keys = self.records
+        match = [(self.position[x], y) for x, y in spec.items()]
+        ret = []
+        for key in tuple(keys):
+            for row in self.records.get(key, {}).values():
+                for pos, value in match:
+                    if row[pos] != value:
+                        break
+                else:
+                    ret.append(row)
+        return ret
+
+
+class SQLite3CacheStorage(SQLite3Storage):
+    '''
+    SQLite3 with a lookup cache, see the module docs.
+    '''
+
+    secondary = CACHE_INDICES
+
+    def __init__(self, spec):
+        super().__init__(spec)
+        self.lock = threading.Lock()
+        self.tables = {}
+        self.dependents = {}
+        self.cascade = {}
+
+    def setup(self, schema):
+        self.tables = {}
+        for table in schema.spec:
+            compiled = schema.compiled[table]
+            names = compiled['all_names']
+            types = ['TEXT', 'BIGINT'] + list(schema.spec[table].values())
+            secondary = [
+                name
+                for name, norm in zip(names, compiled['norm_names'])
+                if norm in self.secondary
+            ]
+            self.tables[table] = CacheTable(
+                names,
+                [affinity(x) for x in types],
+                compiled['idx'][2:],
+                secondary,
+            )
+        #
+        # ON DELETE CASCADE: all the dependents, recursively;
+        # ON UPDATE CASCADE: the dependents referencing fields
+        # that UPSERT may change, i.e. not the index fields
+        #
+        children = {}
+        for table, keys in schema.foreign_keys.items():
+            for key in keys:
+                parent = key['parent']
+                if parent not in self.tables:
+                    continue
+                children.setdefault(parent, set()).add(table)
+                index = ['f_%s' % x for x in schema.compiled[parent]['idx']]
+                if not set(key['parent_fields']) <= set(index):
+                    self.cascade.setdefault(parent, {})[table] = [
+                        self.tables[parent].position[x[2:]]
+                        for x in key['parent_fields']
+                    ]
+        for table in self.tables:
+            ret = set()
+            stack = [table]
+            while stack:
+                for child in children.get(stack.pop(), ()):
+                    if child not in ret:
+                        ret.add(child)
+                        stack.append(child)
+            self.dependents[table] = ret
+
+    def invalidate(self, table=None):
+        with self.lock:
+            if table is None:
+                tables = tuple(self.tables)
+            else:
+                tables = (table,) + tuple(self.dependents.get(table, ()))
+            for name in tables:
+                if name in self.tables:
+                    self.tables[name].valid = False
+                    self.tables[name].records = {}
+                    for index in self.tables[name].secondary.values():
+                        index.clear()
+
+    def written(self, statement, rowcount):
+        #
+        # SQL writes bypassing the cache; the statements that
+        # changed no rows don't change the dependents as well
+        #
+        if read_statement.match(statement):
+            return
+        match = write_statement.match(statement)
+        if match is None:
+            if not schema_statement.match(statement):
+                self.invalidate()
+        elif match.group(2) in self.tables and rowcount != 0:
+            self.invalidate(match.group(2))
+
+    def store(self, table, row, written=False):
+        changed = []
+        with self.lock:
+            ntable = self.tables[table]
+            if not ntable.valid:
+                return
+            cascade = self.cascade.get(table)
+            if cascade:
+                old = ntable.records.get(ntable.key(row), {}).get(row[1])
+                if old is not None:
+                    for child, fields in cascade.items():
+                        if any(old[x] != row[x] for x in fields):
+                            changed.append(child)
+            ntable.store(row)
+        for child in changed:
+            self.invalidate(child)
+
+    def remove(self, table, key):
+        with self.lock:
+            ntable = self.tables[table]
+            if not ntable.valid:
+                return
+            key = tuple(key)
+            if key not in ntable.records:
+                return
+            ntable.remove(key)
+        for child in self.dependents[table]:
+            self.invalidate(child)
+
+    def replace(self, table, spec, row):
+        with self.lock:
+            ntable = self.tables[table]
+            if not ntable.valid:
+                return
+            rows = ntable.lookup(spec)
+            if rows is None or len(rows) > 1:
+                ntable.valid = False
+            else:
+                for old in rows:
+                    ntable.remove(ntable.key(old))
+                ntable.store(row)
+        if not ntable.valid:
+            self.invalidate(table)
+        # UPDATE may change the fields referenced by the dependents
+        for child in self.cascade.get(table, ()):
+            self.invalidate(child)
+
+    def rebuild(self, table, fetch):
+        ntable = self.tables.get(table)
+        if ntable is None or ntable.valid:
+            return
+        # fetch() may write to SQL first, see flush()
+        rows = tuple(fetch('SELECT * FROM %s' % table))
+        with self.lock:
+            ntable.records = {}
+            for index in ntable.secondary.values():
+                index.clear()
+            for row in rows:
+                ntable.store(tuple(row))
+            ntable.valid = True
+
+    def lookup(self, table, spec):
+        ntable = self.tables.get(table)
+        if ntable is None:
+            return None
+        with self.lock:
+            if not ntable.valid:
+                return None
+            return ntable.lookup(spec)
+
+
+class NativeStorage(SQLite3CacheStorage):
+    '''
+    The dict tables with SQLite3 as a write-behind copy, see
+    the module docs.
+    '''
+
+    def __init__(self, spec):
+        super().__init__(spec)
+        self.fetch = None
+        # {table: {key: deleted}}
+        self.dirty = {}
+        # {table: (upsert, delete)}
+        self.statements = {}
+        # {parent: [(child, [(child_pos, parent_pos), ...]), ...]}
+        self.references = {}
+        # {table: (table, dependent, ...)}
+        self.related = {}
+
+    def setup(self, schema):
+        if not schema.upsert:
+            raise TypeError('native storage requires SQLite3 >= 3.24')
+        super().setup(schema)
+        self.fetch = schema.fetch
+        self.dirty = {}
+        self.references = {}
+        for table, ntable in self.tables.items():
+            self.related[table] = (table,) + tuple(self.dependents[table])
+            compiled = schema.compiled[table]
+            self.statements[table] = (compiled['upsert'], compiled['delete'])
+            for key in schema.foreign_keys.get(table, ()):
+                parent = self.tables.get(key['parent'])
+                if parent is None:
+                    continue
+                fields = [
+                    (ntable.position[x[2:]], parent.position[y[2:]])
+                    for x, y in zip(key['fields'], key['parent_fields'])
+                ]
+                self.references.setdefault(key['parent'], []).append(
+                    (table, fields)
+                )
+                #
+                # the cascades look up the referencing records
+                #
+                for pos, _ in fields:
+                    if pos > 1:
+                        ntable.secondary.setdefault(pos, {})
+                        break
+        #
+        # load the tables now, not to write all the records to SQL
+        # when a table is loaded on the first event
+        #
+        for table in self.tables:
+            self.rebuild(table, self.fetch)
+
+    def prepare(self, table):
+        #
+        # the table and the dependents must be loaded to write
+        # and to cascade the changes
+        #
+        for name in self.related[table]:
+            if not self.tables[name].valid:
+                self.rebuild(name, self.fetch)
+
+    def mark(self, table, key, deleted=False):
+        dirty = self.dirty.setdefault(table, {})
+        dirty[key] = deleted or dirty.get(key, False)
+
+    def referencing(self, child, fields, row):
+        ntable = self.tables[child]
+        return ntable.lookup({ntable.names[x]: row[y] for x, y in fields})
+
+    def update(self, table, row, written):
+        ntable = self.tables[table]
+        key = ntable.key(row)
+        old = ntable.records.get(key, {}).get(row[1])
+        ntable.store(row)
+        if not written:
+            self.mark(table, key)
+        if old is None:
+            return
+        #
+        # ON UPDATE CASCADE
+        #
+        for child, fields in self.references.get(table, ()):
+            if all(old[y] == row[y] for _, y in fields):
+                continue
+            ctable = self.tables[child]
+            for crow in self.referencing(child, fields, old):
+                okey = ctable.key(crow)
+                crow = list(crow)
+                for x, y in fields:
+                    crow[x] = row[y]
+                crow = tuple(crow)
+                if ctable.key(crow) != okey:
+                    # the reference is a part of the child index
+                    ctable.discard(okey, crow[1])
+                    if not written:
+                        self.mark(child, okey, True)
+                self.update(child, crow, written)
+
+    def delete(self, table, key, tflags=None):
+        ntable = self.tables[table]
+        records = ntable.records.get(key, {})
+        if tflags is None:
+            rows = tuple(records.values())
+        else:
+            rows = tuple(x for x in (records.get(tflags),) if x is not None)
+        if not rows:
+            return
+        for row in rows:
+            ntable.discard(key, row[1])
+        self.mark(table, key, True)
+        #
+        # ON DELETE CASCADE
+        #
+        for row in rows:
+            for child, fields in self.references.get(table, ()):
+                ctable = self.tables[child]
+                for crow in self.referencing(child, fields, row):
+                    self.delete(child, ctable.key(crow), crow[1])
+
+    def store(self, table, row, written=False):
+        if not written:
+            self.prepare(table)
+        with self.lock:
+            if self.tables[table].valid:
+                self.update(table, row, written)
+        return True
+
+    def remove(self, table, key):
+        self.prepare(table)
+        with self.lock:
+            self.delete(table, tuple(key))
+        return True
+
+    def flush(self):
+        ret = []
+        with self.lock:
+            dirty, self.dirty = self.dirty, {}
+            #
+            # the tables go in the schema order, the parents first
+            #
+            for table, ntable in self.tables.items():
+                keys = dirty.get(table)
+                if not keys:
+                    continue
+                upsert, delete = self.statements[table]
+                deleted = [key for key, flag in keys.items() if flag]
+                if deleted:
+                    ret.append((delete, deleted))
+                rows = [
+                    row
+                    for key in keys
+                    for row in ntable.records.get(key, {}).values()
+                ]
+                if rows:
+                    ret.append((upsert, rows))
+        return ret
+
+
+engines = {
+    'sqlite3': SQLite3Storage,
+    'psycopg2': PostgreSQLStorage,
+    'sqlite3_cache': SQLite3CacheStorage,
+    'native': NativeStorage,
+}
+
+
+def get_engine(provider, spec):
+    for item in DBProvider:
+        if item == provider:
+            return engines[item.value](spec)
+    raise TypeError('DB provider not supported')
@@ -7,6 +7,9 @@ import traceback
 from functools import partial
 
 from pyroute2 import config
+from pyroute2.config import AF_BRIDGE
+from pyroute2.netlink.rtnl.ndmsg import ndmsg
+from pyroute2.netlink.rtnl.rtmsg import rtmsg
 
 from . import schema
 from .events import (
@@ -18,6 +21,9 @@ from .events import (
 from .messages import cmsg, cmsg_event, cmsg_failed, cmsg_sstart
 
 log = logging.getLogger(__name__)
+# the queued batches are loaded in one DB transaction
+# until this number of events is reached
+TRANSACTION_SIZE = 4096
 
 
 def Events(*argv):
@@ -27,6 +33,82 @@ def Events(*argv):
                 yield item
 
 
+class EventCoalescer:
+    '''
+    Keep only the latest state per the table index for neighbour
+    and route events, e.g. for neighbours flapping between REACHABLE
+    and STALE, or for routes replaced again and again.
+
+    A delete drops the pending updates for the key, and an update
+    after a delete is kept after it, so the delete-then-add order
+    is preserved. The pending events are released in the order of
+    their first appearance, before any other event is loaded, and
+    when the window expires; with the window 0 only the events
+    already queued are coalesced.
+    '''
+
+    def __init__(self, schema, window=0):
+        self.schema = schema
+        self.window = window
+        self.pending = {}
+        self.deadline = None
+        self.counter = 0
+
+    def table(self, event):
+        if isinstance(event, ndmsg):
+            if event['family'] == AF_BRIDGE:
+                return 'af_bridge_fdb'
+            return 'neighbours'
+        elif isinstance(event, rtmsg):
+            return 'routes'
+
+    def push(self, event):
+        '''
+        Return True if the event is held.
+        '''
+        table = self.table(event)
+        if table is None:
+            return False
+        key = (
+            table,
+            event['header']['target'],
+            self.schema.netlink_key(table, event),
+        )
+        if key not in self.pending:
+            if not self.pending:
+                self.deadline = time.time() + self.window
+            self.pending[key] = [event]
+            return True
+        slot = self.pending[key]
+        if event['header']['type'] % 2:
+            # RTM_DEL*: the previous updates make no sense
+            self.counter += len(slot)
+            slot[:] = [event]
+        elif slot[-1]['header']['type'] % 2:
+            # RTM_NEW* after RTM_DEL*
+            slot.append(event)
+        else:
+            self.counter += 1
+            slot[-1] = event
+        return True
+
+    def flush(self):
+        ret = []
+        for slot in self.pending.values():
+            ret.extend(slot)
+        self.pending = {}
+        self.deadline = None
+        return ret
+
+    def timeout(self):
+        if not self.pending:
+            return None
+        return max(self.deadline - time.time(), 0)
+
+    def expired(self):
+        return bool(self.pending) and time.time() >= self.deadline
+
+
 class NDBConfig(dict):
     def __init__(self, task_manager):
         self.task_manager = task_manager
@@ -51,13 +133,50 @@ class NDBConfig(dict):
 
 
 class TaskManager:
-    def __init__(self, ndb):
+    def __init__(
+        self, ndb, transaction_size=TRANSACTION_SIZE, coalesce_window=None
+    ):
         self.ndb = ndb
         self.log = ndb.log
         self.event_map = {}
         self.event_queue = ndb._event_queue
+        self.transaction_size = transaction_size
+        self.coalesce_window = coalesce_window
+        self.coalescer = None
         self.thread = None
         self.ctime = self.gctime = time.time()
+        self.counters = {'batches': 0, 'events': 0, 'transactions': 0}
+        # 'receive' is accounted by the source threads
+        self.latency_lock = threading.Lock()
+        self.latency = {
+            stage: {'count': 0, 'total': 0.0, 'max': 0.0}
+            for stage in ('receive', 'queue', 'apply', 'commit')
+        }
+
+    def account(self, stage, value):
+        with self.latency_lock:
+            stat = self.latency[stage]
+            stat['count'] += 1
+            stat['total'] += value
+            stat['max'] = max(stat['max'], value)
+
+    def metrics(self):
+        ret = {
+            'queue_depth': self.event_queue.qsize(),
+            'queue_memory': self.event_queue.memory,
+            'queue_memory_max': self.event_queue.memory_max,
+        }
+        ret.update(self.counters)
+        if self.coalescer is not None:
+            ret['coalesced'] = self.coalescer.counter
+        ret['latency'] = {}
+        with self.latency_lock:
+            for stage, stat in self.latency.items():
+                ret['latency'][stage] = dict(stat)
+                ret['latency'][stage]['avg'] = stat['total'] / max(
+                    stat['count'], 1
+                )
+        return ret
 
     def register_handler(self, event, handler):
         if event not in self.event_map:
@@ -152,6 +271,17 @@ class TaskManager:
             proxy = _do_dispatch_generator
         return (cmsg_req, handler, proxy)
 
+    def db_lookup(self, table, spec):
+        '''
+        Return the table rows where the fields match the spec,
+        `{field: value}`. The lookup cache is used from the caller
+        thread, otherwise the request goes to the DB thread.
+        '''
+        rows = self.ndb.schema.lookup(table, spec)
+        if rows is None:
+            rows = self.db_select(table, spec)
+        return rows
+
     def register_api(self, api_obj, prefix=''):
         for name in dir(api_obj):
             method = getattr(api_obj, name, None)
@@ -163,6 +293,81 @@ class TaskManager:
                 setattr(self, name, partial(proxy, self))
                 self.event_map[event] = [handler]
 
+    def handle_event(self, event, reschedule):
+        '''
+        Run the handlers for an event, return True if the event
+        is the shutdown request.
+        '''
+        handlers = self.event_map.get(event.__class__, [self.default_handler])
+        for handler in tuple(handlers):
+            try:
+                target = event['header']['target']
+                handler(target, event)
+            except RescheduleException:
+                if 'rcounter' not in event['header']:
+                    event['header']['rcounter'] = 0
+                if event['header']['rcounter'] < 3:
+                    event['header']['rcounter'] += 1
+                    self.log.debug('reschedule %s' % (event,))
+                    reschedule.append(event)
+                else:
+                    self.log.error('drop %s' % (event,))
+            except InvalidateHandlerException:
+                try:
+                    handlers.remove(handler)
+                except Exception:
+                    self.log.error(
+                        'could not invalidate '
+                        'event handler:\n%s' % traceback.format_exc()
+                    )
+            except ShutdownException:
+                return True
+            except DBMExitException:
+                raise
+            except Exception:
+                self.log.error(
+                    'could not load event:\n%s\n%s'
+                    % (event, traceback.format_exc())
+                )
+        return False
+
+    def handle_events(self, source, events, reschedule, coalesce=True):
+        '''
+        Run the handlers for an events batch, return the number
+        of the events. Raise ShutdownException when the batch
+        contains the shutdown request.
+        '''
+        stop = False
+        counter = 0
+        coalescer = self.coalescer if coalesce else None
+        try:
+            for event in events:
+                if coalescer is not None:
+                    if coalescer.push(event):
+                        continue
+                    # any other event releases the pending ones
+                    for pending in coalescer.flush():
+                        counter += 1
+                        stop |= self.handle_event(pending, reschedule)
+                counter += 1
+                stop |= self.handle_event(event, reschedule)
+                if time.time() - self.gctime > config.gc_timeout:
+                    self.gctime = time.time()
+        except DBMExitException:
+            raise
+        except Exception as e:
+            self.log.error(f'exception <{e}> in source {source}')
+            # restart the target
+            try:
+                self.log.debug(f'requesting source {source} restart')
+                self.ndb.sources[source].state.set('restart')
+            except KeyError:
+                self.log.debug(f'key error for {source}')
+                pass
+        if stop:
+            raise ShutdownException()
+        return counter
+
     def run(self):
         _locals = {'countdown': len(self.ndb._nl)}
         self.thread = id(threading.current_thread())
@@ -199,62 +404,59 @@ class TaskManager:
             for handler in handlers:
                 self.register_handler(event, handler)
 
+        if self.coalesce_window is not None:
+            self.coalescer = EventCoalescer(
+                self.ndb.schema, self.coalesce_window
+            )
+
         stop = False
-        source = None
         reschedule = []
         while not stop:
-            source, events = self.event_queue.get()
-            events = Events(events, reschedule)
-            reschedule = []
+            timeout = None
+            if self.coalescer is not None:
+                timeout = self.coalescer.timeout()
             try:
-                for event in events:
-                    handlers = event_map.get(
-                        event.__class__, [self.default_handler]
-                    )
-
-                    for handler in tuple(handlers):
-                        try:
-                            target = event['header']['target']
-                            handler(target, event)
-                        except RescheduleException:
-                            if 'rcounter' not in event['header']:
-                                event['header']['rcounter'] = 0
-                            if event['header']['rcounter'] < 3:
-                                event['header']['rcounter'] += 1
-                                self.log.debug('reschedule %s' % (event,))
-                                reschedule.append(event)
-                            else:
-                                self.log.error('drop %s' % (event,))
-                        except InvalidateHandlerException:
-                            try:
-                                handlers.remove(handler)
-                            except Exception:
-                                self.log.error(
-                                    'could not invalidate '
-                                    'event handler:\n%s'
-                                    % traceback.format_exc()
-                                )
-                        except ShutdownException:
-                            stop = True
-                            break
-                        except DBMExitException:
-                            return
-                        except Exception:
-                            self.log.error(
-                                'could not load event:\n%s\n%s'
-                                % (event, traceback.format_exc())
-                            )
-                    if time.time() - self.gctime > config.gc_timeout:
-                        self.gctime = time.time()
-            except Exception as e:
-                self.log.error(f'exception <{e}> in source {source}')
-                # restart the target
-                try:
-                    self.log.debug(f'requesting source {source} restart')
-                    self.ndb.sources[source].state.set('restart')
-                except KeyError:
-                    self.log.debug(f'key error for {source}')
-                    pass
+                source, events = self.event_queue.get(timeout=timeout)
+            except queue.Empty:
+                # the coalescing window expired
+                source, events = None, None
+            # load the queued batches in one transaction
+            self.ndb.schema.begin()
+            try:
+                counter = 0
+                while events is not None:
+                    self.account('queue', self.event_queue.latency)
+                    events, reschedule = Events(events, reschedule), []
+                    timestamp = time.time()
+                    try:
+                        counter += self.handle_events(
+                            source, events, reschedule
+                        )
+                    except ShutdownException:
+                        stop = True
+                    except DBMExitException:
+                        return
+                    self.account('apply', time.time() - timestamp)
+                    self.counters['batches'] += 1
+                    if stop or counter >= self.transaction_size:
+                        break
+                    try:
+                        source, events = self.event_queue.get(block=False)
+                    except queue.Empty:
+                        break
+                if self.coalescer is not None and self.coalescer.expired():
+                    try:
+                        counter += self.handle_events(
+                            None, self.coalescer.flush(), reschedule, False
+                        )
+                    except ShutdownException:
+                        stop = True
+                self.counters['events'] += counter
+            finally:
+                timestamp = time.time()
+                self.ndb.schema.commit()
+                self.account('commit', time.time() - timestamp)
+                self.counters['transactions'] += 1
 
         # release all the sources
         for target in tuple(self.ndb.sources.cache):
@@ -69,7 +69,7 @@ from .objects.netns import NetNS
 from .objects.probe import Probe
 from .objects.route import Route
 from .objects.rule import Rule
-from .report import Record, RecordSet
+from .report import Record, RecordSet, SQLRequest
 from .source import Source, SourceProxy
 
 
@@ -344,14 +344,10 @@ class View(dict):
         ret.register()
         return ret
 
-    def exists(self, key, table=None):
-        '''
-        Check if the specified object exists in the database::
-
-            ndb.interfaces.exists('eth0')
-            ndb.interfaces.exists({'ifname': 'eth0', 'target': 'localhost'})
-            ndb.addresses.exists('127.0.0.1/8')
-        '''
+    def _lookup_fields(self, key):
+        #
+        # the object key -> DB fields to look up the object
+        #
         if self.chain:
             context = self.chain.context
         else:
@@ -367,34 +363,57 @@ class View(dict):
             policy=RSLV_DELETE,
         )
 
-        table = table or self.table
-        schema = self.ndb.schema
-        task_manager = self.ndb.task_manager
-        names = schema.compiled[self.table]['all_names']
-
-        self.log.debug('check if the key %s exists in table %s' % (key, table))
-        keys = []
-        values = []
+        names = self.ndb.schema.compiled[self.table]['all_names']
+        fields = {}
         for name, value in key.items():
             nla_name = iclass.name2nla(name)
             if nla_name in names:
                 name = nla_name
             if value is not None and name in names:
-                keys.append('f_%s = %s' % (name, schema.plch))
                 if isinstance(value, (dict, list, tuple, set)):
                     value = json.dumps(value)
-                values.append(value)
-        spec = task_manager.db_fetchone(
-            'SELECT * FROM %s WHERE %s' % (self.table, ' AND '.join(keys)),
-            values,
+                fields[name] = value
+        return fields
+
+    def exists(self, key, table=None):
+        '''
+        Check if the specified object exists in the database::
+
+            ndb.interfaces.exists('eth0')
+            ndb.interfaces.exists({'ifname': 'eth0', 'target': 'localhost'})
+            ndb.addresses.exists('127.0.0.1/8')
+        '''
+        fields = self._lookup_fields(key)
+        self.log.debug(
+            'check if the key %s exists in table %s'
+            % (fields, table or self.table)
         )
-        if spec is not None:
+        if self.ndb.task_manager.db_lookup(self.table, fields):
             self.log.debug('exists')
             return True
         else:
             self.log.debug('not exists')
             return False
 
+    @check_auth('obj:read')
+    def explain(self, spec=None, **kwarg):
+        '''
+        Return the DB query plan for the object lookup, and the
+        list of the tables that are scanned by the lookup, to spot
+        the lookups that need an index::
+
+            >>> ndb.routes.explain({'oif': 2})
+            {'request': 'SELECT * FROM routes WHERE f_target = ? AND ...',
+             'plan': ['SEARCH routes USING INDEX ix_routes_RTA_OIF ...'],
+             'scans': []}
+
+        Frequent lookups that end up in a table scan are indexed
+        automatically, the declared indices for every object class
+        are defined by `lookup_index()` in the object SQL schema.
+        '''
+        fields = self._lookup_fields(spec or kwarg)
+        return self.ndb.task_manager.db_explain(self.table, fields)
+
     def __setitem__(self, key, value):
         raise NotImplementedError()
 
@@ -439,31 +458,25 @@ class View(dict):
         for record in dump:
             yield Record(fnames, record, self.classes[self.table])
 
+    def _record_set(self, dump):
+        config = {
+            'recordset_pipe': self.ndb.config.get('recordset_pipe', 'false')
+        }
+        if isinstance(dump, SQLRequest):
+            return RecordSet(dump.records(), config=config, request=dump)
+        return RecordSet(self._native(dump), config=config)
+
     @cli.show_result
     @check_auth('obj:list')
     def dump(self):
         iclass = self.classes[self.table]
-        return RecordSet(
-            self._native(iclass.dump(self)),
-            config={
-                'recordset_pipe': self.ndb.config.get(
-                    'recordset_pipe', 'false'
-                )
-            },
-        )
+        return self._record_set(iclass.dump(self))
 
     @cli.show_result
     @check_auth('obj:list')
     def summary(self):
         iclass = self.classes[self.table]
-        return RecordSet(
-            self._native(iclass.summary(self)),
-            config={
-                'recordset_pipe': self.ndb.config.get(
-                    'recordset_pipe', 'false'
-                )
-            },
-        )
+        return self._record_set(iclass.summary(self))
 
     def __repr__(self):
         if self.chain and 'ifname' in self.chain:
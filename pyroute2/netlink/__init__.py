@@ -616,6 +616,7 @@ NETLINK_SCSITRANSPORT = 18  # SCSI Transports
 # NLA flags
 NLA_F_NESTED = 1 << 15
 NLA_F_NET_BYTEORDER = 1 << 14
+NLA_TYPE_MASK = ~(NLA_F_NESTED | NLA_F_NET_BYTEORDER) & 0xFFFF
 
 
 # Netlink message flags values (nlmsghdr.flags)
@@ -697,6 +698,205 @@ cache_fmt = {}
 cache_hdr = {}
 cache_jit = {}
 
+nla_header_struct = struct.Struct('HH')
+nlmsg_header_struct = struct.Struct('IHHI')
+
+
+def nla_types(nla_map):
+    '''
+    Return `{name: type}` for an enumerated `nla_map`, like
+    `(('CTA_UNSPEC', 'none'), ('CTA_TUPLE_ORIG', 'cta_tuple'), ...)`.
+    '''
+    return {x[0]: idx for idx, x in enumerate(nla_map)}
+
+
+def nla_encode(nla_type, payload):
+    '''
+    Encode a raw NLA: the header, the payload and the padding.
+    Use it instead of NLA objects to encode big bulk requests.
+    '''
+    length = len(payload) + 4
+    return (
+        nla_header_struct.pack(length, nla_type)
+        + payload
+        + b'\0' * (-length % 4)
+    )
+
+
+def nla_iter(data, offset, end):
+    '''
+    Iterate raw NLA in `data` from `offset` to `end` without
+    decoding them, yield `(type, start, stop)`, where `type` has
+    the NLA flags cleared, and `start:stop` is the payload.
+    '''
+    unpack_from = nla_header_struct.unpack_from
+    while offset + 4 <= end:
+        length, nla_type = unpack_from(data, offset)
+        if length < 4:
+            break
+        yield nla_type & NLA_TYPE_MASK, offset + 4, offset + length
+        offset += (length + 3) & ~3
+
+
+def nlmsg_iter(data):
+    '''
+    Iterate raw netlink messages in `data` without decoding them,
+    yield `(offset, length, type, flags, sequence_number)`.
+    '''
+    unpack_from = nlmsg_header_struct.unpack_from
+    offset = 0
+    while offset + 16 <= len(data):
+        length, msg_type, flags, seq = unpack_from(data, offset)
+        if length < 16:
+            break
+        yield offset, length, msg_type, flags, seq
+        offset += (length + 3) & ~3
+
+
+class DecodePlan:
+    '''
+    Compiled decoder plan for a message layout.
+
+    The plan is compiled once per message class, see
+    `nlmsg_base.decode_plan()`. Consecutive string formats of the
+    header and the fields are merged into combined `struct.Struct`
+    objects, so decoding a message takes one `unpack_from()` call
+    per run of fields instead of one call per field.
+
+    Formats are merged only if the combined struct has the same
+    size as the sum of the parts, i.e. the merge does not add any
+    alignment padding, and the byte order prefix is the same.
+
+    A run is a tuple `(unpack_from, names, spans, size)`:
+
+    * unpack_from -- bound `struct.Struct.unpack_from`, or the
+      `decode_from()` method for a field type
+    * names -- field names, or the field name for a field type
+    * spans -- `None` if every field unpacks to exactly one value,
+      otherwise `(start, stop)` slices of the unpacked tuple
+    * size -- run size in bytes, `None` for a field type
+    '''
+
+    __slots__ = (
+        'header',
+        'fields',
+        'header_runs',
+        'runs',
+        'packed',
+        'variants',
+    )
+    max_variants = 16
+
+    def __init__(self, header, fields):
+        self.header = header
+        self.fields = fields
+        self.variants = {}
+        self.header_runs = self.compile_runs(header or ())
+        self.runs = self.compile_runs(fields or ())
+        self.packed = None
+
+    @staticmethod
+    def compile_runs(fields):
+        ret = []
+        run = None
+
+        def flush():
+            if run is None:
+                return
+            fmt, names, counts, size = run
+            spans = None
+            if any(x != 1 for x in counts):
+                spans = []
+                start = 0
+                for count in counts:
+                    spans.append((start, start + count))
+                    start += count
+                spans = tuple(spans)
+            ret.append(
+                (struct.Struct(fmt).unpack_from, tuple(names), spans, size)
+            )
+
+        for name, fmt in fields:
+            if not isinstance(fmt, str):
+                flush()
+                run = None
+                if isinstance(fmt, type):
+                    ret.append((fmt.decode_from, name, None, None))
+                continue
+            if fmt[:1] in ('@', '=', '<', '>', '!'):
+                prefix, body = fmt[0], fmt[1:]
+            else:
+                prefix, body = '@', fmt
+            size = struct.calcsize(fmt)
+            count = len(struct.unpack_from(fmt, bytes(size)))
+            if (
+                run is not None
+                and run[0][0] == prefix
+                and struct.calcsize(run[0] + body) == run[3] + size
+            ):
+                run[0] += body
+                run[1].append(name)
+                run[2].append(count)
+                run[3] += size
+                continue
+            flush()
+            run = [prefix + body, [name], [count], size]
+        flush()
+        return tuple(ret)
+
+    @staticmethod
+    def unpack(runs, data, offset, target):
+        '''
+        Decode `runs` from `data` starting at `offset` into the
+        `target` dict. Return the offset right after the last run.
+        '''
+        for unpack_from, names, spans, size in runs:
+            if size is None:
+                target[names], offset = unpack_from(data, offset)
+                continue
+            values = unpack_from(data, offset)
+            if spans is None:
+                target.update(zip(names, values))
+            else:
+                for name, (start, stop) in zip(names, spans):
+                    if stop - start == 1:
+                        target[name] = values[start]
+                    else:
+                        target[name] = values[start:stop]
+            offset += size
+        return offset
+
+    def get_packed(self):
+        '''
+        Return `(unpack_from, names)` for the packed struct decoder,
+        where all the fields are decoded with one format string.
+        '''
+        if self.packed is None:
+            fmt = ''.join(x[1] for x in self.fields)
+            # only public fields consume unpacked values, private
+            # ones are expected to be padding like `3x`
+            self.packed = (
+                struct.Struct(fmt).unpack_from,
+                tuple(x[0] for x in self.fields if x[0][0] != '_'),
+            )
+        return self.packed
+
+    def variant(self, header, fields):
+        '''
+        Return a plan for a layout overridden in an instance,
+        like array cells that use `cell_header`.
+
+        The plan keeps references to `header` and `fields`, so
+        their `id()` is a valid cache key while the plan exists.
+        '''
+        key = (id(header), id(fields))
+        plan = self.variants.get(key)
+        if plan is None:
+            plan = type(self)(header, fields)
+            if len(self.variants) < self.max_variants:
+                self.variants[key] = plan
+        return plan
+
 
 class NlaSpec(dict):
     def __init__(
@@ -775,12 +975,17 @@ class SQLSchema:
 
         self.spec = ret
         self.index = []
+        self.lookup_indices = []
         self.foreign_keys = []
 
     def unique_index(self, *index):
         self.index = index
         return self
 
+    def lookup_index(self, *index):
+        self.lookup_indices.append(index)
+        return self
+
     def constraint(self, name, spec):
         idx = 0
         for field, tspec in self.spec:
@@ -850,6 +1055,7 @@ class nlmsg_base(dict):
     __compiled_ft = False
     __t_nla_map = None
     __r_nla_map = None
+    __d_nla_map = None
     # schema
     __schema = None
 
@@ -864,6 +1070,7 @@ class nlmsg_base(dict):
         "_nla_init",
         "_nla_array",
         "_nla_flags",
+        "_nla_lazy",
         "value",
         "_r_value_map",
         "__weakref__",
@@ -881,7 +1088,8 @@ class nlmsg_base(dict):
         self.data = data or bytearray()
         self.offset = offset
         self.length = length or 0
-        self.chain = [self]
+        # set by nla(), msg[0] returns msg itself without a chain
+        self.chain = None
         if parent is not None:
             # some structures use parents, some not,
             # so don't create cycles without need
@@ -892,10 +1100,14 @@ class nlmsg_base(dict):
         self._nla_init = init
         self._nla_array = False
         self._nla_flags = self.nla_flags
+        self._nla_lazy = False
         self['attrs'] = []
         self.value = NotInitialized
-        # work only on non-empty mappings
-        if self.nla_map and not self.__class__.__compiled_nla:
+        # work only on non-empty mappings; the compiled table is
+        # per class, subclasses may override the parent nla_map
+        if self.nla_map and not self.__class__.__dict__.get(
+            '_nlmsg_base__compiled_nla'
+        ):
             self.compile_nla_table()
         if self.header:
             self['header'] = {}
@@ -904,6 +1116,23 @@ class nlmsg_base(dict):
     def sql_schema(cls):
         return SQLSchema(cls)
 
+    def decode_plan(self):
+        '''
+        Return the compiled decoder plan for the message layout.
+
+        The plan is compiled once per class and cached. Instances
+        that override `header` or `fields` get a plan variant
+        compiled for their own layout.
+        '''
+        plan = cache_jit.get(self.__class__)
+        if plan is None:
+            plan = cache_jit[self.__class__] = DecodePlan(
+                self.header, self.fields
+            )
+        if plan.header is self.header and plan.fields is self.fields:
+            return plan
+        return plan.variant(self.header, self.fields)
+
     @property
     def buf(self):
         logging.error(
@@ -922,6 +1151,7 @@ class nlmsg_base(dict):
         received from the socket.
         '''
         ret = type(self)(data=self.data, offset=self.offset)
+        ret._nla_lazy = self._nla_lazy
         ret.decode()
         return ret
 
@@ -1151,12 +1381,13 @@ class nlmsg_base(dict):
                 ##
                 offset += 4
                 self.length = self['header']['length']
-            else:
-                for name, fmt in self.header:
-                    self['header'][name] = struct.unpack_from(
-                        fmt, self.data, offset
-                    )[0]
-                    offset += struct.calcsize(fmt)
+            elif self.header:
+                offset = DecodePlan.unpack(
+                    self.decode_plan().header_runs,
+                    self.data,
+                    offset,
+                    self['header'],
+                )
                 # update length from header
                 # it can not be less than 4
                 if 'header' in self:
@@ -1346,14 +1577,15 @@ class nlmsg_base(dict):
 
     def __getitem__(self, key):
         if isinstance(key, int):
-            return self.chain[key]
-        if key == 'value' and key not in self:
-            return NotInitialized
-        if key not in self:
-            fields = dict(self.fields)
-            if key in fields:
+            return (self.chain or (self,))[key]
+        try:
+            return dict.__getitem__(self, key)
+        except KeyError:
+            if key == 'value':
+                return NotInitialized
+            if key in dict(self.fields):
                 return 0
-        return dict.__getitem__(self, key)
+            raise
 
     def __delitem__(self, key):
         if key == 'value' and key not in self:
@@ -1464,6 +1696,7 @@ class nlmsg_base(dict):
             self.nla_map.types = self
             self.__class__.__t_nla_map = self.nla_map
             self.__class__.__r_nla_map = self.nla_map
+            self.__class__.__d_nla_map = None
             self.__class__.__compiled_nla = True
             return
         elif isinstance(self.nla_map, dict):
@@ -1473,6 +1706,7 @@ class nlmsg_base(dict):
                 self.nla_map['encode'].types = self
             self.__class__.__t_nla_map = self.nla_map['decode']
             self.__class__.__r_nla_map = self.nla_map['encode']
+            self.__class__.__d_nla_map = None
             self.__class__.__compiled_nla = True
             return
 
@@ -1538,8 +1772,25 @@ class nlmsg_base(dict):
 
         self.__class__.__t_nla_map = t_nla_map
         self.__class__.__r_nla_map = r_nla_map
+        self.__class__.__d_nla_map = {
+            key: self.nla_dispatch(prime) for key, prime in t_nla_map.items()
+        }
         self.__class__.__compiled_nla = True
 
+    @staticmethod
+    def nla_dispatch(prime):
+        '''
+        Convert an NLA spec into a decoder dispatch tuple
+        `(name, class, is_function, init, nla_array)`.
+        '''
+        return (
+            prime['name'],
+            prime['class'],
+            isinstance(prime['class'], types.FunctionType),
+            prime['init'],
+            prime['nla_array'],
+        )
+
     def valid_nla(self, nla):
         return nla in self.__class__.__r_nla_map.keys()
 
@@ -1584,51 +1835,91 @@ class nlmsg_base(dict):
                 offset += (nla_instance.length + 4 - 1) & ~(4 - 1)
         return offset
 
+    def resolve_nla(self, dispatch, offset):
+        '''
+        Return the dispatch tuple with the NLA class resolved: the
+        class may be picked by a function, that uses the message.
+        '''
+        name, msg_class, is_function, init, nla_array = dispatch
+        if not is_function:
+            return dispatch
+        msg_class = msg_class(self, data=self.data, offset=offset)
+        return (name, msg_class, False, init, nla_array)
+
+    def decode_nla(self, offset, length, base_msg_type, dispatch):
+        '''
+        Create an NLA instance for the NLA chain. The instance
+        itself is decoded later, on the first access to the value,
+        see `nla_slot.try_to_decode()`.
+        '''
+        if dispatch is not None:
+            dispatch = self.resolve_nla(dispatch, offset)
+        return create_nla(
+            self.data,
+            offset,
+            length,
+            base_msg_type,
+            dispatch,
+            self,
+            self._nla_lazy,
+        )
+
     def decode_nlas(self, offset):
         '''
         Decode the NLA chain. Should not be called manually, since
         it is called from `decode()` routine.
+
+        In the lazy mode only the NLA index is built: the chain
+        gets `nla_slot_lazy` objects, that create NLA instances
+        on the first access.
         '''
         t_nla_map = self.__class__.__t_nla_map
-        while offset - self.offset <= self.length - 4:
-            nla_instance = None
+        # the dispatch table is compiled only for static NLA maps,
+        # NlaMapAdapter specs are converted on the fly
+        d_nla_map = self.__class__.__d_nla_map
+        data = self.data
+        end = self.offset + self.length
+        append = dict.__getitem__(self, 'attrs').append
+        unpack_from = nla_header_struct.unpack_from
+        lazy = self._nla_lazy
+        if lazy:
+            # lazy slots must not reference the message, or every
+            # message would be freed only by the cyclic GC
+            ref = weakref.ref(self)
+        while offset <= end - 4:
             # pick the length and the type
-            (length, base_msg_type) = struct.unpack_from(
-                'HH', self.data, offset
-            )
+            (length, base_msg_type) = unpack_from(data, offset)
             # first two bits of msg_type are flags:
             msg_type = base_msg_type & ~(NLA_F_NESTED | NLA_F_NET_BYTEORDER)
             # rewind to the beginning
-            length = min(max(length, 4), (self.length - offset + self.offset))
+            length = min(max(length, 4), end - offset)
             # we have a mapping for this NLA
-            if msg_type in t_nla_map:
-                prime = t_nla_map[msg_type]
-                # get the class
-                msg_class = t_nla_map[msg_type]['class']
-                # is it a class or a function?
-                if isinstance(msg_class, types.FunctionType):
-                    # if it is a function -- use it to get the class
-                    msg_class = msg_class(self, data=self.data, offset=offset)
-                # decode NLA
-                nla_instance = msg_class(
-                    data=self.data,
-                    offset=offset,
-                    parent=self,
-                    length=length,
-                    init=prime['init'],
-                )
-                nla_instance._nla_array = prime['nla_array']
-                nla_instance._nla_flags = base_msg_type & (
-                    NLA_F_NESTED | NLA_F_NET_BYTEORDER
+            if d_nla_map is not None:
+                dispatch = d_nla_map.get(msg_type)
+            elif msg_type in t_nla_map:
+                dispatch = self.nla_dispatch(t_nla_map[msg_type])
+            else:
+                dispatch = None
+            name = 'UNKNOWN' if dispatch is None else dispatch[0]
+            if lazy:
+                if dispatch is not None:
+                    dispatch = self.resolve_nla(dispatch, offset)
+                slot = nla_slot_lazy(
+                    name, (ref, data, offset, length, base_msg_type, dispatch)
                 )
-                name = prime['name']
+                if dispatch is not None and dispatch[1].own_parent:
+                    # the NLA uses the parent to decode, do it now
+                    slot.cell
+                append(slot)
             else:
-                name = 'UNKNOWN'
-                nla_instance = nla_base(
-                    data=self.data, offset=offset, length=length
+                append(
+                    nla_slot(
+                        name,
+                        self.decode_nla(
+                            offset, length, base_msg_type, dispatch
+                        ),
+                    )
                 )
-
-            self['attrs'].append(nla_slot(name, nla_instance))
             offset += (length + 4 - 1) & ~(4 - 1)
 
 
@@ -1662,11 +1953,9 @@ class nlmsg_decoder_generic(object):
             return value, offset
 
     def ft_decode(self, offset):
-        for name, fmt in self.fields:
-            if isinstance(fmt, str):
-                self[name], offset = self.decode_field(fmt, self.data, offset)
-            elif isinstance(fmt, type):
-                self[name], offset = fmt.decode_from(self.data, offset)
+        offset = DecodePlan.unpack(
+            self.decode_plan().runs, self.data, offset, self
+        )
         # read NLA chain
         if self.nla_map:
             offset = (offset + 4 - 1) & ~(4 - 1)
@@ -1694,16 +1983,8 @@ class nlmsg_decoder_string(object):
 
 class nlmsg_decoder_struct(object):
     def ft_decode(self, offset):
-        names = []
-        fmt = ''
-        for field in self.fields:
-            names.append(field[0])
-            fmt += field[1]
-        value = struct.unpack_from(fmt, self.data, offset)
-        values = list(value)
-        for name in names:
-            if name[0] != '_':
-                self[name] = values.pop(0)
+        unpack_from, names = self.decode_plan().get_packed()
+        self.update(zip(names, unpack_from(self.data, offset)))
         # read NLA chain
         if self.nla_map:
             offset = (offset + 4 - 1) & ~(4 - 1)
@@ -1781,6 +2062,25 @@ class nlmsg_encoder_generic(object):
 ##
 
 
+def create_nla(data, offset, length, base_msg_type, dispatch, parent, lazy):
+    '''
+    Create an NLA instance by a resolved dispatch tuple, see
+    `nlmsg_base.resolve_nla()`.
+    '''
+    if dispatch is None:
+        return nla_base(data=data, offset=offset, length=length)
+    name, msg_class, _, init, nla_array = dispatch
+    nla_instance = msg_class(
+        data=data, offset=offset, parent=parent, length=length, init=init
+    )
+    nla_instance._nla_array = nla_array
+    nla_instance._nla_flags = base_msg_type & (
+        NLA_F_NESTED | NLA_F_NET_BYTEORDER
+    )
+    nla_instance._nla_lazy = lazy
+    return nla_instance
+
+
 class nla_slot(object):
     __slots__ = ("cell",)
 
@@ -1842,6 +2142,55 @@ class nla_slot(object):
         return repr((self.cell[0], self.get_value()))
 
 
+class nla_slot_lazy(nla_slot):
+    '''
+    NLA slot for the lazy decoding mode.
+
+    Keeps only the NLA name and its location in the message
+    buffer. The NLA instance is created on the first access to
+    the slot value and then cached, so lookups by name like
+    `get_attr()` do not touch NLAs they skip.
+
+    The slot references the parent message only weakly, and the
+    NLA class is resolved when the slot is created, so the slot
+    decodes the same way after the message is dropped. NLA that
+    use the parent to decode, like `target`, are decoded at once.
+    '''
+
+    __slots__ = ("_name", "_spec")
+
+    def __init__(self, name, spec):
+        # spec: (parent ref, data, offset, length, msg_type, dispatch)
+        self._name = name
+        self._spec = spec
+
+    @property
+    def cell(self):
+        if self._spec is None:
+            return nla_slot.cell.__get__(self)
+        ref, data, offset, length, base_msg_type, dispatch = self._spec
+        parent = ref()
+        if parent is not None and dispatch and dispatch[1].own_parent:
+            # the slot is referenced by the parent, avoid the cycle
+            parent = weakref.proxy(parent)
+        nla_instance = create_nla(
+            data, offset, length, base_msg_type, dispatch, parent, True
+        )
+        nla_slot.cell.__set__(self, (self._name, nla_instance))
+        self._spec = None
+        self.try_to_decode()
+        return nla_slot.cell.__get__(self)
+
+    @property
+    def name(self):
+        return self._name
+
+    def __getitem__(self, key):
+        if key == 0:
+            return self._name
+        return super().__getitem__(key)
+
+
 ##
 # 8<---------------------------------------------------------------------
 #
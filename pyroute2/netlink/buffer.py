@@ -1,3 +1,6 @@
+import ctypes
+import weakref
+
 try:
     from multiprocessing import shared_memory
 except ImportError:
@@ -7,18 +10,69 @@ except ImportError:
 class Page:
     '''
     Memory page.
+
+    A page in use may be split into chunks with `slice()`. Every
+    chunk is a read-only memoryview on the page memory, and the page returns
+    to the free list only when it is retired and all the chunks
+    are garbage collected.
+
+    The chunks are tracked by their buffer exporters, not by the
+    memoryview objects: any memoryview derived from a chunk, like
+    `chunk[a:b]`, keeps the page in use as well.
     '''
 
-    def __init__(self, view, offset):
+    def __init__(self, view, offset, free_list=None):
         self.view = view
         self.offset = offset
         self.is_free = True
+        self.free_list = free_list
+        self.used = 0
+        self.retired = False
+        self.chunks = {}
 
     def use(self):
         self.is_free = False
+        self.used = 0
+        self.retired = False
 
     def free(self):
+        if self.is_free:
+            return
         self.is_free = True
+        if self.free_list is not None:
+            self.free_list.append(self)
+
+    @property
+    def tail(self):
+        '''Free space in the end of the page.'''
+        return self.view[self.used :]
+
+    def slice(self, length):
+        '''
+        Return `length` bytes from the start of the free space as
+        a memoryview and mark them as used.
+        '''
+        # a ctypes array on the page memory is the chunk exporter,
+        # it lives as long as any memoryview of the chunk
+        owner = (ctypes.c_char * length).from_buffer(self.view, self.used)
+        self.used += length
+        ref = weakref.ref(owner, self.release)
+        self.chunks[id(ref)] = ref
+        return memoryview(owner).cast('B').toreadonly()
+
+    def release(self, ref):
+        self.chunks.pop(id(ref), None)
+        if self.retired and not self.chunks:
+            self.free()
+
+    def retire(self):
+        '''
+        Stop allocating chunks from the page; free it as soon
+        as there are no references to the chunks.
+        '''
+        self.retired = True
+        if not self.chunks:
+            self.free()
 
     def close(self):
         self.view.release()
@@ -43,11 +97,16 @@ class Buffer:
             self.buf = self.mem.buf
         self.view = memoryview(self.buf)
         self.directory = {}
+        self.free_list = []
         for index in range(size // page_size):
             offset = index * page_size
             self.directory[index] = Page(
-                self.view[offset : offset + self.page_size], offset
+                self.view[offset : offset + self.page_size],
+                offset,
+                self.free_list,
             )
+        # pop() takes pages from the end of the list
+        self.free_list.extend(reversed(self.directory.values()))
 
     def __enter__(self):
         return self
@@ -56,11 +115,12 @@ class Buffer:
         self.close()
 
     def get_free_page(self):
-        for index, page in self.directory.items():
-            if page.is_free:
-                page.use()
-                return page
-        raise MemoryError('no free memory pages available')
+        try:
+            page = self.free_list.pop()
+        except IndexError:
+            raise MemoryError('no free memory pages available')
+        page.use()
+        return page
 
     def close(self):
         for page in self.directory.values():
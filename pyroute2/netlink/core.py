@@ -10,13 +10,16 @@ import threading
 from urllib import parse
 
 from pyroute2 import config, netns
-from pyroute2.common import AddrPool
-from pyroute2.netlink import NLM_F_MULTI
+from pyroute2.common import SeqPool
+from pyroute2.netlink import NLM_F_MULTI, NLMSG_DONE, NLMSG_ERROR, nlmsg_iter
 from pyroute2.netns import setns
 from pyroute2.requests.main import RequestProcessor
 
 log = logging.getLogger(__name__)
 Stats = collections.namedtuple('Stats', ('qsize', 'delta', 'delay'))
+# stats are not collected by the asyncio core, so all the
+# messages share one immutable instance
+EMPTY_STATS = Stats(0, 0, 0)
 CoreSocketResources = collections.namedtuple(
     'CoreSocketResources',
     ('socket', 'msg_queue', 'event_loop', 'transport', 'protocol'),
@@ -114,6 +117,98 @@ class CoreDatagramProtocol(CoreProtocol):
         self.enqueue(data, addr)
 
 
+class CoreBufferedDatagramTransport:
+    '''
+    Minimal datagram transport, that receives data with `recv_into()`
+    directly to the `Buffer` pages, and passes memoryview chunks of
+    the pages to the protocol, so no bytes objects are created on
+    the receive path.
+
+    A page is used for several datagrams while it has at least
+    `max_size` bytes free; if the buffer runs out of free pages,
+    the transport falls back to `recv()`.
+    '''
+
+    def __init__(self, loop, sock, protocol, buffer, max_size=65536):
+        self.loop = loop
+        self.sock = sock
+        self.protocol = protocol
+        self.buffer = buffer
+        self.max_size = min(max_size, buffer.page_size)
+        self.page = None
+        self.closing = False
+        self.loop.add_reader(self.sock.fileno(), self.read_ready)
+        self.loop.call_soon(self.protocol.connection_made, self)
+
+    def get_page(self):
+        if self.page is not None:
+            if len(self.page.view) - self.page.used >= self.max_size:
+                return self.page
+            self.page.retire()
+            self.page = None
+        try:
+            self.page = self.buffer.get_free_page()
+        except MemoryError:
+            log.debug('no free pages in the receive buffer')
+        return self.page
+
+    def read_ready(self):
+        page = self.get_page()
+        try:
+            if page is None:
+                data = self.sock.recv(self.max_size)
+                length = len(data)
+            else:
+                tail = page.tail[: self.max_size]
+                length = self.sock.recv_into(tail, 0, socket.MSG_TRUNC)
+                data = None
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            log.warning('receive error: %s', e)
+            return
+        if data is None:
+            if length > len(tail):
+                # the datagram is truncated, report the error
+                # using the sequence number from the header
+                data = self.truncated(tail, length)
+            else:
+                data = page.slice(length)
+        self.protocol.datagram_received(data, None)
+
+    @staticmethod
+    def truncated(data, length):
+        log.error('datagram truncated: %s bytes', length)
+        seq, pid = struct.unpack_from('II', data, 8)
+        return struct.pack(
+            'IHHIIiIHHII',
+            36,
+            2,  # NLMSG_ERROR
+            0,
+            seq,
+            pid,
+            -errno.EMSGSIZE,
+            16,
+            1,  # NLMSG_NOOP
+            0,
+            seq,
+            pid,
+        )
+
+    def is_closing(self):
+        return self.closing
+
+    def close(self):
+        if self.closing:
+            return
+        self.closing = True
+        self.loop.remove_reader(self.sock.fileno())
+        if self.page is not None:
+            self.page.retire()
+            self.page = None
+        self.loop.call_soon(self.protocol.connection_lost, None)
+
+
 async def netns_main(ctl, nsname, flags, libc, cls):
     # A simple child process
     #
@@ -193,9 +288,9 @@ class AsyncCoreSocket:
         self.scheme = url.scheme if url.scheme else url.path
         self.use_socket = use_socket
         self.callbacks = []  # [(predicate, callback, args), ...]
-        self.addr_pool = AddrPool(minaddr=0x000000FF, maxaddr=0x0000FFFF)
+        self.addr_pool = SeqPool(minaddr=0x000000FF, maxaddr=0x0000FFFF)
         self.marshal = None
-        self.buffer = []
+        self.buffer = None
         self.msg_reschedule = []
         self.__all_open_resources = set()
 
@@ -449,13 +544,16 @@ class AsyncCoreSocket:
         enough = False
         started = False
         error = None
+        target = self.status['target']
         while not enough:
             log.debug('await data on %s', self.msg_queue)
             data = await self.msg_queue.get(msg_seq)
-            messages = tuple(self.marshal.parse(data, msg_seq, callback))
-            if len(messages) == 0:
+            if not data:
                 break
-            for msg in messages:
+            # parse and yield messages one by one, not to keep
+            # decoded copies of the whole buffer at once
+            msg = None
+            for msg in self.marshal.parse(data, msg_seq, callback):
                 log.debug("message %s", msg)
                 if msg.get('header', {}).get('error') is not None:
                     error = msg['header']['error']
@@ -464,11 +562,29 @@ class AsyncCoreSocket:
                 if self.marshal.is_enough(msg):
                     enough = True
                     break
-                msg['header']['target'] = self.status['target']
-                msg['header']['stats'] = Stats(0, 0, 0)
+                msg['header']['target'] = target
+                msg['header']['stats'] = EMPTY_STATS
                 started = True
                 log.debug("yield %s", msg['header'])
-                yield msg
+                try:
+                    yield msg
+                except GeneratorExit:
+                    # the consumer has stopped before the end of a
+                    # multipart response; drop the rest of it, or it
+                    # will go to the broadcast queue after the cleanup
+                    if (
+                        msg_seq != 0
+                        and msg['header'].get('flags', 0) & NLM_F_MULTI
+                        and not (callable(terminate) and terminate(msg))
+                    ):
+                        await self.drain(msg_seq, data)
+                    raise
+            if msg is None:
+                if msg_seq in self.marshal.seq_map:
+                    # all the messages are consumed by the seq parser
+                    continue
+                # nothing to parse in the buffer
+                break
 
             if started and (
                 (msg_seq == 0)
@@ -479,6 +595,18 @@ class AsyncCoreSocket:
         if not noraise and error:
             raise error
 
+    async def drain(self, msg_seq, data):
+        '''
+        Drop the multipart response to `msg_seq` up to NLMSG_DONE
+        or NLMSG_ERROR, starting from the `data` buffer. The data
+        is not parsed, only the message headers are checked.
+        '''
+        while data:
+            for _, _, msg_type, _, seq in nlmsg_iter(data):
+                if seq == msg_seq and msg_type in (NLMSG_DONE, NLMSG_ERROR):
+                    return
+            data = await self.msg_queue.get(msg_seq)
+
     async def __aenter__(self):
         return self
 
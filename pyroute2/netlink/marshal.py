@@ -8,6 +8,7 @@ from pyroute2.netlink import (
     NLMSG_ERROR,
     mtypes,
     nlmsg,
+    nlmsg_header_struct,
     nlmsgerr,
 )
 from pyroute2.netlink.exceptions import (
@@ -28,6 +29,7 @@ class Marshal:
     key_format = None
     key_mask = None
     debug = False
+    lazy_decode = False
     default_message_class = nlmsg
     error_type = NLMSG_ERROR
 
@@ -51,6 +53,7 @@ class Marshal:
             msg = nlmsgerr(data, offset=offset)
         else:
             msg = msg_class(data, offset=offset)
+            msg._nla_lazy = self.lazy_decode
 
         try:
             msg.decode()
@@ -88,13 +91,12 @@ class Marshal:
         not support any defragmentation on that level
         '''
         offset = 0
+        unpack_from = nlmsg_header_struct.unpack_from
         # there must be at least one header in the buffer,
         # 'IHHII' == 16 bytes
         while offset <= len(data) - 16:
             # pick type and length
-            (length, key, flags, sequence_number) = struct.unpack_from(
-                'IHHI', data, offset
-            )
+            (length, key, flags, sequence_number) = unpack_from(data, offset)
             if skip_alien_seq and sequence_number != seq:
                 continue
             if not 0 < length <= len(data):
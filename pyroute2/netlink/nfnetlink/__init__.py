@@ -29,6 +29,10 @@ NFNL_SUBSYS_NFTABLES = 10
 NFNL_SUBSYS_NFT_COMPAT = 11
 NFNL_SUBSYS_COUNT = 12
 
+# batch messages
+NFNL_MSG_BATCH_BEGIN = 0x10
+NFNL_MSG_BATCH_END = 0x11
+
 # multicast group ids (for use with {add,drop}_membership)
 NFNLGRP_NONE = 0
 NFNLGRP_CONNTRACK_NEW = 1
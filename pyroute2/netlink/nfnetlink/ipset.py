@@ -21,6 +21,11 @@ IPSET_CMD_TYPE = 13  # 13: Get set type
 IPSET_CMD_GET_BYNAME = 14  # 14: Get set index by name
 IPSET_CMD_GET_BYINDEX = 15  # 15: Get set index by index
 
+# top level attributes used with the raw encoding
+IPSET_ATTR_DATA = 7  # Nested attributes of one entry
+IPSET_ATTR_ADT = 8  # Multiple data containers
+IPSET_ATTR_LINENO = 9  # Restore lineno
+
 # flags at command level (IPSET_ATTR_FLAGS)
 IPSET_FLAG_LIST_SETNAME = 1 << 1
 IPSET_FLAG_LIST_HEADER = 1 << 2
@@ -4,7 +4,11 @@ NFCTSocket -- low level connection tracking API
 See also: pyroute2.conntrack
 """
 
+import asyncio
+import errno
+import os
 import socket
+import struct
 
 from pyroute2.netlink import (
     NETLINK_NETFILTER,
@@ -14,11 +18,16 @@ from pyroute2.netlink import (
     NLM_F_DUMP,
     NLM_F_EXCL,
     NLM_F_REQUEST,
+    NLMSG_DONE,
     NLMSG_ERROR,
     nla,
+    nla_encode,
+    nla_types,
+    nlmsg_iter,
 )
+from pyroute2.netlink.exceptions import NetlinkError
 from pyroute2.netlink.nfnetlink import NFNL_SUBSYS_CTNETLINK, nfgen_msg
-from pyroute2.netlink.nlsocket import NetlinkSocket
+from pyroute2.netlink.nlsocket import NetlinkPipeline, NetlinkSocket
 
 IPCTNL_MSG_CT_NEW = 0
 IPCTNL_MSG_CT_GET = 1
@@ -196,6 +205,12 @@ def terminate_error_msg(msg):
     return msg['header']['type'] == NLMSG_ERROR
 
 
+def parse_nfct_msg(data, offset, length):
+    msg = nfct_msg(bytes(data[offset : offset + length]))
+    msg.decode()
+    return msg
+
+
 class nfct_stats(nfgen_msg):
     nla_map = (
         ('CTA_STATS_GLOBAL_UNSPEC', 'none'),
@@ -416,6 +431,12 @@ class nfct_msg(nfgen_msg):
         )
 
 
+# NLA types by name, to encode raw NLA in the bulk requests
+CTA_TYPES = nla_types(nfct_msg.nla_map)
+CTA_TUPLE_TYPES = nla_types(nfct_msg.cta_tuple.nla_map)
+CTA_IP_TYPES = nla_types(nfct_msg.cta_tuple.cta_ip.nla_map)
+CTA_PROTO_TYPES = nla_types(nfct_msg.cta_tuple.cta_proto.nla_map)
+
 FILTER_FLAG_CTA_IP_SRC = 1 << 0
 FILTER_FLAG_CTA_IP_DST = 1 << 1
 FILTER_FLAG_CTA_TUPLE_ZONE = 1 << 2
@@ -531,14 +552,30 @@ class NFCTAttrTuple(NFCTAttr):
             cta_proto.append(['CTA_PROTO_DST_PORT', self.dport])
             self.flags |= FILTER_FLAG_CTA_PROTO_DST_PORT
 
+        icmp_flags = {
+            'CTA_PROTO_ICMP': (
+                FILTER_FLAG_CTA_PROTO_ICMP_ID,
+                FILTER_FLAG_CTA_PROTO_ICMP_TYPE,
+                FILTER_FLAG_CTA_PROTO_ICMP_CODE,
+            ),
+            'CTA_PROTO_ICMPV6': (
+                FILTER_FLAG_CTA_PROTO_ICMPV6_ID,
+                FILTER_FLAG_CTA_PROTO_ICMPV6_TYPE,
+                FILTER_FLAG_CTA_PROTO_ICMPV6_CODE,
+            ),
+        }[self._attr_icmp]
+
         if self.icmp_id is not None:
             cta_proto.append([self._attr_icmp + '_ID', self.icmp_id])
+            self.flags |= icmp_flags[0]
 
         if self.icmp_type is not None:
             cta_proto.append([self._attr_icmp + '_TYPE', self.icmp_type])
+            self.flags |= icmp_flags[1]
 
         if self.icmp_code is not None:
             cta_proto.append([self._attr_icmp + '_CODE', self.icmp_code])
+            self.flags |= icmp_flags[2]
 
         if cta_ip:
             cta_tuple.append(['CTA_TUPLE_IP', {'attrs': cta_ip}])
@@ -548,6 +585,55 @@ class NFCTAttrTuple(NFCTAttr):
 
         return cta_tuple
 
+    def encode_nla(self, nla_type):
+        """Return the tuple encoded as an NLA of `nla_type`
+
+        The same as `attrs()` encoded by `nfct_msg`, but much faster,
+        for the bulk requests.
+        """
+        ip = self._attr_ip
+        icmp = self._attr_icmp
+        cta_ip = []
+        cta_proto = []
+        if self.saddr is not None:
+            cta_ip.append(
+                nla_encode(
+                    CTA_IP_TYPES[ip + '_SRC'],
+                    socket.inet_pton(self.family, self.saddr),
+                )
+            )
+        if self.daddr is not None:
+            cta_ip.append(
+                nla_encode(
+                    CTA_IP_TYPES[ip + '_DST'],
+                    socket.inet_pton(self.family, self.daddr),
+                )
+            )
+        for name, fmt, value in (
+            ('CTA_PROTO_NUM', 'B', self.proto),
+            ('CTA_PROTO_SRC_PORT', '>H', self.sport),
+            ('CTA_PROTO_DST_PORT', '>H', self.dport),
+            (icmp + '_ID', '>H', self.icmp_id),
+            (icmp + '_TYPE', 'B', self.icmp_type),
+            (icmp + '_CODE', 'B', self.icmp_code),
+        ):
+            if value is not None:
+                cta_proto.append(
+                    nla_encode(CTA_PROTO_TYPES[name], struct.pack(fmt, value))
+                )
+        cta_tuple = []
+        if cta_ip:
+            cta_tuple.append(
+                nla_encode(CTA_TUPLE_TYPES['CTA_TUPLE_IP'], b''.join(cta_ip))
+            )
+        if cta_proto:
+            cta_tuple.append(
+                nla_encode(
+                    CTA_TUPLE_TYPES['CTA_TUPLE_PROTO'], b''.join(cta_proto)
+                )
+            )
+        return nla_encode(nla_type, b''.join(cta_tuple))
+
     @classmethod
     def from_netlink(cls, family, ndmsg):
         cta_ip = ndmsg.get_attr('CTA_TUPLE_IP')
@@ -709,6 +795,38 @@ class NFCTAttrTuple(NFCTAttr):
         return r + '))'
 
 
+class NFCTBulkResult(object):
+    """
+    The result of `NFCTSocket.entry_many()`
+
+    `total` is the number of the requests sent, `errors` is a list
+    of `(entry, NetlinkError)` pairs for the failed requests, in
+    the order of ACKs.
+    """
+
+    __slots__ = ('total', 'errors', 'callback')
+
+    def __init__(self, callback=None):
+        self.total = 0
+        self.errors = []
+        self.callback = callback
+
+    @property
+    def done(self):
+        return self.total - len(self.errors)
+
+    def ack(self, entry, error):
+        if error is not None:
+            self.errors.append((entry, error))
+        if self.callback is not None:
+            self.callback(entry, error)
+
+    def __repr__(self):
+        return 'BulkResult(total={}, done={}, errors={})'.format(
+            self.total, self.done, len(self.errors)
+        )
+
+
 class NFCTSocket(NetlinkSocket):
     policy = {
         k | (NFNL_SUBSYS_CTNETLINK << 8): v
@@ -767,6 +885,7 @@ class NFCTSocket(NetlinkSocket):
             ct.dump_entries(status=0, status_mask=IPS_SEEN_REPLY)
 
         Note that NFCTAttrTuple attributes are working like one AND operator.
+        All the given filters are applied together.
 
         Example::
            # Get connections from 192.168.1.1 AND on port 443
@@ -775,36 +894,118 @@ class NFCTSocket(NetlinkSocket):
            ct.dump_entries(tuple_orig=filter)
 
         """
-        if tuple_orig is not None:
-            tuple_orig.attrs()  # for creating flags
-            cta_filter = {
-                'attrs': [['CTA_FILTER_ORIG_FLAGS', tuple_orig.flags]]
-            }
-            msg = nfct_msg.create_from(
-                tuple_orig=tuple_orig, cta_filter=cta_filter
-            )
-        elif tuple_reply is not None:
-            tuple_reply.attrs()
-            cta_filter = {
-                'attrs': [['CTA_FILTER_REPLY_FLAGS', tuple_reply.flags]]
-            }
-            msg = nfct_msg.create_from(
-                tuple_reply=tuple_reply, cta_filter=cta_filter
-            )
-        else:
-            kwargs = {}
-            if mark:
-                kwargs['mark'] = mark
-                kwargs['mark_mask'] = mark_mask
-            if status is not None:
-                kwargs['status'] = status
-            if status_mask is not None:
-                kwargs['status_mask'] = status_mask
-            msg = nfct_msg.create_from(**kwargs)
+        msg = self.dump_filter(
+            mark, mark_mask, tuple_orig, tuple_reply, status, status_mask
+        )
         return self.request(
             msg, IPCTNL_MSG_CT_GET, msg_flags=NLM_F_REQUEST | NLM_F_DUMP
         )
 
+    @staticmethod
+    def dump_filter(
+        mark=None,
+        mark_mask=0xFFFFFFFF,
+        tuple_orig=None,
+        tuple_reply=None,
+        status=None,
+        status_mask=None,
+    ):
+        """Return a dump request message with the kernel side filters
+
+        See `dump()` for the arguments.
+        """
+        kwargs = {}
+        cta_filter = []
+        if tuple_orig is not None:
+            kwargs['tuple_orig'] = tuple_orig
+            tuple_orig.attrs()  # for creating flags
+            cta_filter.append(['CTA_FILTER_ORIG_FLAGS', tuple_orig.flags])
+        if tuple_reply is not None:
+            kwargs['tuple_reply'] = tuple_reply
+            tuple_reply.attrs()
+            cta_filter.append(['CTA_FILTER_REPLY_FLAGS', tuple_reply.flags])
+        if cta_filter:
+            kwargs['cta_filter'] = {'attrs': cta_filter}
+        if mark is not None:
+            kwargs['mark'] = mark
+            kwargs['mark_mask'] = mark_mask
+        if status is not None:
+            kwargs['status'] = status
+        if status_mask is not None:
+            kwargs['status_mask'] = status_mask
+        return nfct_msg.create_from(**kwargs)
+
+    def dump_stream(self, parser=None, **kwargs):
+        """Dump conntrack entries and yield them as they arrive
+
+        Unlike `dump()`, the dump is not collected in memory: the
+        entries are parsed and yielded datagram by datagram. The
+        filters are the same as for `dump()`, and they are applied
+        by the kernel only.
+
+        `parser(data, offset, length)` is called for every message
+        in the received buffer, and its return value is yielded; by
+        default the messages are decoded as `nfct_msg`. The buffer
+        is valid only within the call, so the parser must not keep
+        references to it.
+
+        If the consumer stops early, the rest of the dump is read
+        and dropped when the generator is closed.
+        """
+        if parser is None:
+            parser = parse_nfct_msg
+        msg = self.dump_filter(**kwargs)
+        sock = self.asyncore
+        run = sock.event_loop.run_until_complete
+        run(sock.ensure_socket())
+        msg_seq = sock.addr_pool.alloc()
+        msg['nfgen_family'] = self._nfgen_family
+        msg['header']['type'] = (
+            NFNL_SUBSYS_CTNETLINK << 8
+        ) | IPCTNL_MSG_CT_GET
+        msg['header']['flags'] = NLM_F_REQUEST | NLM_F_DUMP
+        msg['header']['sequence_number'] = msg_seq
+        msg['header']['pid'] = sock.epid or os.getpid()
+        msg.encode()
+        queue = asyncio.Queue()
+        sock.msg_queue.queues[msg_seq] = queue
+        done = False
+        try:
+            sock.send(msg.data)
+            while not done:
+                data = run(queue.get())
+                ret, done = self.parse_stream(data, msg_seq, parser)
+                yield from ret
+        except GeneratorExit:
+            # the consumer has stopped, drop the rest of the dump
+            while not done:
+                data = run(queue.get())
+                done = self.parse_stream(data, msg_seq, None)[1]
+            raise
+        finally:
+            sock.msg_queue.queues.pop(msg_seq, None)
+            sock.addr_pool.free(msg_seq, ban=0xFF)
+
+    @staticmethod
+    def parse_stream(data, msg_seq, parser):
+        # -> (parsed messages, end of the dump)
+        ret = []
+        for offset, length, msg_type, _, seq in nlmsg_iter(data):
+            if seq == msg_seq:
+                if msg_type == NLMSG_DONE:
+                    return ret, True
+                if msg_type == NLMSG_ERROR:
+                    code = struct.unpack_from('i', data, offset + 16)[0]
+                    if code:
+                        raise NetlinkError(-code, os.strerror(-code))
+                    return ret, True
+                if parser is not None:
+                    ret.append(parser(data, offset, length))
+        if not data:
+            # the socket is closed
+            raise NetlinkError(errno.ECONNRESET)
+        return ret, False
+
     def stat(self):
         return self.request(
             nfct_msg(),
@@ -887,3 +1088,80 @@ class NFCTSocket(NetlinkSocket):
             msg_flags=NLM_F_REQUEST | msg_flags,
             terminate=terminate_error_msg,
         )
+
+    def entry_many(self, cmd, entries, window=256, callback=None, **kwargs):
+        """
+        Change or delete many conntrack entries.
+
+        `cmd` is 'set' or 'del', as for `entry()`. `entries` is an
+        iterable of NFCTAttrTuple, the original tuples, or of objects
+        with the `tuple_orig` attribute and optional `id` and `zone`,
+        like `ConntrackRecord`; if the id is set, the request fails
+        with ENOENT on a new entry with the same tuple.
+
+        The keyword arguments are 32 bit fields to set on every
+        entry: `mark`, `mark_mask`, `timeout`.
+
+        The requests are sent without waiting for the ACK on every
+        one, up to `window` requests in flight. Returns
+        `NFCTBulkResult`; an optional `callback(entry, error)` is
+        called on every ACK.
+
+        Example::
+            # delete all the entries to 192.168.122.67:5599
+            ret = ct.entry_many('del', [
+                NFCTAttrTuple(saddr='192.168.122.1',
+                              daddr='192.168.122.67',
+                              proto=6, sport=sport, dport=5599)
+                for sport in range(20000, 30000)
+            ])
+        """
+        msg_type = {'set': IPCTNL_MSG_CT_NEW, 'del': IPCTNL_MSG_CT_DELETE}[
+            cmd
+        ] | (NFNL_SUBSYS_CTNETLINK << 8)
+        attrs = []
+        for key, value in kwargs.items():
+            nla = nfct_msg.name2nla(key)
+            if nla not in ('CTA_MARK', 'CTA_MARK_MASK', 'CTA_TIMEOUT'):
+                raise ValueError('unsupported field: {}'.format(key))
+            attrs.append(nla_encode(CTA_TYPES[nla], struct.pack('>I', value)))
+        attrs = b''.join(attrs)
+        ret = NFCTBulkResult(callback)
+        run = self.asyncore.event_loop.run_until_complete
+        run(self.asyncore.ensure_socket())
+        pipeline = NetlinkPipeline(self.asyncore, window, callback=ret.ack)
+        try:
+            for entry in entries:
+                if isinstance(entry, NFCTAttrTuple):
+                    tuple_orig, entry_id, zone = entry, None, None
+                else:
+                    tuple_orig = entry.tuple_orig
+                    entry_id = getattr(entry, 'id', None)
+                    zone = getattr(entry, 'zone', None)
+                data = [
+                    # nlmsghdr is set by the pipeline
+                    struct.pack('16xBBH', tuple_orig.family, 0, 0),
+                    tuple_orig.encode_nla(CTA_TYPES['CTA_TUPLE_ORIG']),
+                ]
+                if entry_id is not None:
+                    data.append(
+                        nla_encode(
+                            CTA_TYPES['CTA_ID'], struct.pack('>I', entry_id)
+                        )
+                    )
+                if zone is not None:
+                    data.append(
+                        nla_encode(
+                            CTA_TYPES['CTA_ZONE'], struct.pack('>H', zone)
+                        )
+                    )
+                data.append(attrs)
+                run(
+                    pipeline.put(
+                        b''.join(data), msg_type, NLM_F_REQUEST, entry
+                    )
+                )
+                ret.total += 1
+        finally:
+            run(pipeline.finish())
+        return ret
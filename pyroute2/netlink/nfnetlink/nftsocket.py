@@ -2,10 +2,30 @@
 NFTSocket -- low level nftables API
 
 See also: pyroute2.nftables
+
+Transactions
+------------
+
+All the nftables changes run in transactions: a batch of messages
+between `BEGIN` and `END`, that the kernel applies atomically.
+`NFTSocket.transaction()` returns a builder, that encodes messages
+in place into the batch buffer pages, and gives every message its
+own sequence number, so the errors are reported per message::
+
+    tx = nft.transaction()
+    for rule in rules:
+        tx.put(rule, NFT_MSG_NEWRULE, NLM_F_CREATE | NLM_F_APPEND)
+    for msg, error in tx.commit():
+        if error is not None:
+            ...
+
+If any message fails, the kernel aborts the whole transaction.
 """
 
+import asyncio
 import struct
 import threading
+from socket import SO_RCVBUF, SO_SNDBUF, SOL_SOCKET
 
 from pyroute2.netlink import (
     NETLINK_NETFILTER,
@@ -16,13 +36,25 @@ from pyroute2.netlink import (
     NLM_F_EXCL,
     NLM_F_REPLACE,
     NLM_F_REQUEST,
+    NLMSG_ERROR,
     nla,
     nla_base_string,
     nlmsg_atoms,
 )
-from pyroute2.netlink.nfnetlink import NFNL_SUBSYS_NFTABLES, nfgen_msg
+from pyroute2.netlink.nfnetlink import (
+    NFNL_MSG_BATCH_BEGIN,
+    NFNL_MSG_BATCH_END,
+    NFNL_SUBSYS_NFTABLES,
+    nfgen_msg,
+)
 from pyroute2.netlink.nlsocket import NetlinkSocket
 
+# socket options to set the buffer size over the system limits
+SO_SNDBUFFORCE = 32
+SO_RCVBUFFORCE = 33
+# estimated kernel memory per one error message
+NFT_ERROR_SIZE = 1024
+
 NFT_MSG_NEWTABLE = 0
 NFT_MSG_GETTABLE = 1
 NFT_MSG_DELTABLE = 2
@@ -1134,6 +1166,161 @@ class nft_flowtable_msg(nfgen_msg):
         )
 
 
+class NFTTransaction:
+    '''
+    nftables transaction builder.
+
+    Messages are encoded in place, one after another, into the
+    buffer pages of `page_size` bytes, so the encoded data is never
+    copied. The kernel runs a transaction only if the whole batch
+    from `BEGIN` to `END` comes in one datagram, thus `submit()`
+    sends all the pages with one `sendmsg()` call, and raises the
+    socket buffers if the batch doesn't fit.
+
+    Every message gets its own sequence number. Only the last
+    message requests an ACK: the kernel reports all the errors
+    before it. `submit()` returns a list of `(msg, error)` pairs in
+    the order of `put()` calls, where `error` is `None` or
+    `NetlinkError`. If the batch as a whole fails, the error is
+    set for all the messages.
+
+    `sock` is the async core of the socket, `commit()` is the
+    synchronous version of `submit()`.
+    '''
+
+    def __init__(self, sock, nfgen_family=2, page_size=131072):
+        self.sock = sock
+        self.nfgen_family = nfgen_family
+        self.page_size = page_size
+        self.pages = []
+        self.requests = []
+        self.seq_begin = self.sock.addr_pool.alloc()
+        self.seq_end = self.sock.addr_pool.alloc()
+        self.encode(self.batch_msg(NFNL_MSG_BATCH_BEGIN, self.seq_begin))
+
+    def __len__(self):
+        return len(self.requests)
+
+    @staticmethod
+    def batch_msg(msg_type, msg_seq):
+        msg = nfgen_msg()
+        msg['res_id'] = NFNL_SUBSYS_NFTABLES
+        msg['header']['type'] = msg_type
+        msg['header']['flags'] = NLM_F_REQUEST
+        msg['header']['sequence_number'] = msg_seq
+        return msg
+
+    def encode(self, msg):
+        if not self.pages or len(self.pages[-1]) >= self.page_size:
+            self.pages.append(bytearray())
+        msg.data = self.pages[-1]
+        msg.offset = len(msg.data)
+        try:
+            msg.encode()
+        except Exception:
+            # drop the partially encoded message
+            del msg.data[msg.offset :]
+            raise
+
+    def put(self, msg, msg_type, msg_flags=NLM_F_REQUEST):
+        '''
+        Encode a message into the batch. `NLM_F_ACK` is ignored.
+        '''
+        msg_seq = self.sock.addr_pool.alloc()
+        msg['header']['type'] = (NFNL_SUBSYS_NFTABLES << 8) | msg_type
+        msg['header']['flags'] = (msg_flags | NLM_F_REQUEST) & ~NLM_F_ACK
+        msg['header']['sequence_number'] = msg_seq
+        msg['nfgen_family'] = self.nfgen_family
+        try:
+            self.encode(msg)
+        except Exception:
+            self.sock.addr_pool.free(msg_seq)
+            raise
+        self.requests.append((msg_seq, msg))
+
+    def ensure_buffer(self, option, force, size):
+        sock = self.sock.socket
+        # the kernel reports the doubled value
+        if sock.getsockopt(SOL_SOCKET, option) >= size * 2:
+            return
+        try:
+            sock.setsockopt(SOL_SOCKET, force, size)
+        except OSError:
+            sock.setsockopt(SOL_SOCKET, option, size)
+
+    async def submit(self):
+        '''
+        Send the transaction and wait for the result.
+        '''
+        if not self.requests:
+            self.cleanup()
+            return []
+        await self.sock.ensure_socket()
+        self.encode(self.batch_msg(NFNL_MSG_BATCH_END, self.seq_end))
+        # request an ACK for the last message
+        last_seq, last = self.requests[-1]
+        struct.pack_into(
+            'H',
+            last.data,
+            last.offset + 6,
+            last['header']['flags'] | NLM_F_ACK,
+        )
+        size = sum([len(x) for x in self.pages])
+        self.ensure_buffer(SO_SNDBUF, SO_SNDBUFFORCE, size + 4096)
+        self.ensure_buffer(
+            SO_RCVBUF,
+            SO_RCVBUFFORCE,
+            size + NFT_ERROR_SIZE * len(self.requests),
+        )
+        queue = asyncio.Queue()
+        queues = self.sock.msg_queue.queues
+        tags = [self.seq_begin] + [x[0] for x in self.requests]
+        for msg_seq in tags:
+            queues[msg_seq] = queue
+        errors = {}
+        try:
+            if hasattr(self.sock.socket, 'sendmsg'):
+                self.sock.socket.sendmsg(self.pages)
+            else:
+                self.sock.send(b''.join(self.pages))
+            while last_seq not in errors and self.seq_begin not in errors:
+                data = await queue.get()
+                msg_type, _, msg_seq = struct.unpack_from('HHI', data, 4)
+                if msg_type != NLMSG_ERROR:
+                    # skip echo messages, if any
+                    continue
+                errors[msg_seq] = None
+                if struct.unpack_from('i', data, 16)[0] != 0:
+                    for msg in self.sock.marshal.parse(data, msg_seq):
+                        errors[msg_seq] = msg['header']['error']
+        finally:
+            for msg_seq in tags:
+                queues.pop(msg_seq, None)
+            self.cleanup()
+        # the batch failed as a whole
+        error = errors.get(self.seq_begin)
+        return [
+            (msg, errors.get(msg_seq) or error)
+            for msg_seq, msg in self.requests
+        ]
+
+    def commit(self):
+        '''
+        Synchronous `submit()`.
+        '''
+        return self.sock.event_loop.run_until_complete(self.submit())
+
+    def cleanup(self):
+        '''
+        Release the sequence numbers and the buffer.
+        '''
+        for msg_seq in [self.seq_begin, self.seq_end] + [
+            x[0] for x in self.requests
+        ]:
+            self.sock.addr_pool.free(msg_seq, ban=0xFF)
+        self.pages = []
+
+
 class NFTSocket(NetlinkSocket):
     '''
     NFNetlink socket (family=NETLINK_NETFILTER).
@@ -1165,7 +1352,8 @@ class NFTSocket(NetlinkSocket):
     }
 
     def __init__(self, version=1, attr_revision=0, nfgen_family=2):
-        super(NFTSocket, self).__init__(family=NETLINK_NETFILTER)
+        # transactions take a sequence number per message
+        super(NFTSocket, self).__init__(family=NETLINK_NETFILTER, seq32=True)
         policy = dict(
             [
                 (x | (NFNL_SUBSYS_NFTABLES << 8), y)
@@ -1179,40 +1367,31 @@ class NFTSocket(NetlinkSocket):
         self._ts = threading.local()
         self._write_lock = threading.RLock()
 
+    def transaction(self, page_size=131072):
+        '''
+        Return a new transaction builder, see `NFTTransaction`.
+        '''
+        return NFTTransaction(self.asyncore, self._nfgen_family, page_size)
+
     def begin(self):
         with self._write_lock:
-            if hasattr(self._ts, 'data'):
+            if hasattr(self._ts, 'tx'):
                 # transaction is already started
                 return False
-
-            self._ts.data = b''
-            self._ts.seqnum = (
-                self.addr_pool.alloc(),  # begin
-                self.addr_pool.alloc(),  # tx
-                self.addr_pool.alloc(),
-            )  # commit
-            msg = nfgen_msg()
-            msg['res_id'] = NFNL_SUBSYS_NFTABLES
-            msg['header']['type'] = 0x10
-            msg['header']['flags'] = NLM_F_REQUEST
-            msg['header']['sequence_number'] = self._ts.seqnum[0]
-            msg.encode()
-            self._ts.data += msg.data
+            self._ts.tx = self.transaction()
             return True
 
     def commit(self):
+        '''
+        Commit the transaction started with `begin()`, raise the
+        first error if any.
+        '''
         with self._write_lock:
-            msg = nfgen_msg()
-            msg['res_id'] = NFNL_SUBSYS_NFTABLES
-            msg['header']['type'] = 0x11
-            msg['header']['flags'] = NLM_F_REQUEST
-            msg['header']['sequence_number'] = self._ts.seqnum[2]
-            msg.encode()
-            self._ts.data += msg.data
-            self.sendto(self._ts.data, (0, 0))
-            for seqnum in self._ts.seqnum:
-                self.addr_pool.free(seqnum, ban=10)
-            del self._ts.data
+            tx = self._ts.tx
+            del self._ts.tx
+            for _, error in tx.commit():
+                if error is not None:
+                    raise error
 
     def request_get(
         self,
@@ -1240,12 +1419,7 @@ class NFTSocket(NetlinkSocket):
         Read-write requests.
         '''
         one_shot = self.begin()
-        msg['header']['type'] = (NFNL_SUBSYS_NFTABLES << 8) | msg_type
-        msg['header']['flags'] = msg_flags
-        msg['header']['sequence_number'] = self._ts.seqnum[1]
-        msg['nfgen_family'] = self._nfgen_family
-        msg.encode()
-        self._ts.data += msg.data
+        self._ts.tx.put(msg, msg_type, msg_flags)
         if one_shot:
             self.commit()
 
@@ -1278,27 +1452,18 @@ class NFTSocket(NetlinkSocket):
         for key, value in kwarg.items():
             nla = msg_class.name2nla(key)
             msg['attrs'].append([nla, value])
-        msg['header']['type'] = (NFNL_SUBSYS_NFTABLES << 8) | cmd
-        msg['header']['flags'] = flags | NLM_F_REQUEST
         msg['nfgen_family'] = self._nfgen_family
 
         if cmd_name != 'get':
-            trans_start = nfgen_msg()
-            trans_start['res_id'] = NFNL_SUBSYS_NFTABLES
-            trans_start['header']['type'] = 0x10
-            trans_start['header']['flags'] = NLM_F_REQUEST
-
-            trans_end = nfgen_msg()
-            trans_end['res_id'] = NFNL_SUBSYS_NFTABLES
-            trans_end['header']['type'] = 0x11
-            trans_end['header']['flags'] = NLM_F_REQUEST
-
-            messages = [trans_start, msg, trans_end]
-            self.nlm_request_batch(messages, noraise=(flags & NLM_F_ACK) == 0)
+            tx = self.transaction()
+            tx.put(msg, cmd, flags)
             # Only throw an error when the request fails. For now,
             # do not return anything.
+            for _, error in tx.commit():
+                if error is not None and flags & NLM_F_ACK:
+                    raise error
         else:
-            return self.request_get(msg, msg['header']['type'], flags)[0]
+            return self.request_get(msg, cmd, flags)[0]
 
 
 # call nft describe "data_type" for more informations
@@ -89,7 +89,7 @@ import struct
 from socket import SO_RCVBUF, SO_SNDBUF, SOCK_DGRAM, SOL_SOCKET
 
 from pyroute2 import config, netns
-from pyroute2.common import AddrPool, basestring, msg_done
+from pyroute2.common import AddrPool, SeqPool, basestring, msg_done
 from pyroute2.config import AF_NETLINK
 from pyroute2.netlink import (
     NETLINK_ADD_MEMBERSHIP,
@@ -108,10 +108,14 @@ from pyroute2.netlink import (
     NLM_F_REPLACE,
     NLM_F_REQUEST,
     NLM_F_ROOT,
+    NLMSG_ERROR,
     SOL_NETLINK,
+    nlmsg_base,
 )
+from pyroute2.netlink.buffer import Buffer
 from pyroute2.netlink.core import (
     AsyncCoreSocket,
+    CoreBufferedDatagramTransport,
     CoreDatagramProtocol,
     CoreSocketSpec,
     SyncAPI,
@@ -212,6 +216,9 @@ class AsyncNetlinkSocket(AsyncCoreSocket):
         flags=os.O_CREAT,
         libc=None,
         use_event_loop=False,
+        lazy_decode=False,
+        use_buffer=False,
+        seq32=False,
     ):
         # 8<-----------------------------------------
         self.spec = NetlinkSocketSpec(
@@ -236,6 +243,9 @@ class AsyncNetlinkSocket(AsyncCoreSocket):
                 'netns': netns,
                 'flags': flags,
                 'use_event_loop': use_event_loop,
+                'lazy_decode': lazy_decode,
+                'use_buffer': use_buffer,
+                'seq32': seq32,
             }
         )
         # TODO: merge capabilities to self.status
@@ -249,13 +259,30 @@ class AsyncNetlinkSocket(AsyncCoreSocket):
             libc=libc, use_socket=use_socket, use_event_loop=use_event_loop
         )
         self.marshal = Marshal()
+        self.marshal.lazy_decode = self.status['lazy_decode']
+        if use_buffer is True:
+            self.buffer = Buffer(page_size=262144)
+        elif use_buffer:
+            self.buffer = use_buffer
+        if seq32:
+            self.addr_pool = SeqPool(minaddr=0x000000FF, maxaddr=0xFFFFFFFF)
         self.request_proxy = None
         self.batch = None
+        self.pipelines = set()
 
     async def setup_endpoint(self, loop=None):
         # Setup asyncio
         if self.endpoint is not None:
             return
+        if self.buffer is not None and not self.status['use_socket']:
+            # receive directly to the buffer pages
+            event_loop = self.event_loop
+            protocol = CoreDatagramProtocol(self.connection_lost, self.enqueue)
+            transport = CoreBufferedDatagramTransport(
+                event_loop, self.socket, protocol, self.buffer
+            )
+            self.endpoint = (transport, protocol)
+            return
         self.endpoint = await self.event_loop.create_datagram_endpoint(
             lambda: CoreDatagramProtocol(self.connection_lost, self.enqueue),
             sock=self.socket,
@@ -403,6 +430,83 @@ class AsyncNetlinkSocket(AsyncCoreSocket):
         await request.send()
         return request
 
+    async def submit_many(self, messages, window=256, bufsize=65536):
+        '''
+        Send many requests without waiting for the ACK on every one.
+
+        `messages` is an iterable of `nlmsg` objects or encoded
+        messages; the message type and flags are taken from the
+        header, the sequence numbers are allocated here. Returns
+        a list of futures, one per message, in the same order. A
+        future is resolved with `None` on the ACK, or gets the
+        `NetlinkError` exception::
+
+            futures = await nlsock.submit_many(messages)
+            results = await asyncio.gather(
+                *futures, return_exceptions=True
+            )
+
+        The messages are sent by a background task via
+        `NetlinkPipeline`, with up to `window` requests in flight.
+        '''
+        await self.ensure_socket()
+        requests = []
+        for msg in messages:
+            if isinstance(msg, nlmsg_base):
+                msg.encode()
+                msg = msg.data
+            requests.append((msg, self.event_loop.create_future()))
+
+        def resolve(future, error):
+            if future.done():
+                return
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+
+        async def run():
+            pipeline = NetlinkPipeline(self, window, bufsize, resolve)
+            try:
+                for data, future in requests:
+                    msg_type, msg_flags = struct.unpack_from('HH', data, 4)
+                    await pipeline.put(data, msg_type, msg_flags, future)
+                await pipeline.finish()
+            except Exception as e:
+                for _, future in requests:
+                    resolve(future, e)
+
+        # keep a reference to the task until it is done
+        task = self.event_loop.create_task(run())
+        self.pipelines.add(task)
+        task.add_done_callback(self.pipelines.discard)
+        return [x[1] for x in requests]
+
+    async def submit_batch(self, batch, window=256, bufsize=65536):
+        '''
+        Send requests compiled to a `NetlinkBatch` and wait for all
+        the ACKs. Returns a list of pairs `(msg, error)`, one per
+        request in the batch order, where `error` is `None` on
+        success, or `NetlinkError` from the kernel.
+
+        The batch buffer is sent in place, with up to `bufsize`
+        bytes per `send()` call; only the message headers are
+        updated. Dump requests are not sent, the result for them
+        is `NetlinkError(EOPNOTSUPP)`.
+        '''
+        errors = {}
+        pipeline = NetlinkPipeline(self, window, bufsize)
+        for index, msg in enumerate(batch.requests):
+            if msg['header']['flags'] & NLM_F_DUMP == NLM_F_DUMP:
+                errors[index] = NetlinkError(
+                    errno.EOPNOTSUPP, 'dump requests are not supported'
+                )
+                continue
+            await pipeline.put_encoded(batch, msg.offset, index)
+        for index, error in await pipeline.finish():
+            errors[index] = error
+        return [(msg, errors[x]) for x, msg in enumerate(batch.requests)]
+
     async def nlm_request(
         self,
         msg,
@@ -533,7 +637,9 @@ class NetlinkRequest:
 
     async def proxy(self):
         if self.sock.batch is not None:
-            self.sock.batch += self.msg.data
+            # the message is already encoded in the batch buffer
+            if isinstance(self.sock.batch, NetlinkBatch):
+                self.sock.batch.requests.append(self.msg)
             await self.sock.msg_queue.put(self.msg_seq, msg_done(self.msg))
             return True
         if self.sock.request_proxy is None:
@@ -546,12 +652,16 @@ class NetlinkRequest:
 
     async def send(self):
         await self.sock.ensure_socket()
+        if self.sock.batch is not None:
+            # encode the message in place, right to the batch buffer
+            self.msg.data = self.sock.batch
+            self.msg.offset = len(self.sock.batch)
         self.msg.encode()
         self.sock.msg_queue.ensure_tag(self.msg_seq)
         if self.parser is not None:
             self.marshal.seq_map[self.msg_seq] = self.parser
         if await self.proxy():
-            return len(self.msg.data)
+            return self.msg['header']['length']
         count = 0
         exc = RuntimeError('Max attempts sending message')
         for count in range(30):
@@ -570,23 +680,253 @@ class NetlinkRequest:
         raise exc
 
     async def response(self):
-        async for msg in self.sock.get(
+        response = self.sock.get(
             msg_seq=self.msg_seq,
             terminate=self.terminate,
             callback=self.callback,
+        )
+        try:
+            async for msg in response:
+                if (
+                    self.dump_filter is not None
+                    and not self.match_one_message(self.dump_filter, msg)
+                ):
+                    continue
+                for cr in self.sock.callbacks:
+                    try:
+                        if cr[0](msg):
+                            cr[1](msg, *cr[2])
+                    except Exception:
+                        log.warning("Callback fail: %{cr}")
+                yield msg
+        except GeneratorExit:
+            # the consumer has stopped before the end of the dump;
+            # get() drops the rest of it, see AsyncCoreSocket.drain()
+            await response.aclose()
+            raise
+        finally:
+            self.cleanup()
+
+
+class NetlinkBatch(bytearray):
+    '''
+    The batch buffer. Requests are encoded right to the buffer
+    one after another, and the encoded `nlmsg` objects are saved
+    in `requests`, in the same order.
+
+    Being a `bytearray`, the batch can be sent as is, or with
+    `AsyncNetlinkSocket.submit_batch()` to get the result of
+    every request.
+    '''
+
+    def __init__(self, *argv):
+        super().__init__(*argv)
+        self.requests = []
+
+    def clear(self):
+        super().clear()
+        self.requests = []
+
+
+class NetlinkPipeline:
+    '''
+    Send many requests with a few `send()` calls, not waiting for
+    the ACK on every request.
+
+    Encoded messages are added with `put()`; the pipeline sets
+    the header, packs the messages into a buffer up to `bufsize`
+    bytes, and keeps up to `window` requests in flight. ACKs are
+    matched by sequence numbers, and `results` collects pairs
+    `(key, error)` in the order of ACKs, where `error` is `None`
+    on success, or `NetlinkError` otherwise::
+
+        pipeline = NetlinkPipeline(sock)
+        for key, data in messages:
+            await pipeline.put(data, RTM_NEWROUTE, flags, key)
+        await pipeline.finish()
+        failed = [x for x in pipeline.results if x[1] is not None]
+
+    All the sequence numbers of the pipeline share one message
+    queue, and the window is limited by the socket `rcvbuf`, so
+    the pending ACKs don't overflow the socket receive buffer.
+
+    An optional `callback(key, error)` is called on every ACK.
+    '''
+
+    # estimated kernel memory per one pending ACK
+    ack_size = 1024
+
+    def __init__(self, sock, window=256, bufsize=65536, callback=None):
+        self.sock = sock
+        self.callback = callback
+        self.window = max(
+            1, min(window, sock.status['rcvbuf'] // self.ack_size)
+        )
+        self.bufsize = bufsize
+        self.epid = sock.epid or os.getpid()
+        self.queue = asyncio.Queue()
+        self.buffer = bytearray()
+        self.region = None
+        self.queued = []
+        self.in_flight = {}
+        self.results = []
+
+    async def reserve(self):
+        # wait for a free slot in the window
+        if len(self.queued) + len(self.in_flight) >= self.window:
+            await self.flush()
+            while len(self.in_flight) > self.window // 2:
+                await self.collect()
+
+    async def put(self, data, msg_type, msg_flags, key=None):
+        '''
+        Add an encoded message to the pipeline. The header fields,
+        except of the length, are overwritten. `NLM_F_REQUEST` and
+        `NLM_F_ACK` are always set.
+        '''
+        await self.reserve()
+        if self.region is not None:
+            await self.flush()
+        msg_seq = self.sock.addr_pool.alloc()
+        offset = len(self.buffer)
+        self.buffer += data
+        struct.pack_into(
+            'IHHII',
+            self.buffer,
+            offset,
+            len(data),
+            msg_type,
+            msg_flags | NLM_F_REQUEST | NLM_F_ACK,
+            msg_seq,
+            self.epid,
+        )
+        self.queued.append((msg_seq, key))
+        if len(self.buffer) >= self.bufsize:
+            await self.flush()
+
+    async def put_encoded(self, buffer, offset, key=None):
+        '''
+        Add a message encoded in `buffer` at `offset`. Only the
+        sequence number, the pid and the flags `NLM_F_REQUEST` and
+        `NLM_F_ACK` are updated, in place. Adjacent messages of one
+        buffer are sent as one region of the buffer, without copying
+        the data.
+        '''
+        await self.reserve()
+        if self.buffer or (
+            self.region is not None
+            and (self.region[0] is not buffer or self.region[2] != offset)
         ):
-            if self.dump_filter is not None and not self.match_one_message(
-                self.dump_filter, msg
-            ):
-                continue
-            for cr in self.sock.callbacks:
-                try:
-                    if cr[0](msg):
-                        cr[1](msg, *cr[2])
-                except Exception:
-                    log.warning("Callback fail: %{cr}")
-            yield msg
-        self.cleanup()
+            await self.flush()
+        length, _, msg_flags = struct.unpack_from('IHH', buffer, offset)
+        msg_seq = self.sock.addr_pool.alloc()
+        struct.pack_into(
+            '=HII',
+            buffer,
+            offset + 6,
+            msg_flags | NLM_F_REQUEST | NLM_F_ACK,
+            msg_seq,
+            self.epid,
+        )
+        if self.region is None:
+            self.region = [buffer, offset, offset]
+        self.region[2] = offset + length
+        self.queued.append((msg_seq, key))
+        if self.region[2] - self.region[1] >= self.bufsize:
+            await self.flush()
+
+    async def flush(self):
+        '''
+        Send all the queued messages.
+        '''
+        if not self.queued:
+            return
+        if self.region is not None:
+            buffer, start, end = self.region
+            data = memoryview(buffer)[start:end]
+        else:
+            data = self.buffer
+        queued = self.queued
+        self.buffer = bytearray()
+        self.region = None
+        self.queued = []
+        try:
+            if self.sock.batch is not None:
+                self.sock.batch += data
+                for msg_seq, key in queued:
+                    self.sock.addr_pool.free(msg_seq, ban=0xFF)
+                    self.done(key, None)
+                return
+            await self.sock.ensure_socket()
+            queues = self.sock.msg_queue.queues
+            for msg_seq, key in queued:
+                queues[msg_seq] = self.queue
+                self.in_flight[msg_seq] = key
+            try:
+                self.sock.send(data)
+            except Exception:
+                for msg_seq, _ in queued:
+                    self.cleanup(msg_seq)
+                raise
+        finally:
+            if isinstance(data, memoryview):
+                # release the buffer export, so it can be resized
+                data.release()
+
+    async def collect(self):
+        '''
+        Wait for the next ACK, and collect all the ACKs that are
+        already received.
+        '''
+        data = await self.queue.get()
+        while True:
+            self.collect_one(data)
+            if self.queue.empty():
+                break
+            data = self.queue.get_nowait()
+
+    def collect_one(self, data):
+        msg_type, _, msg_seq = struct.unpack_from('HHI', data, 4)
+        if msg_type != NLMSG_ERROR or msg_seq not in self.in_flight:
+            # skip echo messages, if any
+            return
+        error = None
+        # decode only failed ACKs
+        if struct.unpack_from('i', data, 16)[0] != 0:
+            error = self.decode_error(data, msg_seq)
+        key = self.in_flight.pop(msg_seq)
+        self.cleanup(msg_seq)
+        self.done(key, error)
+
+    def decode_error(self, data, msg_seq):
+        '''
+        Return an exception for a failed ACK. Subclasses may
+        override it to extract protocol specific details from
+        the error message.
+        '''
+        error = None
+        for msg in self.sock.marshal.parse(data, msg_seq):
+            error = msg['header']['error']
+        return error
+
+    def done(self, key, error):
+        self.results.append((key, error))
+        if self.callback is not None:
+            self.callback(key, error)
+
+    async def finish(self):
+        '''
+        Send the rest of the messages and wait for all the ACKs.
+        '''
+        await self.flush()
+        while self.in_flight:
+            await self.collect()
+        return self.results
+
+    def cleanup(self, msg_seq):
+        self.in_flight.pop(msg_seq, None)
+        self.sock.addr_pool.free(msg_seq, ban=0xFF)
+        self.sock.msg_queue.queues.pop(msg_seq, None)
 
 
 class NetlinkSocket(SyncAPI):
@@ -611,6 +951,9 @@ class NetlinkSocket(SyncAPI):
         netns=None,
         flags=os.O_CREAT,
         libc=None,
+        lazy_decode=False,
+        use_buffer=False,
+        seq32=False,
     ):
         self.asyncore = AsyncNetlinkSocket(
             family,
@@ -632,6 +975,9 @@ class NetlinkSocket(SyncAPI):
             netns,
             flags,
             libc,
+            lazy_decode=lazy_decode,
+            use_buffer=use_buffer,
+            seq32=seq32,
         )
 
     @property
@@ -120,9 +120,15 @@ class AsyncIPRSocket(AsyncNetlinkSocket):
         flags=os.O_CREAT,
         libc=None,
         use_event_loop=False,
+        lazy_decode=False,
+        use_buffer=False,
+        seq32=False,
     ):
         if config.mock_netlink:
-            use_socket = IPEngine()
+            use_socket = IPEngine(
+                netns=netns if isinstance(netns, str) else 'default',
+                flags=flags,
+            )
         self.marshal = MarshalRtnl()
         super().__init__(
             family=NETLINK_ROUTE,
@@ -145,6 +151,9 @@ class AsyncIPRSocket(AsyncNetlinkSocket):
             flags=flags,
             libc=libc,
             use_event_loop=use_event_loop,
+            lazy_decode=lazy_decode,
+            use_buffer=use_buffer,
+            seq32=seq32,
         )
         if sys.platform.startswith('linux') and not config.mock_netlink:
             self.request_proxy = NetlinkProxy(
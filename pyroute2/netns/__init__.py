@@ -78,21 +78,40 @@ where SELinux is enforced. If the Python interpreter,
 loading this module, dumps the core, one can check the
 SELinux state with `getenforce` command.
 
+Sockets in a netns
+------------------
+
+The sockets in a netns, like the ones that `NetNS` and
+`IPRoute(netns=...)` use, are created by a helper child
+process. The helper is forked once and kept running: it
+creates sockets of any family in any netns on request, and
+passes them to the parent. The helper is restarted if it dies,
+and stopped on exit. To stop it explicitly::
+
+    netns.stop_helper()
+
 '''
 
+import atexit
 import ctypes
 import ctypes.util
 import errno
 import io
+import json
 import logging
 import os
 import os.path
+import select
 import socket
-import time
+import threading
 
 from pyroute2 import config
 from pyroute2.common import basestring
-from pyroute2.process import ChildProcess, ChildProcessReturnValue
+from pyroute2.process import (
+    ChildProcess,
+    ChildProcessReturnValue,
+    check_feedback,
+)
 
 log = logging.getLogger(__name__)
 
@@ -406,6 +425,147 @@ def _create_socket_child(nsname, flags, family, socket_type, proto, libc=None):
     return ChildProcessReturnValue(None, [sock])
 
 
+def _create_socket_helper(channel, libc=None):
+    # the helper child: one request -- one socket
+    #
+    # close all the fds inherited from the parent but the channel,
+    # otherwise the child keeps the parent's pipes and sockets open
+    # until it exits, and the peers never get EOF
+    fd = channel.fileno()
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for std in (0, 1, 2):
+        os.dup2(devnull, std)
+    os.closerange(3, fd)
+    os.closerange(fd + 1, os.sysconf('SC_OPEN_MAX'))
+    while True:
+        data = channel.recv(4096)
+        if not data:
+            # the ChildProcess ctrl socket is closed as well,
+            # don't return to the wrapper
+            os._exit(0)
+        request = json.loads(data.decode('utf-8'))
+        payload = {}
+        fds = []
+        sock = None
+        try:
+            setns(request['netns'], request['flags'], libc, fork=False)
+            sock = socket.socket(
+                request['family'], request['socket_type'], request['proto']
+            )
+            fds = [sock.fileno()]
+        except Exception as e:
+            payload = {'exception': e.__class__.__name__, 'options': e.args}
+        socket.send_fds(
+            channel, [json.dumps(payload).encode('utf-8')], fds, len(fds)
+        )
+        if sock is not None:
+            sock.close()
+
+
+class NetNSHelper:
+    '''
+    A long-lived child process that creates sockets in network
+    namespaces. The child is forked on the first request, and
+    serves then any number of requests; every request may refer
+    to another netns.
+
+    The requests are serialized; if the child doesn't respond, it
+    is restarted.
+    '''
+
+    def __init__(self, libc=None):
+        self.libc = libc
+        self.lock = threading.Lock()
+        self.proc = None
+        self.channel = None
+        self.pid = None
+
+    def start(self):
+        self.channel, remote = socket.socketpair(
+            socket.AF_UNIX, socket.SOCK_SEQPACKET
+        )
+        self.proc = ChildProcess(
+            target=_create_socket_helper, args=[remote, self.libc]
+        )
+        self.proc.run()
+        remote.close()
+        self.pid = os.getpid()
+
+    def stop(self):
+        with self.lock:
+            self._stop()
+
+    def _stop(self):
+        if self.proc is None:
+            return
+        if self.pid == os.getpid():
+            self.proc.close()
+        self.channel.close()
+        self.proc = None
+        self.channel = None
+
+    def _request(self, request, timeout):
+        if self.proc is None or self.pid != os.getpid():
+            # not started yet, or inherited after fork()
+            self._stop()
+            self.start()
+        self.channel.send(json.dumps(request).encode('utf-8'))
+        rl, _, _ = select.select([self.channel], [], [], timeout)
+        if not rl:
+            raise TimeoutError()
+        data, fds, _, _ = socket.recv_fds(self.channel, 1024, 1)
+        if not data:
+            raise ConnectionError()
+        check_feedback(json.loads(data.decode('utf-8')))
+        return fds
+
+    def create_socket(
+        self, netns, flags, family, socket_type, proto, timeout=5
+    ):
+        request = {
+            'netns': os.fsdecode(netns),
+            'flags': flags,
+            'family': family,
+            'socket_type': socket_type,
+            'proto': proto,
+        }
+        with self.lock:
+            for _ in range(2):
+                try:
+                    fds = self._request(request, timeout)
+                    break
+                except (ConnectionError, TimeoutError):
+                    self._stop()
+            else:
+                raise TimeoutError(
+                    'could not start netns socket within timeout'
+                )
+        return socket.socket(fileno=fds[0])
+
+
+__helpers = {}
+__helpers_lock = threading.Lock()
+
+
+def _get_helper(libc=None):
+    with __helpers_lock:
+        if libc not in __helpers:
+            __helpers[libc] = NetNSHelper(libc)
+        return __helpers[libc]
+
+
+@atexit.register
+def stop_helper():
+    '''
+    Stop the socket helper processes, if any. The helpers will
+    be started again on the next `create_socket()` call.
+    '''
+    with __helpers_lock:
+        helpers = tuple(__helpers.values())
+    for helper in helpers:
+        helper.stop()
+
+
 @config.mock_if('mock_netns')
 def create_socket(
     netns=None,
@@ -423,15 +583,19 @@ def create_socket(
         return socket.socket(fileno=fileno)
     if netns is None:
         return socket.socket(family, socket_type, proto)
-
-    start_time = time.time()
-    while time.time() - start_time < 5:
+    if not isinstance(netns, basestring):
+        # an open netns fd or file is valid only in a child
+        # forked after it was opened
         with ChildProcess(
             target=_create_socket_child,
             args=[netns, flags, family, socket_type, proto, libc],
         ) as proc:
-            if (fds := proc.communicate(timeout=1)) is None:
-                continue
+            fds = proc.communicate(timeout=timeout)
+            if fds is None:
+                raise TimeoutError(
+                    'could not start netns socket within timeout'
+                )
             return socket.socket(fileno=fds[0])
-
-    raise TimeoutError('could not start netns socket within timeout')
+    return _get_helper(libc).create_socket(
+        netns, flags, family, socket_type, proto, timeout
+    )
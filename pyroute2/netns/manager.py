@@ -1,14 +1,36 @@
 import errno
+import os
+import select
 
 from pyroute2 import netns
 from pyroute2.inotify.inotify_fd import Inotify
 from pyroute2.iproute.linux import IPRoute
 from pyroute2.netlink.exceptions import NetlinkError, SkipInode
-from pyroute2.netlink.rtnl import RTM_DELNETNS, RTM_NEWNETNS
+from pyroute2.netlink.rtnl import (
+    RTM_DELLINK,
+    RTM_DELNETNS,
+    RTM_NEWLINK,
+    RTM_NEWNETNS,
+    RTMGRP_LINK,
+)
+from pyroute2.netlink.rtnl.iprsocket import IPRSocket
 from pyroute2.netlink.rtnl.nsinfmsg import nsinfmsg
 
+NETNSID_UNKNOWN = 0xFFFFFFFF
+
 
 class NetNSManager(Inotify):
+    '''
+    Track network namespaces in the netns directories.
+
+    The full scan runs only on start and on `dump()`. After that
+    the registry is updated incrementally: only the new paths
+    from inotify events are loaded, with the NSID requests sent
+    in one batch per event batch. The veth peers come from a
+    link index, that is kept current by RTNL link events instead
+    of dumping all the links on every update.
+    '''
+
     def __init__(self, libc=None, path=None, target='netns_manager'):
         path = set(path or [])
         super(NetNSManager, self).__init__(libc, path)
@@ -18,20 +40,132 @@ class NetNSManager(Inotify):
                     self.register_path(d)
                 except OSError:
                     pass
+        self.target = target
         self.ipr = IPRoute(target=target)
+        # subscribe before the dump, not to miss link updates
+        self.events = IPRSocket(groups=RTMGRP_LINK)
+        self.events.bind()
         self.registry = {}
+        # ifindex -> netnsid for links with a peer netns
+        self.links = {}
+        # netnsid -> {ifindex: ifname}
+        self.peers = {}
         self.update()
-        self.target = target
 
-    def update(self):
-        self.ipr.netns_path = self.path
-        for info in self.ipr.get_netns_info():
+    def _run(self, coro):
+        return self.ipr.event_loop.run_until_complete(coro)
+
+    def _collect(self, agen):
+        async def collect():
+            return [x async for x in agen]
+
+        return self._run(collect())
+
+    def _index_link(self, msg):
+        index = msg['index']
+        netnsid = self.links.pop(index, None)
+        if netnsid is not None:
+            self.peers[netnsid].pop(index, None)
+            if not self.peers[netnsid]:
+                del self.peers[netnsid]
+        netnsid = msg.get('IFLA_LINK_NETNSID')
+        if msg['header']['type'] == RTM_NEWLINK and netnsid is not None:
+            self.links[index] = netnsid
+            self.peers.setdefault(netnsid, {})[index] = msg.get('IFLA_IFNAME')
+
+    def _reload_links(self):
+        self.links = {}
+        self.peers = {}
+        for msg in self.ipr.get_links():
+            self._index_link(msg)
+
+    def update_links(self):
+        '''
+        Apply pending link events to the link index. Reload the
+        index from scratch if the events were lost.
+        '''
+        try:
+            while select.select([self.events.socket], [], [], 0)[0]:
+                for msg in self.events.get():
+                    if msg['header']['type'] in (RTM_NEWLINK, RTM_DELLINK):
+                        self._index_link(msg)
+        except OSError:
+            # ENOBUFS: the socket buffer overrun
+            self._reload_links()
+
+    def load(self, paths):
+        '''
+        Load netns info for the paths to the registry, if not
+        loaded yet, or if the NSID was not assigned on the last
+        load. A path that refers to an already registered netns
+        is not loaded.
+        '''
+        paths = [
+            x
+            for x in paths
+            if x not in self.registry
+            or self.registry[x]['netnsid'] == NETNSID_UNKNOWN
+        ]
+        for path in paths:
+            self.registry.pop(path, None)
+        registry = set(x['inode'] for x in self.registry.values())
+        for info in self._collect(
+            self.ipr.asyncore._dump_paths(paths, registry)
+        ):
+            del info['value']
             self.registry[info.get_attr('NSINFO_PATH')] = info
 
+    def update(self):
+        '''
+        Rescan all the netns paths and reload the link index.
+        '''
+        # drop pending events, the dump is more recent
+        self.update_links()
+        self._reload_links()
+        self.registry = {}
+        paths = []
+        for directory in self.path:
+            try:
+                paths.extend(
+                    [os.path.join(directory, x) for x in os.listdir(directory)]
+                )
+            except OSError:
+                pass
+        self.load(paths)
+
+    def info(self, path):
+        '''
+        Return netns info for the path with the current peers.
+        '''
+        info = nsinfmsg()
+        info['header']['error'] = None
+        info['header']['target'] = self.target
+        if path in self.registry:
+            info.load(self.registry[path])
+            info['attrs'] = list(info['attrs'])
+            for ifname in self.peers.get(info['netnsid'], {}).values():
+                info['attrs'].append(('NSINFO_PEER', ifname))
+        else:
+            info['attrs'] = [('NSINFO_PATH', path)]
+        info['header']['type'] = RTM_NEWNETNS
+        info['event'] = 'RTM_NEWNETNS'
+        del info['value']
+        return info
+
     def get(self):
-        for msg in super(NetNSManager, self).get():
-            info = nsinfmsg()
+        msgs = list(super(NetNSManager, self).get())
+        # load all the new paths from the batch at once
+        self.load(
+            [
+                '{path}/{name}'.format(**x)
+                for x in msgs
+                if x is not None and x['mask'] & 0x100
+            ]
+        )
+        self.update_links()
+        for msg in msgs:
             if msg is None:
+                info = nsinfmsg()
                 info['header']['error'] = NetlinkError(errno.ECONNRESET)
                 info['header']['type'] = RTM_DELNETNS
                 info['header']['target'] = self.target
@@ -39,24 +173,18 @@ class NetNSManager(Inotify):
                 yield info
                 return
             path = '{path}/{name}'.format(**msg)
-            info['header']['error'] = None
-            info['header']['target'] = self.target
-            if path not in self.registry:
-                self.update()
-            if path in self.registry:
-                info.load(self.registry[path])
-            else:
-                info['attrs'] = [('NSINFO_PATH', path)]
-            del info['value']
+            info = self.info(path)
             if msg['mask'] & 0x200:
                 info['header']['type'] = RTM_DELNETNS
                 info['event'] = 'RTM_DELNETNS'
+                self.registry.pop(path, None)
             elif not msg['mask'] & 0x100:
                 continue
             yield info
 
     def close(self, code=None):
         self.ipr.close()
+        self.events.close()
         super(NetNSManager, self).close()
 
     def create(self, path):
@@ -65,7 +193,7 @@ class NetNSManager(Inotify):
             netns.create(netnspath, self.libc)
         except OSError as e:
             raise NetlinkError(e.errno)
-        info = self.ipr._dump_one_ns(netnspath, set())
+        info = self._run(self.ipr.asyncore._dump_one_ns(netnspath, set()))
         info['header']['type'] = RTM_NEWNETNS
         info['header']['target'] = self.target
         info['event'] = 'RTM_NEWNETNS'
@@ -76,7 +204,7 @@ class NetNSManager(Inotify):
         netnspath = netns._get_netnspath(path)
         info = None
         try:
-            info = self.ipr._dump_one_ns(netnspath, set())
+            info = self._run(self.ipr.asyncore._dump_one_ns(netnspath, set()))
         except SkipInode as e:
             raise NetlinkError(e.code)
         info['header']['type'] = RTM_DELNETNS
@@ -100,10 +228,13 @@ class NetNSManager(Inotify):
             return self.remove(netnspath)
         elif cmd not in ('get', 'set'):
             raise ValueError('method not supported')
-        for item in self.dump():
-            if item.get_attr('NSINFO_PATH') == netnspath:
-                return (item,)
+        netnspath = os.fsdecode(netnspath)
+        self.load([netnspath])
+        if netnspath in self.registry:
+            self.update_links()
+            return (self.info(netnspath),)
         return ()
 
     def dump(self, groups=None):
-        return self.ipr.get_netns_info()
+        self.update()
+        return [self.info(x) for x in self.registry]
@@ -1,7 +1,38 @@
 '''
+Set definitions cache
+---------------------
+
+To encode set elements, `NFTables.set_elems()` needs the set key
+type. The set definitions are cached per socket, and the cache is
+invalidated by the nftables events, so repeated updates of one set
+don't cost an extra round trip. The cache may be disabled with
+`NFTables(set_cache=False)`.
+
+Bulk updates
+------------
+
+`NFTables.set_elems_bulk()` takes an iterable of elements, and
+streams them into `NFT_MSG_NEWSETELEM` or `NFT_MSG_DELSETELEM`
+messages of up to `chunk_size` elements, all in one transaction::
+
+    nft.set_elems_bulk(
+        "add",
+        table="filter",
+        set="blocklist",
+        elements=("10.0.%i.%i" % (x >> 8, x & 0xFF) for x in range(10000)),
+    )
 '''
 
-from pyroute2.netlink.nfnetlink import nfgen_msg
+import errno
+import socket
+import struct
+
+from pyroute2.netlink import NETLINK_NETFILTER, NLM_F_CREATE, nlmsg_iter
+from pyroute2.netlink.nfnetlink import (
+    NFNL_SUBSYS_NFTABLES,
+    NFNLGRP_NFTABLES,
+    nfgen_msg,
+)
 from pyroute2.netlink.nfnetlink.nftsocket import (
     DATA_TYPE_ID_TO_NAME,
     DATA_TYPE_NAME_TO_INFO,
@@ -217,11 +248,111 @@ class NFTSetElem:
         return str(self.as_dict())
 
 
+class NFTSetCache:
+    '''
+    `NFTSet` objects by `(family, table, name)`.
+
+    The cache has its own non-blocking netlink socket subscribed
+    to the nftables events. Pending events are read on every
+    lookup; set and table updates drop the affected entries, and
+    if the socket overflows, the whole cache is dropped.
+    '''
+
+    def __init__(self):
+        self.sets = {}
+        self.socket = None
+
+    def open(self):
+        sock = socket.socket(
+            socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_NETFILTER
+        )
+        try:
+            sock.setblocking(False)
+            sock.bind((0, 1 << (NFNLGRP_NFTABLES - 1)))
+        except Exception:
+            sock.close()
+            raise
+        self.socket = sock
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+        self.sets = {}
+
+    def update(self):
+        '''
+        Read the pending events.
+        '''
+        if self.socket is None:
+            # start listening before caching anything
+            self.sets = {}
+            self.open()
+            return
+        while True:
+            try:
+                data = self.socket.recv(65536)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                if e.errno != errno.ENOBUFS:
+                    raise
+                # events lost
+                self.sets = {}
+                continue
+            self.parse(data)
+
+    def parse(self, data):
+        for offset, length, msg_type, _, _ in nlmsg_iter(data):
+            if msg_type >> 8 == NFNL_SUBSYS_NFTABLES and (
+                msg_type & 0xFF
+                in (NFT_MSG_NEWSET, NFT_MSG_DELSET, NFT_MSG_DELTABLE)
+            ):
+                self.invalidate(data[offset : offset + length])
+
+    def invalidate(self, data):
+        if struct.unpack_from('H', data, 4)[0] & 0xFF == NFT_MSG_DELTABLE:
+            msg = nft_table_msg(data)
+            msg.decode()
+            key = (msg['nfgen_family'], msg.get_attr('NFTA_TABLE_NAME'))
+            for family, table, name in tuple(self.sets):
+                if (family, table) == key:
+                    del self.sets[(family, table, name)]
+        else:
+            msg = nft_set_msg(data)
+            msg.decode()
+            self.drop(
+                msg['nfgen_family'],
+                msg.get_attr('NFTA_SET_TABLE'),
+                msg.get_attr('NFTA_SET_NAME'),
+            )
+
+    def drop(self, family, table, name):
+        self.sets.pop((family, table, name), None)
+
+    def lookup(self, family, table, name):
+        self.update()
+        return self.sets.get((family, table, name))
+
+    def store(self, family, nft_set):
+        self.sets[(family, nft_set.table, nft_set.name)] = nft_set
+
+
 class NFTables(NFTSocket):
     # TODO: documentation
-    # TODO: tests
     # TODO: dump()/load() with support for json and xml
 
+    def __init__(
+        self, version=1, attr_revision=0, nfgen_family=2, set_cache=True
+    ):
+        super().__init__(version, attr_revision, nfgen_family)
+        self.set_cache = NFTSetCache() if set_cache else None
+
+    def close(self, *argv, **kwarg):
+        if self.set_cache is not None:
+            self.set_cache.close()
+        return super().close(*argv, **kwarg)
+
     def get_tables(self):
         return self.request_get(nfgen_msg(), NFT_MSG_GETTABLE)
 
@@ -345,6 +476,10 @@ class NFTables(NFTSocket):
             nft_set = kwarg.pop("set")
         else:
             nft_set = NFTSet(**kwarg)
+        if self.set_cache is not None and cmd != "get":
+            self.set_cache.drop(
+                self._nfgen_family, nft_set.table, nft_set.name
+            )
         kwarg = nft_set.as_netlink()
         msg = self._command(nft_set_msg, commands, cmd, kwarg)
         if cmd == "get":
@@ -371,20 +506,7 @@ class NFTables(NFTSocket):
             'get': NFT_MSG_GETSETELEM,
             'del': NFT_MSG_DELSETELEM,
         }
-        if isinstance(kwarg["set"], NFTSet):
-            nft_set = kwarg.pop("set")
-            kwarg["table"] = nft_set.table
-            kwarg["set"] = nft_set.name
-        else:
-            nft_set = self.sets("get", table=kwarg["table"], name=kwarg["set"])
-
-        found = DATA_TYPE_NAME_TO_INFO.get(nft_set.key_type)
-        if found:
-            _, _, modifier = found
-            modifier = modifier()
-            modifier.header = None
-        else:
-            modifier = None
+        modifier = self._set_elem_modifier(kwarg)
 
         if cmd == "get":
             msg = nft_set_elem_list_msg()
@@ -392,18 +514,103 @@ class NFTables(NFTSocket):
                 ["NFTA_SET_ELEM_LIST_TABLE", kwarg["table"]],
                 ["NFTA_SET_ELEM_LIST_SET", kwarg["set"]],
             ]
-            msg = self.request_get(msg, NFT_MSG_GETSETELEM)[0]
             elements = set()
-            for elem in msg.get_attr('NFTA_SET_ELEM_LIST_ELEMENTS'):
-                elements.add(NFTSetElem.from_netlink(elem, modifier))
+            # large sets are dumped in several messages
+            for msg in self.request_get(msg, NFT_MSG_GETSETELEM):
+                for elem in msg.get_attr('NFTA_SET_ELEM_LIST_ELEMENTS', ()):
+                    elements.add(NFTSetElem.from_netlink(elem, modifier))
             return elements
 
         elements = []
         for elem in kwarg.pop("elements"):
-            if isinstance(elem, dict):
-                elem = NFTSetElem.from_dict(elem)
-            elif not isinstance(elem, NFTSetElem):
-                elem = NFTSetElem(value=elem)
-            elements.append(elem.as_netlink(modifier))
+            elements.append(self._set_elem_attrs(elem, modifier))
         kwarg["elements"] = elements
         return self._command(nft_set_elem_list_msg, commands, cmd, kwarg)
+
+    def set_elems_bulk(self, cmd, elements, chunk_size=1024, **kwarg):
+        '''
+        Add or delete many set elements in one transaction.
+
+        The elements are the same as for `set_elems()`, but may come
+        from any iterable, e.g. a generator; they are encoded into
+        messages of up to `chunk_size` elements as they come::
+
+            nft.set_elems_bulk("add", table="filter", set="test0",
+                               elements=open("blocklist.txt").read().split())
+
+        Raises the first error, if any; then the whole transaction is
+        aborted by the kernel.
+        '''
+        commands = {'add': NFT_MSG_NEWSETELEM, 'del': NFT_MSG_DELSETELEM}
+        msg_type = commands[cmd]
+        msg_flags = NLM_F_CREATE if cmd == 'add' else 0
+        modifier = self._set_elem_modifier(kwarg)
+        tx = self.transaction()
+
+        def put(chunk):
+            msg = nft_set_elem_list_msg()
+            msg['attrs'] = [
+                ['NFTA_SET_ELEM_LIST_TABLE', kwarg['table']],
+                ['NFTA_SET_ELEM_LIST_SET', kwarg['set']],
+                ['NFTA_SET_ELEM_LIST_ELEMENTS', chunk],
+            ]
+            try:
+                tx.put(msg, msg_type, msg_flags)
+            except struct.error:
+                # the elements list doesn't fit into one NLA
+                if len(chunk) < 2:
+                    raise
+                put(chunk[: len(chunk) // 2])
+                put(chunk[len(chunk) // 2 :])
+
+        chunk = []
+        try:
+            for elem in elements:
+                chunk.append(self._set_elem_attrs(elem, modifier))
+                if len(chunk) >= chunk_size:
+                    put(chunk)
+                    chunk = []
+            if chunk:
+                put(chunk)
+        except Exception:
+            tx.cleanup()
+            raise
+        for _, error in tx.commit():
+            if error is not None:
+                raise error
+
+    def _set_elem_modifier(self, kwarg):
+        # resolve the set, and return the key type encoder
+        if isinstance(kwarg["set"], NFTSet):
+            nft_set = kwarg.pop("set")
+            kwarg["table"] = nft_set.table
+            kwarg["set"] = nft_set.name
+        else:
+            nft_set = None
+            if self.set_cache is not None:
+                nft_set = self.set_cache.lookup(
+                    self._nfgen_family, kwarg["table"], kwarg["set"]
+                )
+            if nft_set is None:
+                nft_set = self.sets(
+                    "get", table=kwarg["table"], name=kwarg["set"]
+                )
+                if self.set_cache is not None:
+                    self.set_cache.store(self._nfgen_family, nft_set)
+
+        found = DATA_TYPE_NAME_TO_INFO.get(nft_set.key_type)
+        if found:
+            _, _, modifier = found
+            modifier = modifier()
+            modifier.header = None
+        else:
+            modifier = None
+        return modifier
+
+    @staticmethod
+    def _set_elem_attrs(elem, modifier):
+        if isinstance(elem, dict):
+            elem = NFTSetElem.from_dict(elem)
+        elif not isinstance(elem, NFTSetElem):
+            elem = NFTSetElem(value=elem)
+        return elem.as_netlink(modifier)
@@ -42,6 +42,26 @@ ChildProcessReturnValue = namedtuple(
 )
 
 
+def check_feedback(payload):
+    '''
+    Raise the exception reported by a child, if any.
+    '''
+    if payload:
+        if set(payload.keys()) != set(('exception', 'options')):
+            raise TypeError('error loading child feedback')
+        if payload['exception'] is not None:
+            error_class = getattr(builtins, payload['exception'], None)
+            if error_class is None:
+                error_class = getattr(
+                    pyroute2_exceptions, payload['exception'], None
+                )
+            if error_class is None:
+                error_class = Exception
+            if not issubclass(error_class, Exception):
+                raise TypeError('error loading child error')
+            raise error_class(*payload['options'])
+
+
 class ChildProcess:
     def __init__(self, target, args):
         self.ctrl_r, self.ctrl_w = socket.socketpair(
@@ -76,21 +96,7 @@ class ChildProcess:
             return None
 
         (data, fds, _, _) = socket.recv_fds(self.ctrl_r, 1024, 1)
-        payload = json.loads(data.decode('utf-8'))
-        if payload:
-            if set(payload.keys()) != set(('exception', 'options')):
-                raise TypeError('error loading child feedback')
-            if payload['exception'] is not None:
-                error_class = getattr(builtins, payload['exception'], None)
-                if error_class is None:
-                    error_class = getattr(
-                        pyroute2_exceptions, payload['exception'], None
-                    )
-                if error_class is None:
-                    error_class = Exception
-                if not issubclass(error_class, Exception):
-                    raise TypeError('error loading child error')
-                raise error_class(*payload['options'])
+        check_feedback(json.loads(data.decode('utf-8')))
         return fds
 
     @property
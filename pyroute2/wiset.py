@@ -383,6 +383,12 @@ class WiSet(object):
         we add the element. Without this reset, kernel sometimes store old
         values and can add very strange behavior on counters.
         """
+        entry, kwargs = self._entry_args(entry, kwargs)
+        add_ipset_entry(
+            self.name, entry, etype=self.entry_type, sock=self.sock, **kwargs
+        )
+
+    def _entry_args(self, entry, kwargs):
         if isinstance(entry, dict):
             kwargs.update(entry)
             entry = kwargs.pop("entry")
@@ -398,9 +404,7 @@ class WiSet(object):
             except IndexError:
                 mask = int("0xffffffff", 16)
             kwargs["skbmark"] = (mark, mask)
-        add_ipset_entry(
-            self.name, entry, etype=self.entry_type, sock=self.sock, **kwargs
-        )
+        return entry, kwargs
 
     def delete(self, entry, **kwargs):
         """Delete/remove an entry in this ipset"""
@@ -444,9 +448,26 @@ class WiSet(object):
         return self._content
 
     def insert_list(self, entries):
-        """Just a small helper to reduce the number of loops in main code."""
+        """Add a list of entries.
+
+        Entries are the same as for :func:`add`, but they are packed
+        into a few netlink messages. The first error, if any, is raised
+        when all the entries are processed.
+        """
+        bulk = []
         for entry in entries:
-            self.add(entry)
+            entry, kwargs = self._entry_args(entry, {})
+            kwargs["entry"] = entry
+            bulk.append(kwargs)
+        add_ipset_entries(
+            self.name, bulk, etype=self.entry_type, sock=self.sock
+        )
+
+    def delete_list(self, entries, **kwargs):
+        """Delete a list of entries, see :func:`insert_list`"""
+        delete_ipset_entries(
+            self.name, entries, etype=self.entry_type, sock=self.sock, **kwargs
+        )
 
     def replace_entries(self, new_list):
         """Replace the content of an ipset with a new list of entries.
@@ -575,6 +596,22 @@ def delete_ipset_entry(name, entry, sock=None, **kwargs):
     sock.delete(name, entry, **kwargs)
 
 
+@need_ipset_socket
+def add_ipset_entries(name, entries, sock=None, **kwargs):
+    """Add a list of entries, raise the first error if any"""
+    for error in sock.add_many(name, entries, **kwargs):
+        if error is not None:
+            raise error
+
+
+@need_ipset_socket
+def delete_ipset_entries(name, entries, sock=None, **kwargs):
+    """Remove a list of entries, raise the first error if any"""
+    for error in sock.delete_many(name, entries, **kwargs):
+        if error is not None:
+            raise error
+
+
 @need_ipset_socket
 def test_ipset_exist(name, sock=None):
     """Test if the given ipset exist"""
@@ -596,9 +633,10 @@ def test_ipset_entry(name, entry, sock=None, **kwargs):
 @need_ipset_socket
 def test_ipset_entries(name, entries, sock=None, **kwargs):
     """Test a list (or a set) of entries."""
+    entries = list(entries)
     res = set()
-    for entry in entries:
-        if sock.test(name, entry, **kwargs):
+    for entry, found in zip(entries, sock.test_many(name, entries, **kwargs)):
+        if found:
             res.add(entry)
     return res
 
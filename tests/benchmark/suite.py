@@ -0,0 +1,540 @@
+'''
+Benchmark suite.
+
+Measure the hot paths on controlled sizes and print the results as
+a table, or save them as JSON to track regressions across releases::
+
+    $ python tests/benchmark/suite.py
+    $ python tests/benchmark/suite.py --output results.json
+    $ python tests/benchmark/suite.py --filter 'encode.*' 'decode.*'
+
+The benchmarks run on the mock RTNL engine, `IPEngine`, so they
+don't need root and don't depend on the system network setup. Use
+`--capture` to parse recorded data as well, either a pcap dump from
+an `nlmon` interface, or a hex dump as used in the unit tests::
+
+    $ python tests/benchmark/suite.py --capture nl0.pcap
+
+Use `--lazy` to run the `parse.*` benchmarks in the lazy NLA decoding
+mode::
+
+    $ python tests/benchmark/suite.py --filter 'parse.*' --lazy
+
+Compare the results with a saved run; the exit code is 1 if some
+benchmark is slower than the saved result by more than `--threshold`.
+Only the results of the same size and options are compared, and
+`--quick` runs are too short to compare with the default threshold::
+
+    $ python tests/benchmark/suite.py --compare results.json
+
+Every benchmark is a generator function: it prepares the data, then
+yields a function that processes the data once and returns the number
+of processed items, and then cleans up. Like `timeit`, the function
+is called in a loop that takes at least `--min-time` seconds, and
+the loop is timed `--rounds` times; the rate is calculated for the
+median round.
+'''
+
+import argparse
+import datetime
+import fnmatch
+import gc
+import ipaddress
+import json
+import platform
+import statistics
+import sys
+import time
+from contextlib import contextmanager
+
+from pyroute2 import NDB, IPRoute, config
+from pyroute2.common import load_dump
+from pyroute2.conntrack import ConntrackRecordParser
+from pyroute2.iproute.ipmock import generate, presets
+from pyroute2.netlink import NLM_F_MULTI
+from pyroute2.netlink.nfnetlink.nfctsocket import nfct_msg
+from pyroute2.netlink.rtnl import RTM_NEWLINK, RTM_NEWNEIGH, RTM_NEWROUTE
+from pyroute2.netlink.rtnl.ifinfmsg import ifinfmsg
+from pyroute2.netlink.rtnl.marshal import MarshalRtnl
+from pyroute2.netlink.rtnl.ndmsg import ndmsg
+from pyroute2.netlink.rtnl.rtmsg import rtmsg
+
+# the results file format version
+RESULTS_VERSION = 2
+
+benchmarks = {}
+
+
+def benchmark(name, size, unit='msg'):
+    '''
+    Register a benchmark with the default size, scaled by `--scale`.
+    '''
+
+    def wrapper(func):
+        benchmarks[name] = {'func': func, 'size': size, 'unit': unit}
+        return func
+
+    return wrapper
+
+
+def ip(base, offset):
+    return str(ipaddress.ip_address(base) + offset)
+
+
+def route_values(count):
+    for idx in range(count):
+        yield {
+            'family': 2,
+            'dst_len': 32,
+            'table': 254,
+            'proto': 4,
+            'scope': 0,
+            'type': 1,
+            'attrs': [
+                ('RTA_TABLE', 254),
+                ('RTA_DST', ip('10.0.0.0', idx)),
+                ('RTA_PRIORITY', 100 + idx % 16),
+                ('RTA_GATEWAY', '192.168.0.1'),
+                ('RTA_OIF', 2 + idx % 8),
+            ],
+        }
+
+
+def link_values(count):
+    for idx in range(count):
+        yield {
+            'family': 0,
+            'index': idx + 1,
+            'flags': 0x1043,
+            'attrs': [
+                ('IFLA_IFNAME', f'bench{idx}'),
+                ('IFLA_MTU', 1500),
+                ('IFLA_OPERSTATE', 'UP'),
+                ('IFLA_ADDRESS', '02:00:00:00:%02x:%02x' % divmod(idx, 256)),
+                ('IFLA_LINKINFO', {'attrs': [('IFLA_INFO_KIND', 'dummy')]}),
+            ],
+        }
+
+
+def neighbour_values(count):
+    for idx in range(count):
+        yield {
+            'family': 2,
+            'ifindex': 2 + idx % 8,
+            'state': 2,
+            'attrs': [
+                ('NDA_DST', ip('172.16.0.0', idx)),
+                ('NDA_LLADDR', '02:00:00:00:%02x:%02x' % divmod(idx, 256)),
+            ],
+        }
+
+
+def conntrack_values(count):
+    for idx in range(count):
+        orig = {
+            'attrs': [
+                (
+                    'CTA_TUPLE_IP',
+                    {
+                        'attrs': [
+                            ('CTA_IP_V4_SRC', ip('10.0.0.0', idx)),
+                            ('CTA_IP_V4_DST', '192.168.0.1'),
+                        ]
+                    },
+                ),
+                (
+                    'CTA_TUPLE_PROTO',
+                    {
+                        'attrs': [
+                            ('CTA_PROTO_NUM', 6),
+                            ('CTA_PROTO_SRC_PORT', 1024 + idx % 60000),
+                            ('CTA_PROTO_DST_PORT', 443),
+                        ]
+                    },
+                ),
+            ]
+        }
+        yield {
+            'nfgen_family': 2,
+            'attrs': [
+                ('CTA_TUPLE_ORIG', orig),
+                ('CTA_STATUS', 0x18E),
+                ('CTA_TIMEOUT', 432000),
+                ('CTA_MARK', idx % 4),
+                ('CTA_ID', idx),
+            ],
+        }
+
+
+samples = {
+    'rtmsg': (rtmsg, RTM_NEWROUTE, route_values),
+    'ifinfmsg': (ifinfmsg, RTM_NEWLINK, link_values),
+    'ndmsg': (ndmsg, RTM_NEWNEIGH, neighbour_values),
+    'nfct_msg': (nfct_msg, 0x100, conntrack_values),
+}
+
+
+def encode_sample(name, count):
+    '''
+    Return a list of encoded messages.
+    '''
+    msg_class, msg_type, values = samples[name]
+    ret = []
+    for value in values(count):
+        msg = msg_class()
+        msg.setvalue(value)
+        msg['header']['type'] = msg_type
+        msg['header']['flags'] = NLM_F_MULTI
+        msg['header']['sequence_number'] = 42
+        msg.encode()
+        ret.append(bytes(msg.data))
+    return ret
+
+
+def make_encode_benchmark(name):
+    def func(size):
+        msg_class, msg_type, values = samples[name]
+        values = list(values(size))
+
+        def run():
+            for value in values:
+                msg = msg_class()
+                msg.setvalue(value)
+                msg['header']['type'] = msg_type
+                msg.encode()
+            return len(values)
+
+        yield run
+
+    return func
+
+
+def make_decode_benchmark(name):
+    def func(size):
+        msg_class = samples[name][0]
+        data = encode_sample(name, size)
+
+        def run():
+            for buf in data:
+                msg_class(buf).decode()
+            return len(data)
+
+        yield run
+
+    return func
+
+
+for name in samples:
+    benchmark(f'encode.{name}', 10000)(make_encode_benchmark(name))
+    benchmark(f'decode.{name}', 10000)(make_decode_benchmark(name))
+
+
+@benchmark('decode.conntrack_record', 10000)
+def decode_conntrack_record(size):
+    data = encode_sample('nfct_msg', size)
+    parser = ConntrackRecordParser()
+
+    def run():
+        for buf in data:
+            parser(buf, 0, len(buf))
+        return len(data)
+
+    yield run
+
+
+@benchmark('parse.route_dump', 50000)
+def parse_route_dump(size, lazy=False):
+    data = b''.join(encode_sample('rtmsg', size))
+    marshal = MarshalRtnl()
+    marshal.lazy_decode = lazy
+
+    def run():
+        count = 0
+        for msg in marshal.parse(data):
+            msg.get('dst')
+            count += 1
+        return count
+
+    yield run
+
+
+def load_capture(path):
+    '''
+    Load RTNL messages from a pcap or a hex dump.
+    '''
+    if path.endswith('.pcap'):
+        from pyroute2.decoder.loader import LoaderPcap
+
+        loader = LoaderPcap(path, MarshalRtnl(), 'H', 0, 'll_header{family=0}')
+        return b''.join(x.data for x in loader.data)
+    with open(path, 'r') as f:
+        return load_dump(f)
+
+
+@benchmark('parse.capture', 50000)
+def parse_capture(size, capture=None, lazy=False):
+    if capture is None:
+        return
+    data = load_capture(capture)
+    marshal = MarshalRtnl()
+    marshal.lazy_decode = lazy
+    messages = len(tuple(marshal.parse(data)))
+    if not messages:
+        return
+    data = data * max(1, size // messages)
+
+    def run():
+        count = 0
+        for msg in marshal.parse(data):
+            msg.get('attrs')
+            count += 1
+        return count
+
+    yield run
+
+
+@contextmanager
+def mock_netlink(**kwarg):
+    '''
+    Run the RTNL sockets on `IPEngine` with a generated preset.
+    '''
+    saved = presets['default'], config.mock_netlink
+    presets['default'] = generate(**kwarg)
+    config.mock_netlink = True
+    try:
+        yield
+    finally:
+        presets['default'], config.mock_netlink = saved
+
+
+@benchmark('iproute.get_routes', 50000)
+def iproute_get_routes(size):
+    with mock_netlink(links=8, routes=size):
+        with IPRoute() as ipr:
+            # the first dump encodes and caches the engine objects
+            ipr.get_routes()
+
+            def run():
+                return len(tuple(ipr.get_routes()))
+
+            yield run
+
+
+@benchmark('ndb.load', 10000, unit='object')
+def ndb_load(size):
+    with mock_netlink(links=size // 100, addresses=size // 10, routes=size):
+
+        def run():
+            with NDB() as ndb:
+                return (
+                    ndb.interfaces.count()
+                    + ndb.addresses.count()
+                    + ndb.routes.count()
+                )
+
+        yield run
+
+
+@benchmark('ndb.events', 10000, unit='event')
+def ndb_events(size):
+    with mock_netlink(links=8):
+        with NDB() as ndb:
+            engine = ndb.sources['localhost'].nl.asyncore.use_socket
+
+            def run():
+                events = ndb.metrics()['events']
+                engine.storm(size, kind='route', size=1000, batch=16)
+                while ndb.metrics()['events'] - events < size:
+                    time.sleep(0.01)
+                return size
+
+            yield run
+
+
+def timed(run, number):
+    '''
+    Call `run()` `number` times, return the elapsed time and the
+    count returned by the last call. Like in `timeit`, the garbage
+    collector is disabled while timing.
+    '''
+    count = 0
+    gc.collect()
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for _ in range(number):
+            count = run()
+        return time.perf_counter() - start, count
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def measure(name, spec, size, rounds, min_time=0.2, **kwarg):
+    '''
+    Run the benchmark, return the result record, or None if the
+    benchmark is not applicable.
+
+    The number of calls per round is doubled until one round takes
+    at least `min_time`; these calls warm up the benchmark as well.
+    The `times` are the round times divided by the number of calls.
+    '''
+    context = spec['func'](size, **kwarg)
+    try:
+        run = next(context)
+    except StopIteration:
+        return None
+    number = 1
+    times = []
+    try:
+        while timed(run, number)[0] < min_time:
+            number *= 2
+        for _ in range(rounds):
+            elapsed, count = timed(run, number)
+            times.append(elapsed / number)
+    finally:
+        context.close()
+    median = statistics.median(times)
+    return {
+        'name': name,
+        'size': size,
+        'unit': spec['unit'],
+        'count': count,
+        'number': number,
+        'rounds': rounds,
+        'times': times,
+        'best': min(times),
+        'median': median,
+        'rate': count / median if median else None,
+        'options': kwarg,
+    }
+
+
+def metadata():
+    import pyroute2
+
+    return {
+        'pyroute2': getattr(pyroute2, '__version__', None),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'argv': sys.argv[1:],
+    }
+
+
+def compare(results, baseline, threshold):
+    '''
+    Compare the median rates with the baseline, return the list
+    of `(name, ratio, regression)`. Only the results of the same
+    size and options are compared.
+    '''
+    if baseline.get('version') != RESULTS_VERSION:
+        raise ValueError('incompatible baseline results version')
+    reference = {x['name']: x for x in baseline['results']}
+    ret = []
+    for result in results:
+        base = reference.get(result['name'])
+        if base is None or base['size'] != result['size']:
+            continue
+        if base.get('options', {}) != result['options']:
+            continue
+        if not base['rate'] or not result['rate']:
+            continue
+        ratio = result['rate'] / base['rate']
+        ret.append((result['name'], ratio, ratio < 1 - threshold))
+    return ret
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument(
+        '--filter',
+        nargs='*',
+        default=['*'],
+        help='benchmark name patterns, default: all',
+    )
+    parser.add_argument('--list', action='store_true')
+    parser.add_argument('--rounds', type=int, default=7)
+    parser.add_argument(
+        '--min-time',
+        type=float,
+        default=0.2,
+        help='minimal round time, seconds',
+    )
+    parser.add_argument(
+        '--scale', type=float, default=1.0, help='scale the default sizes'
+    )
+    parser.add_argument(
+        '--quick', action='store_true', help='same as --scale 0.1'
+    )
+    parser.add_argument('--capture', help='pcap or hex dump to parse')
+    parser.add_argument(
+        '--lazy', action='store_true', help='lazy NLA decoding in parse.*'
+    )
+    parser.add_argument('--output', help='save the results as JSON')
+    parser.add_argument('--compare', help='JSON results to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args()
+    if args.list:
+        for name, spec in benchmarks.items():
+            print(f'{name:24} {spec["size"]:>8} {spec["unit"]}')
+        return 0
+    scale = 0.1 if args.quick else args.scale
+
+    results = []
+    for name, spec in benchmarks.items():
+        if not any(fnmatch.fnmatch(name, x) for x in args.filter):
+            continue
+        kwarg = {}
+        if name == 'parse.capture':
+            kwarg['capture'] = args.capture
+        if name.startswith('parse.') and args.lazy:
+            kwarg['lazy'] = True
+        result = measure(
+            name,
+            spec,
+            max(1, int(spec['size'] * scale)),
+            args.rounds,
+            args.min_time,
+            **kwarg,
+        )
+        if result is None:
+            continue
+        results.append(result)
+        print(
+            f'{name:24} {result["count"]:>8} {result["unit"]:6} '
+            f'{result["median"]:8.3f}s {result["rate"]:>12.0f} '
+            f'{result["unit"]}/s',
+            file=sys.stderr,
+        )
+
+    report = {
+        'version': RESULTS_VERSION,
+        'metadata': metadata(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+
+    ret = 0
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        for name, ratio, regression in compare(
+            results, baseline, args.threshold
+        ):
+            mark = 'REGRESSION' if regression else ''
+            print(f'{name:24} {ratio:6.2f}x {mark}', file=sys.stderr)
+            if regression:
+                ret = 1
+    return ret
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,15 @@
+import asyncio
+import errno
 import re
+from socket import AF_INET
 
 import pytest
 from net_tools import address_exists
 
+from pyroute2.netlink import NLM_F_CREATE, NLM_F_EXCL, NLM_F_REQUEST
+from pyroute2.netlink.rtnl import RTM_NEWADDR
+from pyroute2.netlink.rtnl.ifaddrmsg import ifaddrmsg
+
 ip4v6 = re.compile('^[.:0-9a-f]*$')
 
 
@@ -23,3 +30,29 @@ async def test_addr_add(async_ipr, test_link_ifname, test_link_index, nsname):
         'add', index=test_link_index, address='192.168.145.150', prefixlen=24
     )
     assert address_exists('192.168.145.150', test_link_ifname, netns=nsname)
+
+
+@pytest.mark.asyncio
+async def test_addr_submit_many(
+    async_ipr, test_link_ifname, test_link_index, nsname
+):
+    batch = []
+    for x in range(1, 17):
+        msg = ifaddrmsg()
+        msg['header']['type'] = RTM_NEWADDR
+        msg['header']['flags'] = NLM_F_REQUEST | NLM_F_CREATE | NLM_F_EXCL
+        msg['family'] = AF_INET
+        msg['prefixlen'] = 24
+        msg['index'] = test_link_index
+        msg['attrs'] = [('IFA_LOCAL', f'192.168.148.{x}')]
+        batch.append(msg)
+    batch.append(batch[0])
+    futures = await async_ipr.submit_many(batch, window=4)
+    assert len(futures) == len(batch)
+    ret = await asyncio.gather(*futures, return_exceptions=True)
+    assert ret[:16] == [None] * 16
+    assert ret[16].code == errno.EEXIST
+    for x in range(1, 17):
+        assert address_exists(
+            f'192.168.148.{x}', test_link_ifname, netns=nsname
+        )
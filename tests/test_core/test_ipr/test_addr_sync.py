@@ -1,3 +1,4 @@
+import errno
 import re
 
 from net_tools import address_exists
@@ -20,3 +21,34 @@ def test_addr_add(sync_ipr, test_link_ifname, test_link_index, nsname):
         'add', index=test_link_index, address='192.168.145.150', prefixlen=24
     )
     assert address_exists('192.168.145.150', test_link_ifname, netns=nsname)
+
+
+def test_addr_bulk(sync_ipr, test_link_ifname, test_link_index, nsname):
+    requests = [
+        (
+            'add',
+            {
+                'index': test_link_index,
+                'address': f'192.168.146.{x}',
+                'prefixlen': 32,
+            },
+        )
+        for x in range(1, 65)
+    ]
+    # duplicate one address and try a non existing interface
+    requests.append(requests[5])
+    requests.append(
+        ('add', {'index': 0xFFFF, 'address': '192.168.147.1', 'prefixlen': 24})
+    )
+    ret = sync_ipr.bulk('addr', requests, window=16)
+    assert len(ret) == len(requests)
+    assert ret[:64] == [None] * 64
+    assert ret[64].code == errno.EEXIST
+    assert ret[65].code == errno.ENODEV
+    for x in range(1, 65):
+        assert address_exists(
+            f'192.168.146.{x}', test_link_ifname, netns=nsname
+        )
+    ret = sync_ipr.bulk('addr', [('del', x[1]) for x in requests[:64]])
+    assert ret == [None] * 64
+    assert not address_exists('192.168.146.1', test_link_ifname, netns=nsname)
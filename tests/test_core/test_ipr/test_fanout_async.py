@@ -0,0 +1,61 @@
+import uuid
+
+import pytest
+
+from pyroute2 import AsyncIPRoute, netns
+
+
+@pytest.fixture
+def nsnames(nsname):
+    names = [nsname] + [str(uuid.uuid4()) for _ in range(3)]
+    for name in names[1:]:
+        netns.create(name)
+    yield names
+    for name in names[1:]:
+        netns.remove(name)
+
+
+@pytest.mark.asyncio
+async def test_fanout_links(nsnames):
+    links = {}
+    async for name, msg in AsyncIPRoute.fanout(
+        'get_links', netns=nsnames, concurrency=2
+    ):
+        links.setdefault(name, []).append(msg.get('ifname'))
+    assert set(links) == set(nsnames)
+    for name in nsnames[1:]:
+        assert links[name] == ['lo']
+
+
+@pytest.mark.asyncio
+async def test_fanout_method_args(nsnames):
+    ret = []
+    async for name, msg in AsyncIPRoute.fanout(
+        'link', 'get', index=1, netns=nsnames
+    ):
+        ret.append((name, msg.get('ifname')))
+    assert sorted(ret) == sorted([(x, 'lo') for x in nsnames])
+
+
+@pytest.mark.asyncio
+async def test_fanout_errors(nsnames):
+    missing = str(uuid.uuid4())
+    with pytest.raises(OSError):
+        async for _ in AsyncIPRoute.fanout(
+            'get_links', netns=[missing] + nsnames
+        ):
+            pass
+    assert missing not in netns.listnetns()
+    names = set()
+    async for name, _ in AsyncIPRoute.fanout(
+        'get_links', netns=[missing] + nsnames, skip_errors=True
+    ):
+        names.add(name)
+    assert names == set(nsnames)
+
+
+@pytest.mark.asyncio
+async def test_fanout_break(nsnames):
+    async for name, msg in AsyncIPRoute.fanout('get_links', netns=nsnames):
+        break
+    assert name in nsnames
@@ -9,6 +9,24 @@ async def test_link_dump(async_ipr):
         assert 1 < len(link.get('ifname')) < 16
 
 
+@pytest.mark.parametrize('async_ipr', [{'lazy_decode': True}], indirect=True)
+@pytest.mark.asyncio
+async def test_link_dump_lazy(async_ipr):
+    async for link in await async_ipr.link('dump'):
+        assert link.get('index') > 0
+        assert 1 < len(link.get('ifname')) < 16
+        assert link.get('state') in ('up', 'down')
+
+
+@pytest.mark.parametrize('async_ipr', [{'use_buffer': True}], indirect=True)
+@pytest.mark.asyncio
+async def test_link_dump_buffer(async_ipr):
+    async for link in await async_ipr.link('dump'):
+        assert isinstance(link.data, memoryview)
+        assert link.get('index') > 0
+        assert 1 < len(link.get('ifname')) < 16
+
+
 @pytest.mark.asyncio
 async def test_link_add(async_ipr, tmp_link_ifname, nsname):
     await async_ipr.link(
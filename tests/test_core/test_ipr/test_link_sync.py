@@ -1,3 +1,4 @@
+import pytest
 from net_tools import interface_exists
 
 
@@ -7,6 +8,30 @@ def test_link_dump(sync_ipr):
         assert 1 < len(link.get('ifname')) < 16
 
 
+@pytest.mark.parametrize('sync_ipr', [{'lazy_decode': True}], indirect=True)
+def test_link_dump_lazy(sync_ipr):
+    links = tuple(sync_ipr.link('dump'))
+    assert links
+    for link in links:
+        assert link.get('index') > 0
+        assert 1 < len(link.get('ifname')) < 16
+        assert link.get('state') in ('up', 'down')
+        assert link.dump()['attrs']
+
+
+@pytest.mark.parametrize('sync_ipr', [{'use_buffer': True}], indirect=True)
+def test_link_dump_buffer(sync_ipr):
+    links = sync_ipr.get_links()
+    assert links
+    assert [x.get('ifname') for x in links] == [
+        x.get('ifname') for x in sync_ipr.get_links()
+    ]
+    for link in links:
+        assert isinstance(link.data, memoryview)
+        assert link.get('index') > 0
+        assert 1 < len(link.get('ifname')) < 16
+
+
 def test_link_add(sync_ipr, tmp_link_ifname, nsname):
     sync_ipr.link('add', ifname=tmp_link_ifname, kind='dummy', state='up')
     assert interface_exists(tmp_link_ifname, netns=nsname)
@@ -110,3 +110,13 @@ async def test_dumps(
         families.add(route.get('family'))
     assert tables <= target_tables
     assert families == target_families
+
+
+@pytest.mark.asyncio
+async def test_get_routes_break(async_ipr):
+    dump = await async_ipr.get_routes()
+    async for route in dump:
+        break
+    await dump.aclose()
+    assert set(async_ipr.msg_queue.queues.keys()) == {0}
+    assert len([x async for x in await async_ipr.get_routes()]) > 0
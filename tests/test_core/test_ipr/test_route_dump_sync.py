@@ -1,9 +1,11 @@
+import errno
 import io
 from socket import AF_INET, AF_INET6, AF_UNSPEC
 
 import pytest
 from net_tools import address_exists, route_exists
 
+from pyroute2 import IPBatch
 from pyroute2.common import load_dump
 
 test_dump_data = '''
@@ -45,6 +47,24 @@ def test_loads(sync_ipr, nsname):
     assert route_exists(dst='10.1.3.0/24', table=100, netns=nsname)
 
 
+def test_load_errors(sync_ipr, nsname):
+    sync_ipr.link('set', index=1, state='up')
+    ipb = IPBatch()
+    ipb.route('add', dst='10.1.4.0/24', oif=1, table=100)
+    ipb.route('add', dst='10.1.5.0/24', oif=12345, table=100)
+    ipb.route('add', dst='10.1.6.0/24', oif=1, table=100)
+    data = bytes(ipb.batch)
+    ipb.close()
+    ret = sync_ipr.route_loads(data, fmt='raw', window=2, bufsize=64)
+    assert len(ret) == 1
+    msg, error = ret[0]
+    assert msg.get('dst') == '10.1.5.0'
+    assert error.code == errno.ENODEV
+    assert route_exists(dst='10.1.4.0/24', table=100, netns=nsname)
+    assert not route_exists(dst='10.1.5.0/24', table=100, netns=nsname)
+    assert route_exists(dst='10.1.6.0/24', table=100, netns=nsname)
+
+
 @pytest.mark.parametrize(
     'family,target_tables,target_families,fmt,offset',
     [
@@ -104,3 +124,57 @@ def test_dumps(sync_ipr, family, target_tables, target_families, fmt, offset):
         families.add(route.get('family'))
     assert tables <= target_tables
     assert families == target_families
+
+
+def test_iter_routes(sync_ipr):
+    routes = sync_ipr.get_routes()
+    assert len(routes) > 0
+    assert [(x.get('table'), x.get('dst')) for x in routes] == [
+        (x.get('table'), x.get('dst')) for x in sync_ipr.iter_routes()
+    ]
+    for route in sync_ipr.iter_routes(table=255):
+        assert route.get('table') == 255
+
+
+def test_iter_routes_break(sync_ipr):
+    for route in sync_ipr.iter_routes():
+        break
+    assert set(sync_ipr.asyncore.msg_queue.queues.keys()) == {0}
+    assert len(sync_ipr.get_routes()) > 0
+
+
+def test_iter_routes_break_events(sync_ipr):
+    # the dump must span many datagrams
+    sync_ipr.link('set', index=1, state='up')
+    ipb = IPBatch()
+    for i in range(4096):
+        ipb.route('add', dst=f'10.{i >> 8}.{i & 0xFF}.0/24', oif=1, table=100)
+    data = bytes(ipb.batch)
+    ipb.close()
+    assert sync_ipr.route_loads(data, fmt='raw') == []
+    marshal = sync_ipr.asyncore.marshal
+    parse = marshal.parse
+    parsed = []
+
+    def parse_count(*argv, **kwarg):
+        for msg in parse(*argv, **kwarg):
+            parsed.append(msg['header']['type'])
+            yield msg
+
+    marshal.parse = parse_count
+    try:
+        for route in sync_ipr.iter_routes(table=100):
+            break
+    finally:
+        del marshal.parse
+    # the rest of the dump is dropped without parsing
+    assert 0 < len(parsed) < 1024
+    assert len(sync_ipr.get_routes(table=100)) == 4096
+    # the rest of the dump must not leak to the broadcast queue
+    assert sync_ipr.asyncore.msg_queue.root.empty()
+
+
+def test_iter_neighbours(sync_ipr):
+    assert len(tuple(sync_ipr.iter_neighbours())) == len(
+        sync_ipr.get_neighbours()
+    )
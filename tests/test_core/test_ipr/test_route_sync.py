@@ -1,6 +1,9 @@
+import errno
+
 import pytest
+from net_tools import route_exists
 
-from pyroute2 import IPRoute
+from pyroute2 import IPBatch, IPRoute
 
 
 @pytest.mark.parametrize(
@@ -30,3 +33,30 @@ def test_route_filter_strict(command, kwarg):
         assert set(
             [route.get('table') for route in ipr.route(command, **kwarg)]
         ) == set([255])
+
+
+def test_batch_submit(sync_ipr, nsname):
+    sync_ipr.link('set', index=1, state='up')
+    ipb = IPBatch()
+    ipb.route('add', dst='10.1.7.0/24', oif=1, table=100)
+    ipb.route('add', dst='10.1.8.0/24', oif=12345, table=100)
+    ipb.route('add', dst='10.1.9.0/24', oif=1, table=100)
+    ipb.route('dump', table=100)
+    ret = ipb.submit(sync_ipr, window=2, bufsize=64)
+    assert len(ipb.batch) == 0
+    ipb.close()
+    assert [msg.get('dst') for msg, _ in ret] == [
+        '10.1.7.0',
+        '10.1.8.0',
+        '10.1.9.0',
+        None,
+    ]
+    assert [x[1] if x[1] is None else x[1].code for x in ret] == [
+        None,
+        errno.ENODEV,
+        None,
+        errno.EOPNOTSUPP,
+    ]
+    assert route_exists(dst='10.1.7.0/24', table=100, netns=nsname)
+    assert not route_exists(dst='10.1.8.0/24', table=100, netns=nsname)
+    assert route_exists(dst='10.1.9.0/24', table=100, netns=nsname)
@@ -4,7 +4,6 @@ import getpass
 import itertools
 import logging
 import os
-import sys
 import uuid
 from collections import namedtuple
 from socket import AF_INET, AF_INET6
@@ -55,7 +54,7 @@ def make_test_matrix(targets=None, tables=None, dbs=None, types=None):
         db_provider, db_spec = db.split('/')
         if any(map(db_provider.startswith, skipdb)):
             continue
-        if db_provider != 'sqlite3':
+        if db_provider not in ('sqlite3', 'sqlite3_cache', 'native'):
             db_spec = {'dbname': db_spec}
             user = os.environ.get('PGUSER')
             port = os.environ.get('PGPORT')
@@ -313,7 +312,7 @@ class NDBContextManager(object):
         2. remove the registered interfaces, ignore not existing
         '''
         # save postmortem DB for SQLite3
-        if self.db_provider == 'sqlite3' and sys.version_info >= (3, 7):
+        if self.db_provider in ('sqlite3', 'sqlite3_cache', 'native'):
             self.ndb.backup(f'{self.spec.uid}-post.db')
         self.ndb.close()
         self.ipr.close()
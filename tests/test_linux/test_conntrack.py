@@ -1,3 +1,4 @@
+import errno
 import socket
 import subprocess
 import threading
@@ -179,3 +180,102 @@ def test_ct_dump(ct_inject):
             count_found += 1
 
     assert count_found == ct_inject.COUNT_CT
+
+
+def test_ct_stream(ct_inject):
+    tuple_match = NFCTAttrTuple(
+        saddr='192.168.122.1', daddr='192.168.122.67', proto=socket.IPPROTO_TCP
+    )
+    records = list(ct_inject.ct.stream_entries(tuple_orig=tuple_match))
+    assert len(records) == ct_inject.COUNT_CT
+    assert {x.tuple_orig.sport for x in records} == {
+        x.sport for x in ct_inject.tuples
+    }
+    for record in records:
+        assert record.tuple_reply == record.tuple_orig.reverse()
+        assert record.status_name()
+        assert 0 < record.timeout <= 60
+        assert record.id is not None
+
+    # filters are combined
+    records = list(
+        ct_inject.ct.stream_entries(
+            tuple_orig=NFCTAttrTuple(proto=socket.IPPROTO_TCP, sport=20001),
+            tuple_reply=NFCTAttrTuple(saddr='192.168.122.67'),
+        )
+    )
+    assert [x.tuple_orig.sport for x in records] == [20001]
+
+
+def test_ct_stream_fields(ct_inject):
+    tuple_match = NFCTAttrTuple(saddr='192.168.122.1', daddr='192.168.122.67')
+    records = list(
+        ct_inject.ct.stream_entries(
+            fields=('tuple_orig', 'mark'), tuple_orig=tuple_match
+        )
+    )
+    assert len(records) == ct_inject.COUNT_CT
+    for record in records:
+        assert tuple_match == record.tuple_orig
+        assert record.tuple_reply is None
+        assert record.timeout is None
+        assert record.status is None
+        assert record.status_name() == ''
+        repr(record)
+    with pytest.raises(ValueError):
+        ct_inject.ct.stream_entries(fields=('nosuchfield',))
+
+
+def test_ct_stream_close(ct_inject):
+    tuple_match = NFCTAttrTuple(saddr='192.168.122.1', daddr='192.168.122.67')
+    records = ct_inject.ct.stream_entries(tuple_orig=tuple_match)
+    next(records)
+    records.close()
+    # the rest of the dump is dropped
+    assert (
+        len(list(ct_inject.ct.stream_entries(tuple_orig=tuple_match)))
+        == ct_inject.COUNT_CT
+    )
+
+
+def test_ct_update_many(ct_inject):
+    ret = ct_inject.ct.update_many(ct_inject.tuples[:10], mark=5)
+    assert (ret.total, ret.done, ret.errors) == (10, 10, [])
+    records = ct_inject.ct.stream_entries(fields=('tuple_orig',), mark=5)
+    assert {x.tuple_orig.sport for x in records} == {
+        x.sport for x in ct_inject.tuples[:10]
+    }
+
+    ret = ct_inject.ct.update_many(match={'mark': 5}, mark=6, timeout=120)
+    assert (ret.total, ret.done) == (10, 10)
+    for record in ct_inject.ct.stream_entries(mark=6):
+        assert record.timeout > 60
+
+
+def test_ct_delete_many(ct_inject):
+    tuple_match = NFCTAttrTuple(saddr='192.168.122.1', daddr='192.168.122.67')
+    deleted = ct_inject.tuples[:5]
+    acks = []
+    ret = ct_inject.ct.delete_many(deleted, callback=lambda *x: acks.append(x))
+    assert (ret.total, ret.done) == (5, 5)
+    assert len(acks) == 5
+    ret = ct_inject.ct.delete_many(deleted[:2])
+    assert [x[1].code for x in ret.errors] == [errno.ENOENT] * 2
+    assert [x[0] for x in ret.errors] == deleted[:2]
+    assert (
+        len(list(ct_inject.ct.stream_entries(tuple_orig=tuple_match)))
+        == ct_inject.COUNT_CT - 5
+    )
+
+    ret = ct_inject.ct.delete_many(match={'tuple_orig': tuple_match})
+    assert (ret.total, ret.done) == (ct_inject.COUNT_CT - 5,) * 2
+    assert not list(ct_inject.ct.stream_entries(tuple_orig=tuple_match))
+
+    # restore the entries for the fixture teardown
+    for tuple_orig in ct_inject.tuples:
+        ct_inject.ct.entry(
+            'add',
+            timeout=60,
+            tuple_orig=tuple_orig,
+            tuple_reply=tuple_orig.reverse(),
+        )
@@ -9,8 +9,10 @@ from pr2test.marks import require_root
 from pyroute2.ipset import IPSet, IPSetError, PortEntry, PortRange
 from pyroute2.netlink.exceptions import NetlinkError
 from pyroute2.netlink.nfnetlink.ipset import (
+    IPSET_ERR_EXIST,
     IPSET_ERR_TYPE_SPECIFIC,
     IPSET_FLAG_WITH_FORCEADD,
+    ipset_msg,
 )
 
 pytestmark = [require_root()]
@@ -445,3 +447,94 @@ def test_set_by(ipset, ipset_name):
     # restore version back to original
     ipset._proto_version = old_vers
     assert ipset_name == name_found
+
+
+def test_add_many(ipset, ipset_name):
+    ipset.create(ipset_name, comment=True)
+    entries = ["198.51.100.%i" % x for x in range(1, 201)]
+    assert ipset.add_many(ipset_name, entries) == [None] * len(entries)
+    content = list_ipset(ipset_name)
+    assert set(entries) <= set(content)
+    # existing entries fail one by one, the rest is added
+    bulk = [
+        "192.0.2.1",
+        entries[10],
+        {"entry": "192.0.2.2", "comment": "foo"},
+        entries[20],
+        entries[30],
+        "192.0.2.3",
+    ]
+    errors = ipset.add_many(ipset_name, bulk)
+    assert [x is None for x in errors] == [1, 0, 1, 0, 0, 1]
+    assert [x.lineno for x in errors if x is not None] == [2, 4, 5]
+    assert [x.code for x in errors if x is not None] == [IPSET_ERR_EXIST] * 3
+    content = list_ipset(ipset_name)
+    assert content["192.0.2.2"][2] == "foo"
+    assert "192.0.2.3" in content
+    # non exclusive
+    assert ipset.add_many(ipset_name, bulk, exclusive=False) == [None] * 6
+
+
+def test_add_many_split(ipset, ipset_name):
+    ipset.create(ipset_name, maxelem=16384)
+    entries = ["10.0.%i.%i" % (x >> 8, x & 0xFF) for x in range(10000)]
+    errors = ipset.add_many(
+        ipset_name, entries[:5000] + entries[:10] + entries[5000:]
+    )
+    assert [x.code for x in errors[5000:5010]] == [IPSET_ERR_EXIST] * 10
+    assert [x.lineno for x in errors[5000:5010]] == list(range(5001, 5011))
+    assert errors[:5000] + errors[5010:] == [None] * 10000
+    assert set(list_ipset(ipset_name)) == set(entries)
+    # small messages
+    errors = ipset.delete_many(ipset_name, entries, max_size=1024)
+    assert errors == [None] * 10000
+    assert list_ipset(ipset_name) == {}
+
+
+def test_add_many_no_set(ipset, ipset_name):
+    errors = ipset.add_many(ipset_name, ["192.0.2.1", "192.0.2.2"])
+    assert [x.code for x in errors] == [errno.ENOENT] * 2
+
+
+def test_delete_many(ipset, ipset_name):
+    ipset.create(ipset_name, stype="hash:net")
+    ipset.add_many(
+        ipset_name, ["192.0.2.0/24", "198.51.100.0/24"], etype="net"
+    )
+    errors = ipset.delete_many(
+        ipset_name, ["192.0.2.0/24", "203.0.113.0/24"], etype="net"
+    )
+    assert errors[0] is None
+    assert errors[1].code == IPSET_ERR_EXIST
+    assert errors[1].lineno == 2
+    assert list(list_ipset(ipset_name)) == ["198.51.100.0/24"]
+
+
+def test_test_many(ipset, ipset_name):
+    ipset.create(ipset_name)
+    ipset.add(ipset_name, "192.0.2.1")
+    ipset.add(ipset_name, "192.0.2.3")
+    assert ipset.test_many(
+        ipset_name, ["192.0.2.1", "192.0.2.2", "192.0.2.3"]
+    ) == [True, False, True]
+
+
+def test_bulk_encoding(ipset):
+    # the raw data encoding must match the generic encoder
+    cases = (
+        ("192.0.2.0/24", "net", socket.AF_INET, {"comment": "foo"}),
+        ("192.0.2.0-192.0.2.9", "net", socket.AF_INET, {"timeout": 5}),
+        ("2001:db8::1", "ip", socket.AF_INET6, {"skbmark": (1, 0xFF)}),
+        (("192.0.2.0/24", "eth0"), "net,iface", socket.AF_INET, {}),
+        (("192.0.2.1", PortEntry(80, 6)), "ip,port", socket.AF_INET, {}),
+        (PortRange(1000, 2000), "port", socket.AF_INET, {"packets": 1}),
+    )
+    for entry, etype, family, kwarg in cases:
+        ret = ipset._bulk_data([entry], family, etype, kwarg)
+        attrs = ipset._data_attrs(
+            entry, etype, ipset._family_to_version(family), lineno=1, **kwarg
+        )
+        adt = ipset_msg.attr_adt()
+        adt["attrs"] = [["IPSET_ATTR_DATA", {"attrs": attrs}]]
+        adt.encode()
+        assert ret == [bytes(adt.data)[4:]]
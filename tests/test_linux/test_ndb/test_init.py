@@ -1,10 +1,12 @@
+import time
 import uuid
 from socket import AF_INET, AF_INET6
 
 import pytest
 from pr2test.marks import require_root
 
-from pyroute2 import NDB
+from pyroute2 import NDB, IPRoute
+from pyroute2.ndb.schema import AUTO_INDEX
 from pyroute2.netlink.rtnl import RTMGRP_IPV4_IFADDR, RTMGRP_LINK
 
 pytestmark = [require_root()]
@@ -33,3 +35,132 @@ def test_netlink_groups(kind):
         assert routes.count() == 0
         neighbours = ndb.neighbours.dump()
         assert neighbours.count() == 0
+
+
+def test_pipeline_metrics():
+    spec = {'target': 'localhost', 'kind': 'netns', 'netns': str(uuid.uuid4())}
+    with NDB(sources=[spec], queue_memory=4096, transaction_size=16) as ndb:
+        with ndb.interfaces['lo'] as lo:
+            lo.set(state='up')
+        metrics = ndb.metrics()
+        assert metrics['queue_memory_max'] > 0
+        assert metrics['events'] > 0
+        assert 0 < metrics['transactions'] <= metrics['batches']
+        for stage in ('receive', 'queue', 'apply', 'commit'):
+            assert metrics['latency'][stage]['count'] > 0
+
+
+def test_coalesce_window():
+    netns = str(uuid.uuid4())
+    spec = {'target': 'localhost', 'kind': 'netns', 'netns': netns}
+    with NDB(sources=[spec], coalesce_window=0.5) as ndb:
+        with ndb.interfaces['lo'] as lo:
+            lo.set(state='up')
+        with IPRoute(netns=netns) as ipr:
+            for proto in range(10, 60):
+                ipr.route('replace', dst='10.1.0.0/24', oif=1, proto=proto)
+        for _ in range(50):
+            route = ndb.routes.get({'dst': '10.1.0.0', 'dst_len': 24})
+            if route is not None and route['proto'] == 59:
+                break
+            time.sleep(0.1)
+        else:
+            raise TimeoutError('route update not loaded')
+        assert ndb.metrics()['coalesced'] > 0
+
+
+def test_cache_storage():
+    netns = str(uuid.uuid4())
+    spec = {'target': 'localhost', 'kind': 'netns', 'netns': netns}
+    with NDB(sources=[spec], db_provider='sqlite3_cache') as ndb:
+        # the initial load doesn't fill the cache
+        assert ndb.schema.lookup('routes', {'RTA_OIF': 1}) is None
+        with ndb.interfaces['lo'] as lo:
+            lo.set(state='up')
+        with IPRoute(netns=netns) as ipr:
+            for host in range(1, 5):
+                ipr.route('add', dst=f'10.1.0.{host}/32', oif=1)
+            ipr.route('del', dst='10.1.0.4/32', oif=1)
+        ndb.routes.wait(dst='10.1.0.3', dst_len=32, timeout=5)
+        ndb.routes.wait(dst='10.1.0.4', dst_len=32, action='remove', timeout=5)
+        # the lookup is done in the cache
+        assert ndb.schema.lookup('routes', {'RTA_DST': '10.1.0.3'})
+        assert ndb.interfaces.exists('lo')
+        assert ndb.routes['10.1.0.2/32']['oif'] == 1
+        routes = ndb.task_manager.db_fetch(
+            'SELECT * FROM routes WHERE f_RTA_OIF = 1'
+        )
+        assert len(list(ndb.routes.getmany({'oif': 1}))) == len(list(routes))
+
+
+def records(rows):
+    # compare the dict tables with SQL up to the type affinity
+    return sorted(tuple(map(str, x)) for x in rows)
+
+
+def test_native_storage():
+    netns = str(uuid.uuid4())
+    spec = {'target': 'localhost', 'kind': 'netns', 'netns': netns}
+    with NDB(sources=[spec], db_provider='native') as ndb:
+        with ndb.interfaces['lo'] as lo:
+            lo.set(state='up')
+        with IPRoute(netns=netns) as ipr:
+            for host in range(1, 5):
+                ipr.route(
+                    'add',
+                    dst=f'10.1.0.{host}/32',
+                    oif=1,
+                    metrics={'mtu': 1300},
+                )
+            ipr.route('del', dst='10.1.0.4/32', oif=1)
+        # exists() uses only the dict tables, while the objects
+        # load the dependencies with SQL
+        for _ in range(50):
+            if ndb.routes.exists('10.1.0.3/32') and not ndb.routes.exists(
+                '10.1.0.4/32'
+            ):
+                break
+            time.sleep(0.1)
+        else:
+            raise TimeoutError('routes not loaded')
+        # the events are not written to SQL yet
+        assert ndb.schema.storage.dirty['routes']
+        assert ndb.routes['10.1.0.2/32']['metrics']['mtu'] == 1300
+        # SQL requests get the same records
+        routes = ndb.task_manager.db_fetch('SELECT * FROM routes')
+        assert len(list(ndb.routes.getmany({}))) == len(list(routes))
+        assert not ndb.schema.storage.dirty
+        # the interface removal cascades to the addresses and routes
+        with IPRoute(netns=netns) as ipr:
+            ipr.link('add', ifname='v0', kind='veth', peer='v1')
+            (index,) = ipr.link_lookup(ifname='v0')
+            ipr.addr('add', index=index, address='10.2.0.1', prefixlen=24)
+            ipr.link('set', index=index, state='up')
+            for host in range(1, 5):
+                ipr.route('add', dst=f'10.3.0.{host}/32', oif=index)
+        ndb.routes.wait(dst='10.3.0.4', dst_len=32, timeout=5)
+        with IPRoute(netns=netns) as ipr:
+            ipr.link('del', index=index)
+        for ifname in ('v0', 'v1'):
+            ndb.interfaces.wait(ifname=ifname, action='remove', timeout=5)
+        assert not ndb.addresses.exists({'index': index})
+        assert not ndb.routes.exists({'oif': index})
+        for table in ('interfaces', 'addresses', 'routes', 'metrics'):
+            sql = ndb.task_manager.db_fetch(f'SELECT * FROM {table}')
+            rows = ndb.task_manager.db_select(table, {})
+            assert records(rows) == records(sql)
+        assert ndb.routes.exists('10.1.0.3/32')
+
+
+@pytest.mark.parametrize('rtnl_debug', (False, True))
+def test_lookup_index(rtnl_debug):
+    spec = {'target': 'localhost', 'kind': 'netns', 'netns': str(uuid.uuid4())}
+    with NDB(sources=[spec], rtnl_debug=rtnl_debug) as ndb:
+        # declared indices
+        assert ndb.interfaces.explain('lo')['scans'] == []
+        assert ndb.routes.explain({'oif': 1})['scans'] == []
+        # automatic index
+        assert ndb.routes.explain({'proto': 2})['scans'] == ['routes']
+        for _ in range(AUTO_INDEX):
+            list(ndb.routes.getmany({'proto': 2}))
+        assert ndb.routes.explain({'proto': 2})['scans'] == []
@@ -8,7 +8,12 @@ pytestmark = [require_root()]
 tnl_matrix = make_test_matrix(
     targets=['local', 'netns'],
     types=['gre', 'ipip', 'sit'],
-    dbs=['sqlite3/:memory:', 'postgres/pr2test'],
+    dbs=[
+        'sqlite3/:memory:',
+        'sqlite3_cache/:memory:',
+        'native/:memory:',
+        'postgres/pr2test',
+    ],
 )
 
 
@@ -6,7 +6,13 @@ from pr2test.tools import neighbour_exists
 pytestmark = [require_root()]
 
 test_matrix = make_test_matrix(
-    targets=['local', 'netns'], dbs=['sqlite3/:memory:', 'postgres/pr2test']
+    targets=['local', 'netns'],
+    dbs=[
+        'sqlite3/:memory:',
+        'sqlite3_cache/:memory:',
+        'native/:memory:',
+        'postgres/pr2test',
+    ],
 )
 
 
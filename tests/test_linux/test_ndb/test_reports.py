@@ -184,3 +184,37 @@ def test_nested_ports(context):
     )
     # 1 port
     assert records == 2
+
+
+@pytest.mark.parametrize('context', test_matrix, indirect=True)
+def test_join(context):
+    context.ndb.interfaces['lo'].set('state', 'up').commit()
+    context.ndb.addresses.wait(address='127.0.0.1', timeout=10)
+    index = context.ndb.interfaces['lo']['index']
+
+    # SQL: both the record sets come from the DB
+    with context.ndb.addresses.dump() as dump:
+        dump.select_records(address='127.0.0.1')
+        dump = dump.join(
+            context.ndb.interfaces.dump(), on='index', prefix='i_'
+        )
+        assert dump.request is not None
+        records = list(dump)
+    assert len(records) == 1
+    assert records[0].i_ifname == 'lo'
+    assert records[0].index == records[0].i_index == index
+
+    # Python: the left record set is filtered with a callable
+    with context.ndb.addresses.dump() as dump:
+        dump.select_records(lambda x: x.address == '127.0.0.1')
+        dump = dump.join(
+            context.ndb.interfaces.dump(), on='index', prefix='i_'
+        )
+        assert dump.request is None
+        assert [tuple(x) for x in dump] == [tuple(x) for x in records]
+
+    # a pair of different field names
+    with context.ndb.routes.dump() as dump:
+        dump.select_records(lambda x: x.dst == '127.0.0.1')
+        dump = dump.join(context.ndb.interfaces.dump(), on=('oif', 'index'))
+        assert set([x.ifname for x in dump]) == set(('lo',))
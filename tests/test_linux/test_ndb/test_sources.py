@@ -5,6 +5,7 @@ from pr2test.tools import interface_exists
 from utils import require_user
 
 from pyroute2 import NDB
+from pyroute2.netlink.rtnl import RTM_NEWLINK
 
 pytestmark = [require_root()]
 test_matrix = make_test_matrix(
@@ -154,6 +155,73 @@ def test_source_netns_restart(context):
     # as interfaces inside the netns
 
 
+@pytest.mark.parametrize('context', test_matrix, indirect=True)
+def test_source_resync(context):
+    '''
+    On reconnect the dump must be compared with the DB, and only
+    the difference must be loaded
+    '''
+    require_user('root')
+    ifname = context.new_ifname
+    ndb = context.ndb
+    source = ndb.sources['localhost']
+
+    (ndb.interfaces.create(ifname=ifname, kind='dummy', state='up').commit())
+    #
+    # make the DB out of sync
+    ndb.task_manager.db_fetchone(
+        'DELETE FROM interfaces WHERE f_target = %s AND f_IFLA_IFNAME = %s'
+        % (ndb.schema.plch, ndb.schema.plch),
+        ('localhost', ifname),
+    )
+    assert ifname not in ndb.interfaces
+    #
+    # only the missing interface must be reported, and nothing
+    # must be removed
+    events = ndb.task_manager.db_resync(
+        'localhost', [source.fake_zero_if()] + list(source.api('dump'))
+    )
+    assert [
+        x.get('ifname') for x in events if x['header']['type'] == RTM_NEWLINK
+    ] == [ifname]
+    assert all([x['header']['type'] % 2 == 0 for x in events])
+    #
+    # the source restart loads the difference
+    source.restart(reason='test')
+    assert ifname in ndb.interfaces
+    ndb.interfaces[ifname].remove().commit()
+
+
+def test_source_update(context):
+    '''
+    Records loaded again must be updated in place
+    '''
+    require_user('root')
+    ifname = context.new_ifname
+    ndb = context.ndb
+    count = 'SELECT count(*) FROM interfaces WHERE f_target = %s' % (
+        ndb.schema.plch
+    )
+
+    (ndb.interfaces.create(ifname=ifname, kind='dummy', mtu=1280).commit())
+    total = ndb.task_manager.db_fetchone(count, ('localhost',))[0]
+    #
+    # make the record stale
+    ndb.task_manager.db_fetchone(
+        'UPDATE interfaces SET f_IFLA_MTU = 1 '
+        'WHERE f_target = %s AND f_IFLA_IFNAME = %s'
+        % (ndb.schema.plch, ndb.schema.plch),
+        ('localhost', ifname),
+    )
+    assert ndb.interfaces[ifname]['mtu'] == 1
+    #
+    # the reload updates the record and adds no new ones
+    ndb.sources['localhost'].restart(reason='test')
+    assert ndb.interfaces[ifname]['mtu'] == 1280
+    assert ndb.task_manager.db_fetchone(count, ('localhost',))[0] == total
+    ndb.interfaces[ifname].remove().commit()
+
+
 def count_interfaces(ndb, target):
     return (
         ndb.task_manager.db_fetchone(
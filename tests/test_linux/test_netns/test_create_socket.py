@@ -0,0 +1,92 @@
+import os
+import select
+import socket
+import threading
+import uuid
+
+import pytest
+from pr2test.marks import require_root
+
+from pyroute2 import IPRoute, netns
+
+pytestmark = [require_root()]
+
+
+@pytest.fixture
+def nsname():
+    name = str(uuid.uuid4())
+    netns.create(name)
+    yield name
+    netns.remove(name)
+
+
+def test_helper_reuse(nsname):
+    helper = netns._get_helper()
+    sockets = [
+        netns.create_socket(nsname, socket.AF_NETLINK, socket.SOCK_DGRAM, 0),
+        netns.create_socket(nsname, socket.AF_INET, socket.SOCK_STREAM, 0),
+        netns.create_socket(nsname, socket.AF_INET6, socket.SOCK_DGRAM, 0),
+    ]
+    pid = helper.proc.pid
+    assert netns._get_helper() is helper
+    for sock in sockets:
+        sock.close()
+    with IPRoute(netns=nsname) as ipr:
+        assert [x.get('ifname') for x in ipr.get_links()] == ['lo']
+    assert helper.proc.pid == pid
+
+
+def test_helper_threads(nsname):
+    errors = []
+
+    def create():
+        try:
+            for _ in range(16):
+                netns.create_socket(nsname).close()
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=create) for _ in range(8)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert errors == []
+
+
+def test_helper_restart(nsname):
+    netns.create_socket(nsname).close()
+    helper = netns._get_helper()
+    pid = helper.proc.pid
+    os.kill(pid, 9)
+    netns.create_socket(nsname).close()
+    assert helper.proc.pid != pid
+    netns.stop_helper()
+    assert helper.proc is None
+    netns.create_socket(nsname).close()
+    assert helper.proc is not None
+
+
+def test_helper_errors(nsname):
+    with pytest.raises(OSError):
+        netns.create_socket(str(uuid.uuid4()), flags=0)
+    # the helper survives errors
+    netns.create_socket(nsname, flags=0).close()
+
+
+def test_helper_fds(nsname):
+    netns.stop_helper()
+    r, w = os.pipe()
+    try:
+        # the helper is started with the pipe open
+        netns.create_socket(nsname).close()
+        os.close(w)
+        w = None
+        # the helper must not keep the write end
+        rl, _, _ = select.select([r], [], [], 5)
+        assert rl
+        assert os.read(r, 1) == b''
+    finally:
+        os.close(r)
+        if w is not None:
+            os.close(w)
@@ -0,0 +1,66 @@
+import uuid
+
+import pytest
+from pr2test.marks import require_root
+
+from pyroute2 import IPRoute, netns
+from pyroute2.netns.manager import NetNSManager
+
+pytestmark = [require_root()]
+
+
+@pytest.fixture
+def manager():
+    ret = NetNSManager()
+    ret.bind()
+    yield ret
+    ret.close()
+
+
+@pytest.fixture
+def nsname():
+    name = str(uuid.uuid4())
+    netns.create(name)
+    yield name
+    netns.remove(name)
+
+
+def test_events(manager):
+    nsname = str(uuid.uuid4())
+    path = f'{netns.NETNS_RUN_DIR}/{nsname}'
+    netns.create(nsname)
+    events = [(x['event'], x.get_attr('NSINFO_PATH')) for x in manager.get()]
+    assert ('RTM_NEWNETNS', path) in events
+    assert path in manager.registry
+    netns.remove(nsname)
+    events = [(x['event'], x.get_attr('NSINFO_PATH')) for x in manager.get()]
+    assert ('RTM_DELNETNS', path) in events
+    assert path not in manager.registry
+
+
+def test_peers(manager, nsname):
+    ifname = f'v{uuid.uuid4().hex[:8]}'
+    with IPRoute() as ipr:
+        ipr.link(
+            'add',
+            ifname=ifname,
+            kind='veth',
+            peer={'ifname': 'eth0', 'net_ns_fd': nsname},
+        )
+        try:
+            (info,) = manager.netns('get', path=nsname)
+            assert info['netnsid'] != 0xFFFFFFFF
+            assert info.get_attrs('NSINFO_PEER') == [ifname]
+            # the peers index follows link events
+            assert manager.links[ipr.link_lookup(ifname=ifname)[0]] == (
+                info['netnsid']
+            )
+        finally:
+            ipr.link('del', ifname=ifname)
+    (info,) = manager.netns('get', path=nsname)
+    assert info.get_attrs('NSINFO_PEER') == []
+
+
+def test_dump(manager, nsname):
+    paths = [x.get_attr('NSINFO_PATH') for x in manager.dump()]
+    assert f'{netns.NETNS_RUN_DIR}/{nsname}' in paths
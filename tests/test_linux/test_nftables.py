@@ -0,0 +1,147 @@
+import errno
+from uuid import uuid4
+
+import pytest
+from pr2test.marks import require_root
+
+from pyroute2.netlink import NLM_F_APPEND, NLM_F_CREATE
+from pyroute2.netlink.exceptions import NetlinkError
+from pyroute2.netlink.nfnetlink.nftsocket import (
+    NFT_MSG_NEWRULE,
+    NFT_MSG_NEWTABLE,
+    nft_rule_msg,
+    nft_table_msg,
+)
+from pyroute2.nftables.expressions import ipv4addr, verdict
+from pyroute2.nftables.main import NFTables, NFTSet
+
+pytestmark = [require_root()]
+
+
+@pytest.fixture
+def nft():
+    sock = NFTables(nfgen_family=2)
+    yield sock
+    sock.close()
+
+
+@pytest.fixture
+def table(nft):
+    name = str(uuid4())[:16]
+    nft.table('add', name=name)
+    nft.chain('add', table=name, name='c0', hook='input', policy=1)
+    yield name
+    nft.table('del', name=name)
+
+
+def rule_msg(table, idx, chain='c0'):
+    expressions = []
+    for expression in (
+        ipv4addr(src='10.%i.%i.0/24' % (idx >> 8, idx & 0xFF)),
+        verdict(code=1),
+    ):
+        expressions.extend(expression)
+    msg = nft_rule_msg()
+    msg['attrs'] = [
+        ['NFTA_RULE_TABLE', table],
+        ['NFTA_RULE_CHAIN', chain],
+        ['NFTA_RULE_EXPRESSIONS', expressions],
+    ]
+    return msg
+
+
+def count_rules(nft, table):
+    return len(
+        [x for x in nft.get_rules() if x.get_attr('NFTA_RULE_TABLE') == table]
+    )
+
+
+def test_table_create(nft, table):
+    assert table in [x.get_attr('NFTA_TABLE_NAME') for x in nft.get_tables()]
+    with pytest.raises(NetlinkError) as e:
+        nft.table('create', name=table)
+    assert e.value.code == errno.EEXIST
+
+
+def test_transaction(nft, table):
+    tx = nft.transaction(page_size=4096)
+    for idx in range(1000):
+        tx.put(rule_msg(table, idx), NFT_MSG_NEWRULE, NLM_F_CREATE)
+    assert len(tx) == 1000
+    assert len(tx.pages) > 1
+    ret = tx.commit()
+    assert [x[1] for x in ret] == [None] * 1000
+    assert count_rules(nft, table) == 1000
+
+
+def test_transaction_errors(nft, table):
+    tx = nft.transaction()
+    for idx in range(10):
+        chain = 'nochain' if idx in (3, 7) else 'c0'
+        tx.put(
+            rule_msg(table, idx, chain),
+            NFT_MSG_NEWRULE,
+            NLM_F_CREATE | NLM_F_APPEND,
+        )
+    errors = [x[1] for x in tx.commit()]
+    assert [x for x, y in enumerate(errors) if y is not None] == [3, 7]
+    assert errors[3].code == errors[7].code == errno.ENOENT
+    # the whole transaction is aborted
+    assert count_rules(nft, table) == 0
+
+
+def test_transaction_empty(nft):
+    assert nft.transaction().commit() == []
+
+
+def test_begin_commit(nft, table):
+    nft.begin()
+    msg = nft_table_msg()
+    msg['attrs'] = [['NFTA_TABLE_NAME', table]]
+    nft.request_put(msg, NFT_MSG_NEWTABLE, NLM_F_CREATE)
+    for idx in range(3):
+        nft.request_put(rule_msg(table, idx), NFT_MSG_NEWRULE, NLM_F_CREATE)
+    nft.commit()
+    assert count_rules(nft, table) == 3
+    nft.begin()
+    nft.request_put(
+        rule_msg(table, 0, 'nochain'), NFT_MSG_NEWRULE, NLM_F_CREATE
+    )
+    with pytest.raises(NetlinkError):
+        nft.commit()
+
+
+def test_set_cache(nft, table):
+    nft.sets('add', table=table, name='s0', key_type='ipv4_addr')
+    nft.set_elems('add', table=table, set='s0', elements=['10.0.0.1'])
+    key = (2, table, 's0')
+    assert nft.set_cache.sets[key].key_type == 'ipv4_addr'
+    # the set is redefined by another socket
+    with NFTables(nfgen_family=2, set_cache=False) as other:
+        other.sets('del', table=table, name='s0')
+        other.sets('add', table=table, name='s0', key_type='ipv6_addr')
+    nft.set_elems('add', table=table, set='s0', elements=['fc00::1'])
+    assert nft.set_cache.sets[key].key_type == 'ipv6_addr'
+    assert {x.value for x in nft.set_elems('get', table=table, set='s0')} == {
+        'fc00::1'
+    }
+
+
+def test_set_elems_bulk(nft, table):
+    nft.sets('add', set=NFTSet(table=table, name='s0', key_type='ipv4_addr'))
+    elements = ['10.1.%i.%i' % (x >> 8, x & 0xFF) for x in range(3000)]
+    nft.set_elems_bulk(
+        'add', table=table, set='s0', elements=iter(elements), chunk_size=1000
+    )
+    ret = nft.set_elems('get', table=table, set='s0')
+    assert {x.value for x in ret} == set(elements)
+    nft.set_elems_bulk('del', table=table, set='s0', elements=elements[1:])
+    ret = nft.set_elems('get', table=table, set='s0')
+    assert {x.value for x in ret} == set(elements[:1])
+    with pytest.raises(NetlinkError) as e:
+        nft.set_elems_bulk(
+            'del', table=table, set='s0', elements=['10.2.0.1', '10.1.0.0']
+        )
+    assert e.value.code == errno.ENOENT
+    # the transaction is aborted
+    assert len(nft.set_elems('get', table=table, set='s0')) == 1
@@ -360,3 +360,22 @@ def test_wildcard_entries(ipset_name):
 
 def test_invalid_load_ipset():
     assert load_ipset("ipsetdoesnotexists") is None
+
+
+def test_insert_delete_list(ipset_name, wiset_sock):
+    entries = ["10.0.%i.%i" % (x >> 8, x & 0xFF) for x in range(1000)]
+    myset = WiSet(name=ipset_name, sock=wiset_sock, counters=True)
+    myset.create()
+    myset.insert_list(entries)
+    myset.update_content()
+    assert set(myset.content) == set(entries)
+    assert myset.test_list(entries + ["192.0.2.1"]) == set(entries)
+    try:
+        myset.insert_list(["192.0.2.1", entries[0], "192.0.2.2"])
+    except IPSetError:
+        pass
+    else:
+        raise AssertionError("duplicate entry must fail")
+    myset.delete_list(entries)
+    myset.update_content()
+    assert set(myset.content) == set(["192.0.2.1", "192.0.2.2"])
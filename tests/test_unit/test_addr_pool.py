@@ -1,6 +1,6 @@
 import pytest
 
-from pyroute2.common import AddrPool
+from pyroute2.common import AddrPool, SeqPool
 
 
 def test_alloc_aligned():
@@ -52,3 +52,58 @@ def test_locate():
     assert bit2 == bit1 + 1
     assert is_allocated1
     assert not is_allocated2
+
+
+def test_seq_alloc():
+    sp = SeqPool(minaddr=1, maxaddr=1024)
+    assert sorted(sp.alloc() for _ in range(1024)) == list(range(1, 1025))
+    with pytest.raises(KeyError):
+        sp.alloc()
+
+
+def test_seq_free():
+    sp = SeqPool(minaddr=1, maxaddr=2)
+    f = sp.alloc()
+    sp.alloc()
+    sp.free(f)
+    assert sp.alloc() == f
+    with pytest.raises(KeyError):
+        sp.free(3)
+    # not tracked numbers are ignored on release with ban
+    sp.free(3, ban=0xFF)
+
+
+def test_seq_ban():
+    sp = SeqPool(minaddr=1, maxaddr=1024)
+    f = sp.alloc()
+    sp.free(f, ban=10)
+    allocated = [sp.alloc() for _ in range(10)]
+    assert f not in allocated
+    assert sp.alloc() == f
+
+
+def test_seq_quarantine():
+    sp = SeqPool(minaddr=1, maxaddr=2, quarantine=3600)
+    f = sp.alloc()
+    sp.free(f)
+    sp.alloc()
+    with pytest.raises(KeyError):
+        sp.alloc()
+
+
+def test_seq_reuse():
+    sp = SeqPool(minaddr=0xFF, maxaddr=0xFFFFFFFF)
+    seen = set()
+    for _ in range(1000):
+        f = sp.alloc()
+        seen.add(f)
+        sp.free(f, ban=0xFF)
+    # every number is reused after 0xFF other allocations
+    assert len(seen) == 0x100
+
+
+def test_seq_32bit():
+    sp = SeqPool(minaddr=0xFF, maxaddr=0xFFFFFFFF)
+    for _ in range(0x10000):
+        sp.alloc()
+    assert sp.alloc() > 0xFFFF
@@ -59,3 +59,66 @@ def test_context_manager(mode, size, page_size):
             assert buffer.mode == mode
     except ModuleNotFoundError:
         pytest.skip(f'buffer mode "{mode}" not supported')
+
+
+@pytest.mark.parametrize(*buffer_settings)
+def test_free_list(mode, size, page_size):
+    try:
+        buffer = Buffer(mode, size, page_size)
+    except ModuleNotFoundError:
+        pytest.skip(f'buffer mode "{mode}" not supported')
+    page0 = buffer.get_free_page()
+    page1 = buffer.get_free_page()
+    assert page0.offset == 0
+    assert page1.offset == page_size
+    assert len(buffer.free_list) == size // page_size - 2
+    page0.free()
+    page0.free()
+    assert len(buffer.free_list) == size // page_size - 1
+    assert buffer.get_free_page() is page0
+    buffer.close()
+
+
+def test_page_chunks():
+    buffer = Buffer('internal', 1024, 256)
+    page = buffer.get_free_page()
+    page.tail[:4] = b'\x01\x02\x03\x04'
+    chunk0 = page.slice(2)
+    chunk1 = page.slice(2)
+    assert bytes(chunk0) == b'\x01\x02'
+    assert bytes(chunk1) == b'\x03\x04'
+    assert chunk0.readonly
+    assert len(page.tail) == 252
+    # the page is not released while it is in use
+    del chunk0
+    del chunk1
+    assert not page.is_free
+    chunk2 = page.slice(8)
+    page.retire()
+    assert not page.is_free
+    # ... and when the last chunk is gone
+    del chunk2
+    assert page.is_free
+    assert buffer.free_list[-1] is page
+    buffer.close()
+
+
+def test_page_chunk_slices():
+    buffer = Buffer('internal', 1024, 256)
+    page = buffer.get_free_page()
+    page.tail[:4] = b'AAAA'
+    chunk = page.slice(4)
+    data = chunk[0:4]
+    del chunk
+    page.retire()
+    # the slice still refers the page memory
+    assert not page.is_free
+    assert buffer.get_free_page() is not page
+    assert bytes(data) == b'AAAA'
+    del data
+    assert page.is_free
+    # reuse the page
+    assert buffer.get_free_page() is page
+    page.tail[:4] = b'BBBB'
+    assert bytes(page.slice(4)) == b'BBBB'
+    buffer.close()
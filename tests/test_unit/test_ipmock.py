@@ -0,0 +1,137 @@
+import asyncio
+import errno
+import struct
+
+import pytest
+
+from pyroute2 import IPRoute
+from pyroute2.iproute.ipmock import IPEngine, generate, presets
+from pyroute2.netlink import NLM_F_ACK, NLM_F_CREATE, NLM_F_REQUEST
+from pyroute2.netlink.exceptions import NetlinkError
+from pyroute2.netlink.nlsocket import NetlinkPipeline
+from pyroute2.netlink.rtnl import RTM_NEWROUTE
+from pyroute2.netlink.rtnl.rtmsg import rtmsg
+
+
+@pytest.fixture
+def bench():
+    presets['test_bench'] = generate(
+        links=4, addresses=16, routes=256, neighbours=32, rules=8
+    )
+    yield 'test_bench'
+    presets.pop('test_bench')
+
+
+def test_generate(bench):
+    with IPRoute(use_socket=IPEngine(netns=bench, dump_size=1024)) as ipr:
+        links = [x.get('ifname') for x in ipr.link('dump')]
+        assert links == ['lo', 'eth0', 'mock3', 'mock4', 'mock5', 'mock6']
+        assert len(ipr.addr('dump')) == 2 + 16
+        assert len(ipr.route('dump')) == 7 + 256
+        assert len(ipr.neigh('dump')) == 1 + 32
+        assert len(ipr.rule('dump')) == 3 + 8
+
+
+def test_route_get(bench):
+    with IPRoute(use_socket=IPEngine(netns=bench)) as ipr:
+        (route, _) = ipr.route('get', dst='10.0.0.5')
+        assert route.get('dst') == '10.0.0.5'
+        assert route.get('oif') == 4
+        (route, _) = ipr.route('get', dst='192.168.122.100')
+        assert route.get('oif') == 2
+
+
+def test_dellink_cascade(bench):
+    with IPRoute(use_socket=IPEngine(netns=bench)) as ipr:
+        ipr.link('del', index=3)
+        assert not ipr.link('get', index=3)[:-1]
+        assert all(x.get('index') != 3 for x in ipr.addr('dump'))
+        assert all(x.get('oif') != 3 for x in ipr.route('dump'))
+        assert all(x.get('ifindex') != 3 for x in ipr.neigh('dump'))
+
+
+def test_get_no_messages(bench):
+    with IPRoute(use_socket=IPEngine(netns=bench)) as ipr:
+        sock = ipr.asyncore
+        sock.msg_queue.ensure_tag(1024)
+        # zero length header, nothing to parse
+        sock.msg_queue.put_nowait(1024, bytes(16))
+
+        async def get():
+            return [x async for x in sock.get(msg_seq=1024)]
+
+        # must not wait for the next buffer
+        ret = ipr.event_loop.run_until_complete(
+            asyncio.wait_for(get(), timeout=1)
+        )
+        assert ret == []
+        sock.msg_queue.free_tag(1024)
+
+
+def test_neigh_rule():
+    with IPRoute(use_socket=IPEngine(netns='test_neigh_rule')) as ipr:
+        ipr.neigh(
+            'add', dst='127.0.0.2', lladdr='00:11:22:33:44:55', ifindex=1
+        )
+        with pytest.raises(NetlinkError) as e:
+            ipr.neigh(
+                'add', dst='127.0.0.2', lladdr='00:11:22:33:44:55', ifindex=1
+            )
+        assert e.value.code == errno.EEXIST
+        assert [x.get('dst') for x in ipr.neigh('dump')] == ['127.0.0.2']
+        ipr.neigh('del', dst='127.0.0.2', ifindex=1)
+        assert not ipr.neigh('dump')
+        ipr.rule('add', table=10, priority=100)
+        assert 100 in [x.get('priority') for x in ipr.rule('dump')]
+        ipr.rule('del', table=10, priority=100)
+        assert 100 not in [x.get('priority') for x in ipr.rule('dump')]
+    presets.pop('test_neigh_rule')
+
+
+def test_route_gateway():
+    with IPRoute(use_socket=IPEngine()) as ipr:
+        ipr.route('add', dst='10.7.0.0/24', gateway='192.168.122.1')
+        (route,) = ipr.route('dump', dst='10.7.0.0')
+        assert route.get('oif') == 2
+        ipr.route('del', dst='10.7.0.0/24', gateway='192.168.122.1')
+        assert not ipr.route('dump', dst='10.7.0.0')
+
+
+def test_pipeline_flags():
+    with IPRoute(use_socket=IPEngine()) as ipr:
+        msg = rtmsg()
+        msg['family'] = 2
+        msg['dst_len'] = 24
+        msg['attrs'] = [('RTA_DST', '10.8.0.0'), ('RTA_OIF', 2)]
+        msg.encode()
+        buffer = bytearray(msg.data)
+        # no NLM_F_REQUEST in the source flags
+        struct.pack_into('HH', buffer, 4, RTM_NEWROUTE, NLM_F_CREATE)
+        pipeline = NetlinkPipeline(ipr.asyncore)
+
+        async def load():
+            await pipeline.put(bytes(buffer), RTM_NEWROUTE, NLM_F_CREATE)
+            ret = struct.unpack_from('H', pipeline.buffer, 6)[0]
+            await pipeline.put_encoded(buffer, 0)
+            return ret
+
+        flags = NLM_F_REQUEST | NLM_F_ACK | NLM_F_CREATE
+        assert ipr.event_loop.run_until_complete(load()) == flags
+        assert struct.unpack_from('H', buffer, 6)[0] == flags
+        assert len(ipr.event_loop.run_until_complete(pipeline.finish())) == 2
+
+
+def test_storm():
+    ipe = IPEngine()
+    with IPRoute(use_socket=ipe) as ipr:
+        ipr.bind()
+        # the first message is the route sent on bind()
+        ipr.get()
+        ipe.storm(100, kind='route', size=10, batch=4)
+        events = []
+        while len(events) < 100:
+            events.extend(ipr.get())
+        assert [x['event'] for x in events[:10]] == ['RTM_NEWROUTE'] * 10
+        assert [x['event'] for x in events[10:20]] == ['RTM_DELROUTE'] * 10
+        assert events[0].get('dst') == events[10].get('dst')
+        assert len(ipr.route('dump')) == 7
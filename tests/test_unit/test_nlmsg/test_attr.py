@@ -1,6 +1,15 @@
 import pytest
 
-from pyroute2.netlink import nlmsg
+from pyroute2.netlink import (
+    NLA_F_NESTED,
+    NLA_F_NET_BYTEORDER,
+    nla_encode,
+    nla_iter,
+    nla_types,
+    nlmsg,
+    nlmsg_iter,
+)
+from pyroute2.netlink.nfnetlink.nfctsocket import nfct_msg
 
 prime = {
     'attrs': (
@@ -34,3 +43,53 @@ def test_get_nested(msg):
     assert msg.get_nested('B', 'D', 'F') == 7
     assert msg.get_nested('B', 'D', 'G') is None
     assert msg.get_nested('C', 'D', 'E') is None
+
+
+def test_nla_map_subclass():
+    class parent(nlmsg):
+        nla_map = (('PARENT_UNSPEC', 'none'), ('PARENT_VALUE', 'uint32'))
+
+    # compile the parent table first
+    parent()
+
+    class child(parent):
+        nla_map = (('CHILD_UNSPEC', 'none'), ('CHILD_NAME', 'asciiz'))
+
+    msg = child()
+    msg['attrs'] = [['CHILD_NAME', 'test']]
+    msg.encode()
+    ret = child(msg.data)
+    ret.decode()
+    assert ret.get_attr('CHILD_NAME') == 'test'
+
+
+def test_nla_raw():
+    data = (
+        nla_encode(1, b'\x01')
+        + nla_encode(2 | NLA_F_NESTED, nla_encode(3, b'\x02\x03\x04\x05'))
+        + nla_encode(4 | NLA_F_NET_BYTEORDER, b'')
+    )
+    assert len(data) == 8 + 12 + 4
+    ret = list(nla_iter(data, 0, len(data)))
+    assert [x[0] for x in ret] == [1, 2, 4]
+    assert data[ret[0][1] : ret[0][2]] == b'\x01'
+    assert list(nla_iter(data, ret[1][1], ret[1][2])) == [(3, 16, 20)]
+    # a broken header stops the iteration
+    assert list(nla_iter(bytes(8), 0, 8)) == []
+
+
+def test_nlmsg_raw():
+    msg = nlmsg()
+    msg['header']['type'] = 16
+    msg['header']['sequence_number'] = 42
+    msg.encode()
+    data = msg.data * 2
+    assert list(nlmsg_iter(data)) == [(0, 16, 16, 0, 42), (16, 16, 16, 0, 42)]
+    assert list(nlmsg_iter(bytes(16))) == []
+
+
+def test_nla_types():
+    types = nla_types(nfct_msg.nla_map)
+    assert types['CTA_ID'] == 12
+    assert types['CTA_ZONE'] == 18
+    assert nfct_msg.nla_map[types['CTA_TIMEOUT']][0] == 'CTA_TIMEOUT'
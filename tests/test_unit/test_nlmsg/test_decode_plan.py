@@ -0,0 +1,153 @@
+import struct
+
+import pytest
+
+from pyroute2.inotify.inotify_msg import inotify_msg
+from pyroute2.netlink import DecodePlan, nla, nla_struct, nlmsg
+from pyroute2.netlink.rtnl.ifinfmsg import ifinfmsg
+from pyroute2.netlink.rtnl.rtmsg import rtmsg
+
+
+def test_merge_runs():
+    runs = DecodePlan.compile_runs(
+        (('a', 'B'), ('b', 'B'), ('c', 'H'), ('d', 'I'))
+    )
+    assert len(runs) == 1
+    unpack_from, names, spans, size = runs[0]
+    assert names == ('a', 'b', 'c', 'd')
+    assert spans is None
+    assert size == 8
+
+
+def test_split_on_alignment():
+    # 'BI' in the native mode would add 3 bytes of padding
+    runs = DecodePlan.compile_runs((('a', 'B'), ('b', 'I')))
+    assert len(runs) == 2
+    assert sum(x[3] for x in runs) == 5
+
+
+def test_split_on_byte_order():
+    runs = DecodePlan.compile_runs((('a', 'H'), ('b', '>H'), ('c', '>H')))
+    assert [x[1] for x in runs] == [('a',), ('b', 'c')]
+
+
+def test_unpack_spans():
+    runs = DecodePlan.compile_runs(
+        (('a', 'B'), ('__pad', '3x'), ('b', 'II'), ('c', '4s'))
+    )
+    data = struct.pack('B3xII4s', 1, 2, 3, b'test')
+    target = {}
+    offset = DecodePlan.unpack(runs, data, 0, target)
+    assert offset == len(data)
+    assert target == {'a': 1, '__pad': (), 'b': (2, 3), 'c': b'test'}
+
+
+def test_variant():
+    plan = rtmsg().decode_plan()
+    assert rtmsg().decode_plan() is plan
+    header = (('length', 'I'),)
+    variant = plan.variant(header, rtmsg.fields)
+    assert variant is not plan
+    assert variant.header is header
+    assert plan.variant(header, rtmsg.fields) is variant
+
+
+class custom_msg(nlmsg):
+    fields = (
+        ('family', 'B'),
+        ('__pad', '3x'),
+        ('index', 'i'),
+        ('mac', '6s'),
+        ('port', '>H'),
+    )
+    nla_map = (
+        ('CUSTOM_UNSPEC', 'none'),
+        ('CUSTOM_NAME', 'asciiz'),
+        ('CUSTOM_PAIR', 'pair'),
+        ('CUSTOM_NEST', 'nest'),
+    )
+
+    class pair(nla_struct):
+        fields = (('first', 'H'), ('_pad', '2x'), ('second', 'I'))
+
+    class nest(nla):
+        nla_map = (('NEST_UNSPEC', 'none'), ('NEST_VALUE', 'uint32'))
+
+
+@pytest.mark.parametrize(
+    'msg_class,spec',
+    (
+        (
+            rtmsg,
+            {
+                'family': 2,
+                'dst_len': 24,
+                'table': 254,
+                'proto': 4,
+                'type': 1,
+                'attrs': [
+                    ('RTA_DST', '10.0.0.0'),
+                    ('RTA_GATEWAY', '192.168.0.1'),
+                    ('RTA_OIF', 2),
+                ],
+            },
+        ),
+        (
+            ifinfmsg,
+            {
+                'index': 3,
+                'flags': 1,
+                'attrs': [('IFLA_IFNAME', 'eth0'), ('IFLA_MTU', 1500)],
+            },
+        ),
+        (
+            custom_msg,
+            {
+                'family': 10,
+                'index': -1,
+                'mac': b'\x00\x11\x22\x33\x44\x55',
+                'port': 8080,
+                'attrs': [
+                    ('CUSTOM_NAME', 'test'),
+                    ('CUSTOM_PAIR', {'first': 1, 'second': 2}),
+                    ('CUSTOM_NEST', {'attrs': [('NEST_VALUE', 42)]}),
+                ],
+            },
+        ),
+    ),
+)
+def test_roundtrip(msg_class, spec):
+    msg = msg_class()
+    msg.load(spec)
+    msg['header']['sequence_number'] = 42
+    msg.encode()
+    ret = msg_class(msg.data)
+    ret.decode()
+    assert ret['header']['length'] == len(msg.data)
+    assert ret['header']['sequence_number'] == 42
+    for key, value in spec.items():
+        if key == 'attrs':
+            for name, nla_value in value:
+                if isinstance(nla_value, dict) and 'attrs' in nla_value:
+                    for sub_name, sub_value in nla_value['attrs']:
+                        assert (
+                            ret.get_attr(name).get_attr(sub_name) == sub_value
+                        )
+                elif isinstance(nla_value, dict):
+                    for sub_name, sub_value in nla_value.items():
+                        assert ret.get_attr(name)[sub_name] == sub_value
+                else:
+                    assert ret.get_attr(name) == nla_value
+        else:
+            assert ret[key] == value
+
+
+def test_no_header():
+    data = struct.pack('iIII', 1, 0x100, 0, 8) + b'test\0\0\0\0'
+    msg = inotify_msg(data)
+    msg.decode()
+    assert 'header' not in msg
+    assert msg['wd'] == 1
+    assert msg['mask'] == 0x100
+    assert msg['name'] == 'test'
+    assert msg.length == 24
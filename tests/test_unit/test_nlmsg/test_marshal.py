@@ -1,12 +1,14 @@
 # required by iw_scan_rsp.dump
 import datetime  # noqa: F401
+import gc
 import json
 import struct
+import weakref
 
 import pytest
 
 from pyroute2.common import load_dump
-from pyroute2.netlink import NLMSG_ERROR
+from pyroute2.netlink import NLMSG_ERROR, nla_slot_lazy
 from pyroute2.netlink.nl80211 import MarshalNl80211
 from pyroute2.netlink.rtnl import RTM_NEWADDR, RTM_NEWLINK
 from pyroute2.netlink.rtnl.iprsocket import MarshalRtnl
@@ -144,3 +146,91 @@ def test_custom_parser(sample, parser, parser_id, msg_seq, msg_type):
     for msg in marshal.parse(data):
         assert msg['parser'] == parser_id
         assert msg['header']['type'] in msg_type
+
+
+@pytest.mark.parametrize(
+    'sample,marshal',
+    (
+        ('test_unit/test_nlmsg/addrmsg_ipv4.dump', MarshalRtnl()),
+        ('test_unit/test_nlmsg/gre_01.dump', MarshalRtnl()),
+        ('test_unit/test_nlmsg/iw_info_rsp.dump', MarshalNl80211()),
+        ('test_unit/test_nlmsg/iw_scan_rsp.dump', MarshalNl80211()),
+    ),
+)
+def test_lazy_decode(sample, marshal):
+    marshal.lazy_decode = True
+    return run_using_marshal(sample, marshal)
+
+
+def test_lazy_decode_on_access():
+    marshal = MarshalRtnl()
+    marshal.lazy_decode = True
+    messages, data = load_sample('test_unit/test_nlmsg/gre_01.dump')
+    for msg in marshal.parse(data):
+        if msg['header']['type'] != RTM_NEWLINK:
+            continue
+        slots = msg['attrs']
+        assert all(isinstance(x, nla_slot_lazy) for x in slots)
+        # names are available without decoding
+        assert all(x._spec is not None for x in slots if x[0])
+        ifname = msg.get('ifname')
+        assert isinstance(ifname, str)
+        for slot in slots:
+            # only the touched NLA is decoded
+            assert (slot._spec is None) == (slot[0] == 'IFLA_IFNAME')
+        # nested NLAs are lazy as well
+        linkinfo = msg.get_attr('IFLA_LINKINFO')
+        assert linkinfo._nla_lazy
+        assert msg.get(('linkinfo', 'kind')) == 'gre'
+
+
+def test_lazy_decode_parent_dropped():
+    messages, data = load_sample('test_unit/test_nlmsg/gre_01.dump')
+    expected = [
+        msg.get('ifname')
+        for msg in MarshalRtnl().parse(data)
+        if msg['header']['type'] == RTM_NEWLINK
+    ]
+    marshal = MarshalRtnl()
+    marshal.lazy_decode = True
+    attrs = [
+        msg['attrs']
+        for msg in marshal.parse(data)
+        if msg['header']['type'] == RTM_NEWLINK
+    ]
+    # the messages are not referenced anymore
+    gc.collect()
+    for slots, ifname in zip(attrs, expected):
+        (slot,) = [x for x in slots if x[0] == 'IFLA_IFNAME']
+        assert slot[1] == ifname
+        assert isinstance(ifname, str)
+
+
+@pytest.mark.parametrize(
+    'sample',
+    (
+        'test_unit/test_nlmsg/addrmsg_ipv4.dump',
+        'test_unit/test_nlmsg/gre_01.dump',
+    ),
+)
+def test_lazy_decode_refcount(sample):
+    messages, data = load_sample(sample)
+    marshal = MarshalRtnl()
+    marshal.lazy_decode = True
+    gc.disable()
+    try:
+        refs = []
+        values = []
+        for msg in marshal.parse(data):
+            refs.append(weakref.ref(msg))
+            values.append(msg['attrs'])
+            # decode some NLA, but not all of them
+            msg.get_attr(msg['attrs'][-1][0])
+        del msg
+        # freed by the reference counting, no cycles
+        assert refs
+        assert all(ref() is None for ref in refs)
+    finally:
+        gc.enable()
+    expected = [msg['attrs'] for msg in MarshalRtnl().parse(data)]
+    assert repr(values) == repr(expected)